@@ -0,0 +1,244 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from components import exceptions, shared_state, jobs
+
+def request_cost(tables_spec):
+    """
+    Return the cost of generating the given tables_spec, in cells (ie. the
+    number of records multiplied by the number of fields, summed over every
+    table).
+    """
+
+    return sum(
+        table_spec["settings"]["numRecords"] * len(table_spec["fields"])
+        for table_spec in tables_spec)
+
+class AdmissionController:
+    """
+    A concurrency limiter with a bounded queue and row budgets.
+
+    At most max_concurrent requests may hold a slot at once, and at most
+    max_queued more may wait for one. Waiting requests are rejected if they do
+    not get a slot within queue_timeout seconds.
+
+    A request only gets a slot if its cost (see request_cost()) fits into both
+    the global budget (max_rows_global) and its client's budget
+    (max_rows_per_client), given the costs of all requests already holding a
+    slot. A budget of 0 is unlimited.
+    """
+
+    def __init__(self,
+            max_concurrent,
+            max_queued,
+            queue_timeout,
+            max_rows_global=0,
+            max_rows_per_client=0,
+            retry_after=1):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.max_rows_global = max_rows_global
+        self.max_rows_per_client = max_rows_per_client
+        self.retry_after = retry_after
+
+        self._cond = threading.Condition()
+        self._running = 0
+        self._queued = 0
+        self._rows_global = 0
+        self._rows_per_client = {}
+
+    def _fits_into(self, running, rows_global, rows_client, cost):
+        # Whether a request of the given cost fits, given how many requests are
+        # running, and the cost of them (and of those of its client)
+        return (
+            running < self.max_concurrent and
+            (self.max_rows_global == 0 or
+                rows_global + cost <= self.max_rows_global) and
+            (self.max_rows_per_client == 0 or
+                rows_client + cost <= self.max_rows_per_client)
+        )
+
+    def _fits(self, client, cost):
+        return self._fits_into(self._running, self._rows_global,
+            self._rows_per_client.get(client, 0), cost)
+
+    def _check_budgets(self, cost):
+        # A request that costs more than a whole budget would wait forever, so
+        # there is no point in queueing it (or in asking the client to retry).
+        if self.max_rows_global != 0 and cost > self.max_rows_global:
+            raise exceptions.BudgetExceededError(
+                "request costs "+str(cost)+" cells, but the global budget is "+
+                str(self.max_rows_global))
+        if self.max_rows_per_client != 0 and cost > self.max_rows_per_client:
+            raise exceptions.BudgetExceededError(
+                "request costs "+str(cost)+" cells, but the per-client "+
+                "budget is "+str(self.max_rows_per_client))
+
+    def _wait_time(self, timed_out, deadline):
+        """
+        Return how long a queued request may keep waiting, given when it times
+        out and its deadline (both time.monotonic() times, deadline being None
+        if it has none), or raise the error for why it may not.
+        """
+
+        now = time.monotonic()
+        if deadline is not None and now >= deadline:
+            raise exceptions.CancelledError(jobs.DEADLINE)
+        if now >= timed_out:
+            raise exceptions.OverloadedError(
+                "timed out waiting for a generation slot", self.retry_after)
+
+        if deadline is None:
+            return timed_out - now
+        return min(timed_out, deadline) - now
+
+    def acquire(self, client, cost, deadline=None):
+        """
+        Take a slot for the given client, waiting in the queue if needed.
+
+        Raises exceptions.BudgetExceededError if the request could never be
+        admitted, or exceptions.OverloadedError if it cannot be admitted now.
+        If deadline (a time.monotonic() time) is given and passes while the
+        request is queued, raises exceptions.CancelledError (with
+        jobs.DEADLINE).
+        """
+
+        self._check_budgets(cost)
+
+        with self._cond:
+            if not self._fits(client, cost):
+                if self._queued >= self.max_queued:
+                    raise exceptions.OverloadedError(
+                        "generation queue is full", self.retry_after)
+
+                self._queued += 1
+                try:
+                    timed_out = time.monotonic() + self.queue_timeout
+                    while not self._fits(client, cost):
+                        self._cond.wait(self._wait_time(timed_out, deadline))
+                finally:
+                    self._queued -= 1
+
+            self._running += 1
+            self._rows_global += cost
+            self._rows_per_client[client] = (
+                self._rows_per_client.get(client, 0) + cost)
+
+    def release(self, client, cost):
+        """Give back a slot taken by acquire()."""
+
+        with self._cond:
+            self._running -= 1
+            self._rows_global -= cost
+            self._rows_per_client[client] -= cost
+            if self._rows_per_client[client] == 0:
+                del self._rows_per_client[client]
+
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, client, cost, deadline=None):
+        """Hold a slot (see acquire()) for the duration of the with block."""
+
+        self.acquire(client, cost, deadline)
+        try:
+            yield
+        finally:
+            self.release(client, cost)
+
+class SharedAdmissionController(AdmissionController):
+    """
+    As AdmissionController, but its slots, queue and budgets are shared by every
+    process that uses the same directory (eg. the workers of a production
+    server, see gunicorn.conf.py), rather than only by the threads of one
+    process.
+
+    The requests holding (or queued for) a slot are kept in a file in
+    directory, which is locked while it is read and written. Queued requests
+    check it every shared_state.POLL_INTERVAL seconds. Slots held by processes
+    that have exited (eg. workers that were killed) are given back as soon as
+    they are found.
+    """
+
+    def __init__(self, directory, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        os.makedirs(directory, exist_ok=True)
+        self._lock_path = os.path.join(directory, "admission.lock")
+        self._state_path = os.path.join(directory, "admission.json")
+
+    @contextmanager
+    def _state(self):
+        """
+        Lock the shared state for the duration of the with block, yielding it
+        to be read and modified, then write it back.
+
+        The state is a dict of "running" (a list of [pid, client, cost] of each
+        request holding a slot) and "queued" (a list of [pid, client] of each
+        request waiting for one).
+        """
+
+        with shared_state.locked(self._lock_path):
+            state = shared_state.read_json(self._state_path,
+                {"running": [], "queued": []})
+            alive = {}
+            for name in ("running", "queued"):
+                state[name] = [
+                    entry for entry in state[name]
+                    if alive.setdefault(entry[0],
+                        shared_state.process_alive(entry[0]))]
+
+            yield state
+            shared_state.write_json(self._state_path, state)
+
+    def _take(self, state, client, cost):
+        # Take a slot in the given state, if the request fits
+        running = state["running"]
+        if not self._fits_into(
+                len(running),
+                sum(entry[2] for entry in running),
+                sum(entry[2] for entry in running if entry[1] == client),
+                cost):
+            return False
+
+        running.append([os.getpid(), client, cost])
+        return True
+
+    def acquire(self, client, cost, deadline=None):
+        """As AdmissionController.acquire()."""
+
+        self._check_budgets(cost)
+
+        queued = [os.getpid(), client]
+        with self._state() as state:
+            if self._take(state, client, cost):
+                return
+            if len(state["queued"]) >= self.max_queued:
+                raise exceptions.OverloadedError(
+                    "generation queue is full", self.retry_after)
+            state["queued"].append(queued)
+
+        admitted = False
+        try:
+            timed_out = time.monotonic() + self.queue_timeout
+            while not admitted:
+                time.sleep(min(self._wait_time(timed_out, deadline),
+                    shared_state.POLL_INTERVAL))
+
+                with self._state() as state:
+                    admitted = self._take(state, client, cost)
+                    if admitted:
+                        state["queued"].remove(queued)
+        finally:
+            if not admitted:
+                with self._state() as state:
+                    if queued in state["queued"]:
+                        state["queued"].remove(queued)
+
+    def release(self, client, cost):
+        """Give back a slot taken by acquire()."""
+
+        with self._state() as state:
+            state["running"].remove([os.getpid(), client, cost])
@@ -0,0 +1,82 @@
+"""
+Checkpoints of long-running generations, so that they can be resumed after
+being interrupted (eg. by the process being killed).
+
+Every chunk of every field is seeded separately (see plans.chunk_rng()), and
+generators can start at any offset, so the state of every generator at any
+record can be recreated from the seed and the record's position alone. A
+checkpoint therefore only records the seed and how much of each output was
+completed, not the state of any generator or random number generator.
+"""
+
+import os
+import json
+import time
+
+def load(path):
+    """Return the checkpoint at the given path, or None if there is none."""
+
+    try:
+        with open(path, encoding="utf-8") as checkpoint_file:
+            return json.load(checkpoint_file)
+    except FileNotFoundError:
+        return None
+
+def save(path, state):
+    """
+    Save the given (JSON-serialisable) state as the checkpoint at the given
+    path, replacing any checkpoint already there.
+
+    The checkpoint is written to a temporary file first and synced to disk, so
+    a checkpoint is either entirely the old one or entirely the new one, even
+    if the process or machine stops part-way through saving it.
+    """
+
+    tmp_path = path+".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as checkpoint_file:
+        json.dump(state, checkpoint_file)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(tmp_path, path)
+
+def sync(binary_file):
+    """
+    Flush and sync the given open file to disk, so that a checkpoint saved
+    after it refers to data that will still be there.
+    """
+
+    binary_file.flush()
+    os.fsync(binary_file.fileno())
+
+def sync_path(path):
+    """As sync(), for the (closed) file at the given path."""
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class Checkpointer:
+    """
+    Saves the checkpoints of one piece of work to the given path, at most once
+    every interval seconds (except for forced saves).
+    """
+
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+
+        # The state of the last checkpoint, or None if there is none
+        self.state = load(path)
+        self._last_save = time.monotonic()
+
+    def due(self):
+        """Return whether it is time to save another checkpoint."""
+
+        return time.monotonic() - self._last_save >= self.interval
+
+    def save(self, state):
+        save(self.path, state)
+        self.state = state
+        self._last_save = time.monotonic()
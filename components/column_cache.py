@@ -0,0 +1,172 @@
+import os
+import atexit
+import pickle
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from components import plans
+
+def column_key(field_hash, table_name, seed, num_records, chunk_records):
+    """
+    Return the cache key of a generated column.
+
+    A column's values only depend on its field's spec, its table's name, the
+    seed and how many records (in how many chunks) are generated.
+    """
+
+    return plans.spec_hash(
+        [field_hash, table_name, seed, num_records, chunk_records])
+
+def _remove_directory(directory, pid):
+    # Forked processes (eg. server workers) inherit this exit handler, but only
+    # the process that created the directory may remove it
+    if os.getpid() == pid:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def _read_chunks(column_file):
+    with column_file:
+        while True:
+            try:
+                yield pickle.load(column_file)
+            except EOFError:
+                return
+
+class _Entry:
+    def __init__(self, chunks, nbytes, path=None):
+        self.chunks = chunks # If in memory
+        self.path = path # If on disk
+        self.nbytes = nbytes
+
+class ColumnCache:
+    """
+    A two-tier LRU cache of generated columns, so that regenerating a spec in
+    which only some fields have changed only generates those fields.
+
+    Columns are held in memory, up to max_memory bytes (as estimated by
+    storage.column_nbytes()). When the memory tier is full, its least recently
+    used columns are moved to files in directory, up to max_disk bytes. When
+    that is full, its least recently used columns are deleted.
+
+    If directory is None, a temporary directory is created (and removed when
+    the process exits). Caches must not be shared between processes, so each
+    forked process that needs a cache must create its own.
+    """
+
+    def __init__(self, max_memory, max_disk, directory=None):
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix="dataset-generator-cache-")
+            atexit.register(_remove_directory, directory, os.getpid())
+        else:
+            os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._disk = OrderedDict()
+        self._memory_used = 0
+        self._disk_used = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key+".column")
+
+    def _evict(self):
+        # Demote from memory to disk ...
+        while self._memory_used > self.max_memory:
+            (key, entry) = self._memory.popitem(last=False)
+            self._memory_used -= entry.nbytes
+            if entry.nbytes > self.max_disk:
+                continue
+
+            path = self._path(key)
+            with open(path, "wb") as column_file:
+                for chunk in entry.chunks:
+                    pickle.dump(chunk, column_file, pickle.HIGHEST_PROTOCOL)
+            self._add_to_disk(key, _Entry(None, os.path.getsize(path), path))
+
+        # ... and drop from disk
+        while self._disk_used > self.max_disk:
+            (key, entry) = self._disk.popitem(last=False)
+            self._disk_used -= entry.nbytes
+            os.remove(entry.path)
+
+    def _add_to_disk(self, key, entry):
+        if key in self._disk:
+            self._disk_used -= self._disk.pop(key).nbytes
+        self._disk[key] = entry
+        self._disk_used += entry.nbytes
+
+    def _discard(self, key):
+        if key in self._memory:
+            self._memory_used -= self._memory.pop(key).nbytes
+        if key in self._disk:
+            entry = self._disk.pop(key)
+            self._disk_used -= entry.nbytes
+            if os.path.exists(entry.path):
+                os.remove(entry.path)
+
+    def get(self, key):
+        """
+        Return an iterator over the chunks of the cached column with the given
+        key, or None if it is not cached.
+
+        The iterator remains valid even if the column is evicted while it is
+        being iterated over.
+        """
+
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return iter(self._memory[key].chunks)
+
+            if key in self._disk:
+                self._disk.move_to_end(key)
+
+                # Opening the file now means it can still be read if it is
+                # evicted (ie. deleted) before it is finished with
+                return _read_chunks(open(self._disk[key].path, "rb"))
+
+        return None
+
+    def put(self, key, chunks, nbytes):
+        """
+        Cache the given chunks (a list of lists of values) of a column, which
+        use nbytes of memory, under the given key.
+
+        The chunks must not be modified once cached.
+        """
+
+        if nbytes > self.max_memory:
+            return
+
+        with self._lock:
+            self._discard(key)
+            self._memory[key] = _Entry(chunks, nbytes)
+            self._memory_used += nbytes
+            self._evict()
+
+    def put_file(self, path, key):
+        """
+        Cache the column stored (as pickled chunks) in the file at path under
+        the given key. The file is linked (or copied) into the cache, so the
+        original may be deleted afterwards.
+        """
+
+        nbytes = os.path.getsize(path)
+        if nbytes > self.max_disk:
+            return
+
+        with self._lock:
+            self._discard(key)
+
+            cache_path = self._path(key)
+            try:
+                os.link(path, cache_path)
+            except OSError:
+                shutil.copyfile(path, cache_path)
+
+            self._add_to_disk(key, _Entry(None, nbytes, cache_path))
+            self._evict()
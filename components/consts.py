@@ -1,3 +1,5 @@
+import os
+
 # Defined APIs
 # ----------
 
@@ -18,5 +20,120 @@ APIs = {
 
 PROTOCOL = "http"
 HOST = "localhost"
-PORT = 5000
+PORT = int(os.environ.get("DATASET_GENERATOR_PORT", 5000))
 WEB_ROOT_URL = "".join([PROTOCOL, "://", HOST, ":", str(PORT)])
+
+# HTTP Caching
+# ----------
+
+# How long (in seconds) clients may use cached responses before revalidating
+SCHEMAS_MAX_AGE = 3600
+RESOURCES_MAX_AGE = 300
+
+# How often (in seconds) to check whether any resources have been added/removed
+RESOURCE_INDEX_CHECK_INTERVAL = 2
+
+# Preview
+# ----------
+
+# How many records of each table to preview, if not specified, and at most
+PREVIEW_RECORDS = 10
+MAX_PREVIEW_RECORDS = 1000
+
+# Admission Control
+# ----------
+
+# Operators may override any of these through the environment by prefixing
+# their names with 'DATASET_GENERATOR_', eg.
+#   DATASET_GENERATOR_MAX_ROWS_PER_CLIENT=1000000 python ./dataset-generator.py
+
+def _env_number(name, default, type_fn=int):
+    value = os.environ.get("DATASET_GENERATOR_"+name)
+    return default if value is None else type_fn(value)
+
+# How many generations may run at once, and how many more may wait for a slot
+MAX_CONCURRENT_GENERATIONS = _env_number("MAX_CONCURRENT_GENERATIONS", 2)
+MAX_QUEUED_GENERATIONS = _env_number("MAX_QUEUED_GENERATIONS", 8)
+
+# How long (in seconds) a queued generation waits before it is rejected
+QUEUE_TIMEOUT = _env_number("QUEUE_TIMEOUT", 10, float)
+
+# Row budgets, measured in cells (numRecords x fields, summed over all tables)
+# of the generations that are currently running. 0 means unlimited.
+MAX_ROWS_GLOBAL = _env_number("MAX_ROWS_GLOBAL", 50000000)
+MAX_ROWS_PER_CLIENT = _env_number("MAX_ROWS_PER_CLIENT", 20000000)
+
+# Sent in the 'Retry-After' header (in seconds) of rejected requests
+RETRY_AFTER = _env_number("RETRY_AFTER", 5)
+
+# Memory
+# ----------
+
+# How much memory (in bytes) each generation may hold its generated records and
+# output in before spilling them to temporary files on disk
+MEMORY_BUDGET = _env_number("MEMORY_BUDGET", 512 * 1024 * 1024)
+
+# Where to create temporary files. If None, the system's temporary directory
+# is used.
+SPILL_DIR = os.environ.get("DATASET_GENERATOR_SPILL_DIR")
+
+# How much memory and disk space (in bytes) to use for caching generated
+# columns of seeded generations, so that regenerating a spec after changing a
+# few fields only generates those fields. Columns are cached on disk in
+# COLUMN_CACHE_DIR, or a temporary directory if None.
+COLUMN_CACHE_MEMORY = _env_number("COLUMN_CACHE_MEMORY", 256 * 1024 * 1024)
+COLUMN_CACHE_DISK = _env_number("COLUMN_CACHE_DISK", 2 * 1024 * 1024 * 1024)
+COLUMN_CACHE_DIR = os.environ.get("DATASET_GENERATOR_COLUMN_CACHE_DIR")
+
+# Sorting
+# ----------
+
+# How many records of a table with orderBy to sort in memory at once (each such
+# 'run' is spilled to a temporary file), and how many runs to merge at once
+SORT_RUN_RECORDS = _env_number("SORT_RUN_RECORDS", 250000)
+SORT_FAN_IN = _env_number("SORT_FAN_IN", 16)
+
+# Profiling
+# ----------
+
+# Requests to the generate endpoint with an 'X-Profile' header equal to this
+# token are profiled. Profiling by header is disabled if the token is empty.
+PROFILE_TOKEN = os.environ.get("DATASET_GENERATOR_PROFILE_TOKEN", "")
+
+# The fraction of requests to the generate endpoint to profile at random
+PROFILE_SAMPLE_RATE = _env_number("PROFILE_SAMPLE_RATE", 0, float)
+
+# Where to store profiles (in the format of the pstats module)
+PROFILE_DIR = os.environ.get("DATASET_GENERATOR_PROFILE_DIR", "profiles")
+
+# Progress
+# ----------
+
+# At most how often (in seconds) to send progress events for a generation
+PROGRESS_INTERVAL = _env_number("PROGRESS_INTERVAL", 0.5, float)
+
+# How long (in seconds) to keep finished jobs, so that clients can see how they
+# finished, and how long to wait for a job to start when asked for its progress
+JOB_RETENTION = _env_number("JOB_RETENTION", 60, float)
+JOB_WAIT = _env_number("JOB_WAIT", 10, float)
+
+# Samples
+# ----------
+
+# How many rows of an uploaded sample to keep at random, and how many of its
+# most frequent values to count, when modelling it
+SAMPLE_RESERVOIR_SIZE = _env_number("SAMPLE_RESERVOIR_SIZE", 10000)
+SAMPLE_HEAVY_HITTERS = _env_number("SAMPLE_HEAVY_HITTERS", 1000)
+
+# Where to store models of uploaded samples, and how many of them to keep in
+# memory
+SAMPLE_MODEL_DIR = os.environ.get(
+    "DATASET_GENERATOR_SAMPLE_MODEL_DIR", "sample-models")
+SAMPLE_MODEL_MEMORY_SIZE = _env_number("SAMPLE_MODEL_MEMORY_SIZE", 64)
+
+# Deadlines
+# ----------
+
+# The longest (in seconds) that a generation may take, including waiting to be
+# admitted. Clients may ask for a shorter deadline. 0 means unlimited.
+MAX_GENERATION_SECONDS = _env_number("MAX_GENERATION_SECONDS", 600, float)
@@ -0,0 +1,339 @@
+import io
+import time
+import tracemalloc
+import zlib
+from itertools import islice
+from components import consts, generate, generators, admission
+
+# Calibration
+# --------------------------------------------------
+
+# The settings used to benchmark each generator. These should be typical of
+# what users ask for, as the throughput figures are used for every field with
+# that generator, regardless of its actual settings.
+CALIBRATION_SETTINGS = {
+    "null": None,
+    "forename": None,
+    "surname": None,
+    "phoneNumber": None,
+    "numberSequence": {"start": 0, "step": 1, "sequenceType": "infinite"},
+    "randomNumber": {"start": 0, "end": 1000, "round": 0.01}
+}
+
+# Data types that cannot be benchmarked on their own (eg. without an uploaded
+# sample, or other fields to derive from), and the generator that each performs
+# like, which stands in for it
+CALIBRATION_STAND_INS = {
+    "sampled": "forename",
+    "derived": "randomNumber"
+}
+
+def _calibrated_types():
+    return [
+        data_type for data_type in generators.generators
+        if data_type not in CALIBRATION_STAND_INS]
+
+# How many records to generate per benchmark. Tracing memory is much slower
+# than generating, but per-value sizes settle quickly, so fewer records are
+# traced.
+CALIBRATION_RECORDS = 20000
+CALIBRATION_TRACED_RECORDS = 2000
+
+# How many records to sample from each table when estimating
+SAMPLE_RECORDS = 256
+
+def _field_spec(name, data_type, settings):
+    data_type_spec = {"dataType": data_type}
+    if settings is not None:
+        data_type_spec[data_type] = settings
+
+    return {
+        "name": name,
+        "settings": {
+            "keySettings": {"primaryKey": False, "foreignKey": False},
+            "dataType": data_type_spec
+        }
+    }
+
+def _table_spec(name, num_records, field_specs):
+    return {
+        "name": name,
+        "settings": {"numRecords": num_records},
+        "fields": field_specs
+    }
+
+def _csv_bytes(table_gen):
+    csv = io.StringIO()
+    generate.write_csv(table_gen, csv)
+    return csv.getvalue().encode("utf-8")
+
+def _deflate(data):
+    # Raw deflate at the default level, as used by zipfile.ZIP_DEFLATED
+    compressor = zlib.compressobj(
+        zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+class Calibration:
+    """
+    Throughput and size figures for this machine, as measured by calibrate().
+
+    - cells_per_second maps each data type to how many values of that type
+      generate_tables() produces per second.
+    - cell_memory maps each data type to how many bytes each generated value of
+      that type holds in memory (including its slot in the record).
+    - record_memory is the memory overhead of each record, in bytes.
+    - encode_bytes_per_second is how many bytes of CSV write_csv() produces per
+      second.
+    - encode_record_memory is the peak memory used by write_csv(), per record
+      in the batch it is encoding.
+    - deflate_bytes_per_second is how many bytes of CSV can be compressed per
+      second.
+    """
+
+    def __init__(self,
+            cells_per_second,
+            cell_memory,
+            record_memory,
+            encode_bytes_per_second,
+            encode_record_memory,
+            deflate_bytes_per_second):
+        self.cells_per_second = cells_per_second
+        self.cell_memory = cell_memory
+        self.record_memory = record_memory
+        self.encode_bytes_per_second = encode_bytes_per_second
+        self.encode_record_memory = encode_record_memory
+        self.deflate_bytes_per_second = deflate_bytes_per_second
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return (result, max(time.perf_counter() - start, 1e-9))
+
+def _traced_peak(fn, *args):
+    tracemalloc.start()
+    try:
+        result = fn(*args)
+        (current, peak) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (result, current, peak)
+
+def calibrate(
+        num_records=CALIBRATION_RECORDS,
+        num_traced_records=CALIBRATION_TRACED_RECORDS):
+    """
+    Run a micro-benchmark of generation, encoding and compression on this
+    machine, returning a Calibration.
+
+    This takes a fraction of a second, so is intended to be run once at
+    startup.
+    """
+
+    cells_per_second = {}
+    cell_memory = {}
+    for data_type in _calibrated_types():
+        settings = CALIBRATION_SETTINGS.get(data_type)
+        field_specs = [_field_spec("value", data_type, settings)]
+
+        (_, seconds) = _timed(generate.generate_tables,
+            [_table_spec("calibration", num_records, field_specs)])
+        cells_per_second[data_type] = num_records / seconds
+
+        # Memory is measured separately, as tracing slows generation down
+        (tables, current, _) = _traced_peak(generate.generate_tables,
+            [_table_spec("calibration", num_traced_records, field_specs)])
+        cell_memory[data_type] = current / num_traced_records
+        del tables
+
+    # The per-record overhead is whatever a zero-field table holds
+    (tables, current, _) = _traced_peak(generate.generate_tables,
+        [_table_spec("calibration", num_traced_records, [])])
+    record_memory = current / num_traced_records
+    for data_type in cell_memory:
+        cell_memory[data_type] = max(cell_memory[data_type] - record_memory, 0)
+    del tables
+
+    for (data_type, stand_in) in CALIBRATION_STAND_INS.items():
+        cells_per_second[data_type] = cells_per_second[stand_in]
+        cell_memory[data_type] = cell_memory[stand_in]
+
+    # Encode a table with every data type in it
+    table = generate.generate_tables([_table_spec("calibration", num_records, [
+        _field_spec("value_"+str(i), data_type,
+            CALIBRATION_SETTINGS.get(data_type))
+        for (i, data_type) in enumerate(_calibrated_types())
+    ])])["calibration"]
+
+    (csv_bytes, seconds) = _timed(_csv_bytes, table)
+    encode_bytes_per_second = len(csv_bytes) / seconds
+
+    traced_table = dict(table,
+        records=list(islice(table["records"], num_traced_records)))
+    (_, current, peak) = _traced_peak(_csv_bytes, traced_table)
+    encode_record_memory = (peak - current) / num_traced_records
+
+    (_, seconds) = _timed(_deflate, csv_bytes)
+    deflate_bytes_per_second = len(csv_bytes) / seconds
+
+    return Calibration(
+        cells_per_second,
+        cell_memory,
+        record_memory,
+        encode_bytes_per_second,
+        encode_record_memory,
+        deflate_bytes_per_second)
+
+# Estimation
+# --------------------------------------------------
+
+class Estimator:
+    """
+    Estimates the cost of a generate spec without generating it, based on a
+    Calibration and on a small sample of each table.
+    """
+
+    def __init__(self, calibration, memory_budget=None):
+        self.calibration = calibration
+        self.memory_budget = memory_budget
+
+    def _avg_value_lengths(self, table_spec, sample, num_records):
+        """
+        Return the average formatted length of each field's values.
+
+        The sample only covers the first few records, which is representative
+        of most generators, but not of infinite sequences, whose values keep
+        getting longer. For those, also take the last value into account.
+        """
+
+        lengths = []
+        for (i, field_spec) in enumerate(table_spec["fields"]):
+            sample_lengths = [len(str(record[i])) for record in sample]
+            avg_length = (
+                sum(sample_lengths) / len(sample_lengths)
+                if len(sample_lengths) > 0 else 0)
+
+            data_type_spec = field_spec["settings"]["dataType"]
+            if (
+                data_type_spec["dataType"] == "numberSequence" and
+                data_type_spec["numberSequence"]["sequenceType"] == "infinite"
+                and num_records > len(sample)
+            ):
+                seq_spec = data_type_spec["numberSequence"]
+                last = seq_spec["start"] + seq_spec["step"] * (num_records - 1)
+                avg_length = (avg_length + len(str(last))) / 2
+
+            lengths.append(avg_length)
+
+        return lengths
+
+    def estimate_table(self, table_spec):
+        """
+        Return a dict of estimates for the given (validated) table_spec.
+
+        Only SAMPLE_RECORDS records are generated, so this takes constant time,
+        regardless of numRecords.
+        """
+
+        calibration = self.calibration
+        num_records = table_spec["settings"]["numRecords"]
+        num_fields = len(table_spec["fields"])
+        data_types = [
+            field_spec["settings"]["dataType"]["dataType"]
+            for field_spec in table_spec["fields"]]
+
+        sample_spec = dict(table_spec,
+            settings=dict(table_spec["settings"],
+                numRecords=min(num_records, SAMPLE_RECORDS)))
+        sample_table = generate.generate_tables([sample_spec])[
+            table_spec["name"]]
+        sample = list(sample_table["records"])
+
+        # Uncompressed size: the header, the values, and the separators
+        header_bytes = len(",".join(
+            field_spec["name"] for field_spec in table_spec["fields"])) + 1
+        record_bytes = (
+            sum(self._avg_value_lengths(table_spec, sample, num_records)) +
+            max(num_fields - 1, 0))
+        uncompressed_bytes = (
+            header_bytes + record_bytes * num_records +
+            max(num_records - 1, 0))
+
+        # Compressed size: assume the whole table compresses as well as the
+        # sample does
+        if len(sample) > 0:
+            sample_csv = _csv_bytes(sample_table)
+            ratio = len(_deflate(sample_csv)) / len(sample_csv)
+        else:
+            ratio = 1
+        compressed_bytes = uncompressed_bytes * ratio
+
+        # Memory: every record is held (in memory or on disk) while the table
+        # is encoded, but only one batch of records is encoded at a time. Tables
+        # with orderBy also hold one run of records while sorting it.
+        per_record_memory = (
+            calibration.record_memory +
+            sum(calibration.cell_memory[data_type]
+                for data_type in data_types))
+        records_memory = num_records * per_record_memory
+        encode_memory = (
+            min(num_records, generate.CSV_BATCH_RECORDS) *
+            calibration.encode_record_memory)
+        if "orderBy" in table_spec["settings"]:
+            encode_memory += (
+                min(num_records, consts.SORT_RUN_RECORDS) * per_record_memory)
+
+        # Time: generate every value, then encode and compress the result
+        generate_seconds = sum(
+            num_records / calibration.cells_per_second[data_type]
+            for data_type in data_types)
+        encode_seconds = (
+            uncompressed_bytes / calibration.encode_bytes_per_second +
+            uncompressed_bytes / calibration.deflate_bytes_per_second)
+
+        return {
+            "rows": num_records,
+            "cells": num_records * num_fields,
+            "uncompressedBytes": int(uncompressed_bytes),
+            "compressedBytes": int(compressed_bytes),
+            "recordsMemoryBytes": int(records_memory),
+            "peakMemoryBytes": int(records_memory + encode_memory),
+            "wallTimeSeconds": generate_seconds + encode_seconds
+        }
+
+    def estimate(self, generate_spec):
+        """
+        Return a dict of estimates for the given (validated) generate_spec,
+        containing the estimates for each table and for the whole spec.
+        """
+
+        tables = {
+            table_spec["name"]: self.estimate_table(table_spec)
+            for table_spec in generate_spec["tables"]}
+
+        # Every table is held until all of them are generated, then they are
+        # encoded one at a time into a zip file, which is streamed to the
+        # client as it is written. Records are only held in memory up to the
+        # memory budget (if any).
+        records_memory = sum(
+            table["recordsMemoryBytes"] for table in tables.values())
+        compressed_bytes = sum(
+            table["compressedBytes"] for table in tables.values())
+        if self.memory_budget is not None:
+            records_memory = min(records_memory, self.memory_budget)
+        encode_memory = max([
+            table["peakMemoryBytes"] - table["recordsMemoryBytes"]
+            for table in tables.values()] + [0])
+
+        return {
+            "tables": tables,
+            "total": {
+                "rows": sum(table["rows"] for table in tables.values()),
+                "cost": admission.request_cost(generate_spec["tables"]),
+                "uncompressedBytes": sum(
+                    table["uncompressedBytes"] for table in tables.values()),
+                "compressedBytes": compressed_bytes,
+                "peakMemoryBytes": records_memory + encode_memory,
+                "wallTimeSeconds": sum(
+                    table["wallTimeSeconds"] for table in tables.values())
+            }
+        }
@@ -1,2 +1,35 @@
 class BadSpecificationError(ValueError):
     pass
+
+class OverloadedError(RuntimeError):
+    """
+    Raised when a request cannot be admitted at this time, but may be admitted
+    if retried after retry_after seconds.
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class BudgetExceededError(ValueError):
+    """
+    Raised when a request could never be admitted, because it alone costs more
+    than a configured budget allows.
+    """
+
+    pass
+
+class ShardError(RuntimeError):
+    """Raised when the shards of a shard manifest cannot be merged."""
+
+    pass
+
+class CancelledError(RuntimeError):
+    """
+    Raised when work is stopped early by a jobs.Cancellation, for the given
+    reason (one of the reasons in jobs).
+    """
+
+    def __init__(self, reason):
+        super().__init__("cancelled: "+reason)
+        self.reason = reason
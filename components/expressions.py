@@ -0,0 +1,567 @@
+"""
+Expressions of derived fields, whose values are computed from the values of
+other fields in the same record, eg.
+
+    lower(forename) + "." + lower(surname) + "@example.com"
+    price * quantity
+
+Expressions are written in a small, safe subset of Python's expression syntax:
+field names, string/number/boolean/None literals, the arithmetic operators
++ - * / // %, comparisons, 'and'/'or'/'not', 'a if condition else b', and calls
+to the functions in FUNCTIONS. They are parsed and type-checked once, then
+compiled into functions that compute the values of a whole chunk of records at
+a time, column-wise, rather than interpreting the expression for every record.
+
+An operation that fails for a record (eg. dividing by zero, or using a null
+value) gives null for that record, rather than failing the generation. So does
+an operation that gives a value that is too big (see MAX_STRING_LENGTH and
+MAX_INT_BITS).
+"""
+
+import ast
+import sys
+import operator
+from itertools import repeat
+
+from components import generators
+
+# The longest expression that is accepted (in characters)
+MAX_LENGTH = 1000
+
+# The longest chain of derived fields that depend on each other (eg. c = b + 1,
+# b = a + 1 is a chain of 2) that is accepted
+MAX_DERIVED_DEPTH = 16
+
+# The longest string (in characters) and biggest integer (in bits) that an
+# operation may produce. Larger values give null, so that values cannot grow
+# without limit (eg. by repeatedly doubling them through a chain of fields).
+MAX_STRING_LENGTH = 4096
+MAX_INT_BITS = 4096
+
+# The errors that an operation may raise for bad values, which give null
+_VALUE_ERRORS = (TypeError, ValueError, ArithmeticError)
+
+# Types
+# --------------------------------------------------
+
+# Values are typed as "number", "string" or "boolean", or None if they may be
+# of any type (or null). Booleans are numbers, as in Python.
+
+def _value_type(value):
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    return None
+
+def _is(value_type, expected):
+    """Return whether a value of value_type may be used as expected."""
+
+    if value_type is None or expected is None:
+        return True
+    if expected == "number":
+        return value_type in ("number", "boolean")
+    return value_type == expected
+
+def _common(types):
+    """Return the type of a value that may be any of types."""
+
+    types = set(types)
+    if types == {"boolean", "number"}:
+        return "number"
+    return types.pop() if len(types) == 1 else None
+
+# Functions and Operators
+# --------------------------------------------------
+
+def _multiply(a, b):
+    # Repeating strings could use any amount of memory
+    if isinstance(a, str) or isinstance(b, str):
+        raise TypeError("cannot multiply strings")
+    return a * b
+
+def _modulo(a, b):
+    # Formatting strings (eg. "%99999999d" % n) could use any amount of memory
+    if isinstance(a, str) or isinstance(b, str):
+        raise TypeError("cannot format strings")
+    return a % b
+
+class Function:
+    """
+    A function that expressions may call, taking between min_args and max_args
+    arguments, each of arg_type. Its result is of result_type, or (if that is
+    None) of the common type of its arguments.
+    """
+
+    def __init__(self, fn, min_args, max_args, arg_type, result_type):
+        self.fn = fn
+        self.min_args = min_args
+        self.max_args = max_args
+        self.arg_type = arg_type
+        self.result_type = result_type
+
+FUNCTIONS = {
+    "lower": Function(str.lower, 1, 1, "string", "string"),
+    "upper": Function(str.upper, 1, 1, "string", "string"),
+    "trim": Function(str.strip, 1, 1, "string", "string"),
+    "len": Function(len, 1, 1, "string", "number"),
+    "str": Function(str, 1, 1, None, "string"),
+    "int": Function(int, 1, 1, None, "number"),
+    "float": Function(float, 1, 1, None, "number"),
+    "abs": Function(abs, 1, 1, "number", "number"),
+    "round": Function(round, 1, 2, "number", "number"),
+    "min": Function(min, 2, None, None, None),
+    "max": Function(max, 2, None, None, None)
+}
+
+_BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: _multiply,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: _modulo
+}
+
+# The operators that may produce values bigger than their operands (see
+# _GROWING), which only take operands whose types are known: both numbers, or
+# (for +) both strings
+_GROWING_OPERATORS = {ast.Add, ast.Mult, ast.Mod}
+
+_UNARY_OPERATORS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+    ast.Not: operator.not_
+}
+
+_COMPARISONS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge
+}
+
+_SYMBOLS = {
+    ast.Add: "+", ast.Sub: "-", ast.Mult: "*", ast.Div: "/", ast.FloorDiv: "//",
+    ast.Mod: "%", ast.UAdd: "+", ast.USub: "-", ast.Not: "not",
+    ast.Lt: "<", ast.LtE: "<=", ast.Gt: ">", ast.GtE: ">="
+}
+
+def _and(a, b):
+    return a and b
+
+def _or(a, b):
+    return a or b
+
+def _if(condition, body, orelse):
+    return body if condition else orelse
+
+# Constants are parsed as ast.Constant from Python 3.8, and as these before it
+if sys.version_info >= (3, 8):
+    _CONSTANT_NODES = (ast.Constant,)
+else:
+    _CONSTANT_NODES = (ast.Num, ast.Str, ast.NameConstant)
+
+def _constant(node):
+    for attr in ("value", "n", "s"):
+        if hasattr(node, attr):
+            return getattr(node, attr)
+
+# Evaluation
+# --------------------------------------------------
+
+class _Constant:
+    """The value of a sub-expression that is the same for every record."""
+
+    def __init__(self, value):
+        self.value = value
+
+def _safe(fn, *args):
+    try:
+        return fn(*args)
+    except _VALUE_ERRORS:
+        return None
+
+def _columns(args, size):
+    return [
+        repeat(arg.value, size) if isinstance(arg, _Constant) else arg
+        for arg in args]
+
+def _oversized(value):
+    if isinstance(value, str):
+        return len(value) > MAX_STRING_LENGTH
+    if isinstance(value, int):
+        return value.bit_length() > MAX_INT_BITS
+    return False
+
+def _limited(fn):
+    """
+    Return fn, but giving null instead of values that are too big (see
+    MAX_STRING_LENGTH and MAX_INT_BITS), as soon as each is produced.
+    """
+
+    def limited(*args):
+        value = fn(*args)
+        return None if _oversized(value) else value
+    return limited
+
+# The functions that may produce values bigger than their arguments, which are
+# limited. Every other function's values are bounded by its arguments' (or are
+# small). As arguments are limited too, no value is ever much bigger than the
+# limits, even while it is being produced.
+_GROWING = {operator.add, _multiply, _modulo, int}
+
+def _apply(fn, args, size):
+    """
+    Apply fn to the values of each record of args (each a column of size
+    values, or a _Constant), returning a column, or a _Constant if every
+    argument is one.
+
+    fn is mapped over the whole columns at once. Only if that fails is it
+    applied to each record separately, giving null for the records it fails
+    for.
+    """
+
+    if all(isinstance(arg, _Constant) for arg in args):
+        return _Constant(_safe(fn, *[arg.value for arg in args]))
+
+    try:
+        return list(map(fn, *_columns(args, size)))
+    except _VALUE_ERRORS:
+        return [_safe(fn, *values) for values in zip(*_columns(args, size))]
+
+def _compile(node):
+    """
+    Return a function of (columns, size) that evaluates the given (checked)
+    node for a chunk of size records, given the columns of the fields it
+    references by name.
+    """
+
+    if isinstance(node, _CONSTANT_NODES):
+        constant = _Constant(_constant(node))
+        return lambda columns, size: constant
+
+    if isinstance(node, ast.Name):
+        return lambda columns, size: columns[node.id]
+
+    def applying(fn, operands):
+        if fn in _GROWING:
+            fn = _limited(fn)
+        compiled = [_compile(operand) for operand in operands]
+        return lambda columns, size: _apply(fn,
+            [evaluate(columns, size) for evaluate in compiled], size)
+
+    if isinstance(node, ast.BinOp):
+        return applying(
+            _BINARY_OPERATORS[type(node.op)], [node.left, node.right])
+
+    if isinstance(node, ast.UnaryOp):
+        return applying(_UNARY_OPERATORS[type(node.op)], [node.operand])
+
+    if isinstance(node, ast.Compare):
+        # a < b < c is (a < b) and (b < c), but each operand is evaluated once
+        operands = [_compile(operand)
+            for operand in [node.left] + node.comparators]
+        fns = [_COMPARISONS[type(op)] for op in node.ops]
+
+        def compare(columns, size):
+            values = [evaluate(columns, size) for evaluate in operands]
+            result = _apply(fns[0], values[0:2], size)
+            for (i, fn) in enumerate(fns[1:], 1):
+                result = _apply(_and,
+                    [result, _apply(fn, values[i:i+2], size)], size)
+            return result
+        return compare
+
+    if isinstance(node, ast.BoolOp):
+        fn = _and if isinstance(node.op, ast.And) else _or
+        operands = [_compile(operand) for operand in node.values]
+
+        def combine(columns, size):
+            result = operands[0](columns, size)
+            for evaluate in operands[1:]:
+                result = _apply(fn, [result, evaluate(columns, size)], size)
+            return result
+        return combine
+
+    if isinstance(node, ast.IfExp):
+        return applying(_if, [node.test, node.body, node.orelse])
+
+    if isinstance(node, ast.Call):
+        return applying(FUNCTIONS[node.func.id].fn, node.args)
+
+    # _check() only allows the nodes above
+    raise AssertionError("unchecked node: "+type(node).__name__)
+
+# Expressions
+# --------------------------------------------------
+
+class Expression:
+    """
+    A parsed and checked expression.
+
+    Raises ValueError if source is not a valid expression.
+    """
+
+    def __init__(self, source):
+        if len(source) > MAX_LENGTH:
+            raise ValueError(
+                "is longer than "+str(MAX_LENGTH)+" characters")
+        try:
+            tree = ast.parse(source.strip(), mode="eval")
+        except SyntaxError as err:
+            raise ValueError("is not a valid expression ("+str(err.msg)+")")
+
+        self.source = source
+
+        # The names of the fields that the expression references, in the order
+        # they first appear
+        self.references = []
+
+        self._tree = tree.body
+        self._check(self._tree)
+        self._evaluate = _compile(self._tree)
+
+    def _check(self, node):
+        if isinstance(node, _CONSTANT_NODES):
+            if (
+                _constant(node) is not None and
+                _value_type(_constant(node)) is None
+            ):
+                raise ValueError(
+                    "has an unsupported value: "+repr(_constant(node)))
+            return
+
+        if isinstance(node, ast.Name):
+            if node.id not in self.references:
+                self.references.append(node.id)
+            return
+
+        if isinstance(node, ast.BinOp):
+            if type(node.op) not in _BINARY_OPERATORS:
+                raise ValueError("uses an unsupported operator: "+
+                    type(node.op).__name__)
+            children = [node.left, node.right]
+        elif isinstance(node, ast.UnaryOp):
+            if type(node.op) not in _UNARY_OPERATORS:
+                raise ValueError("uses an unsupported operator: "+
+                    type(node.op).__name__)
+            children = [node.operand]
+        elif isinstance(node, ast.Compare):
+            for op in node.ops:
+                if type(op) not in _COMPARISONS:
+                    raise ValueError("uses an unsupported comparison: "+
+                        type(op).__name__)
+            children = [node.left] + node.comparators
+        elif isinstance(node, ast.BoolOp):
+            children = node.values
+        elif isinstance(node, ast.IfExp):
+            children = [node.test, node.body, node.orelse]
+        elif isinstance(node, ast.Call):
+            if (
+                not isinstance(node.func, ast.Name) or
+                node.func.id not in FUNCTIONS
+            ):
+                raise ValueError("calls an unknown function (the functions "+
+                    "are: "+", ".join(sorted(FUNCTIONS))+")")
+            function = FUNCTIONS[node.func.id]
+            if len(node.keywords) > 0 or any(
+                    isinstance(arg, ast.Starred) for arg in node.args):
+                raise ValueError("calls "+node.func.id+"() with unsupported "+
+                    "arguments")
+            if len(node.args) < function.min_args or (
+                function.max_args is not None and
+                len(node.args) > function.max_args
+            ):
+                raise ValueError("calls "+node.func.id+"() with the wrong "+
+                    "number of arguments")
+            children = node.args
+        else:
+            raise ValueError(
+                "uses unsupported syntax: "+type(node).__name__)
+
+        for child in children:
+            self._check(child)
+
+    def type(self, field_types):
+        """
+        Return the type of the expression's values (see _value_type()), given
+        the type of each field it references (by name).
+
+        Raises ValueError if the expression uses a value of the wrong type
+        (eg. adds a string to a number).
+        """
+
+        return self._type(self._tree, field_types)
+
+    def _type(self, node, field_types):
+        if isinstance(node, _CONSTANT_NODES):
+            return _value_type(_constant(node))
+        if isinstance(node, ast.Name):
+            return field_types[node.id]
+
+        if isinstance(node, ast.Call):
+            function = FUNCTIONS[node.func.id]
+            arg_types = [self._type(arg, field_types) for arg in node.args]
+            for arg_type in arg_types:
+                if not _is(arg_type, function.arg_type):
+                    raise ValueError("calls "+node.func.id+"() with a "+
+                        arg_type+", but it takes a "+function.arg_type)
+            if function.result_type is None:
+                return _common(arg_types)
+            return function.result_type
+
+        if isinstance(node, ast.BinOp):
+            (left, right) = (
+                self._type(node.left, field_types),
+                self._type(node.right, field_types))
+            if type(node.op) in _GROWING_OPERATORS and None in (left, right):
+                # These could make values of unknown types grow without limit
+                # (eg. formatting a string with %), so must know their types
+                raise ValueError("uses "+_SYMBOLS[type(node.op)]+" on a value "+
+                    "whose type is not known (use str(), int() or float() to "+
+                    "convert it)")
+            if isinstance(node.op, ast.Add):
+                if _is(left, "string") and _is(right, "string"):
+                    return "string" if "string" in (left, right) else None
+                if _is(left, "number") and _is(right, "number"):
+                    return "number" if None not in (left, right) else None
+                raise ValueError("adds a "+left+" and a "+right+" (use str() "+
+                    "to convert numbers to strings)")
+            for operand_type in (left, right):
+                if not _is(operand_type, "number"):
+                    raise ValueError("uses "+_SYMBOLS[type(node.op)]+" on a "+
+                        operand_type+", but it takes numbers")
+            return "number" if None not in (left, right) else None
+
+        if isinstance(node, ast.UnaryOp):
+            operand_type = self._type(node.operand, field_types)
+            if isinstance(node.op, ast.Not):
+                return "boolean"
+            if not _is(operand_type, "number"):
+                raise ValueError("uses "+_SYMBOLS[type(node.op)]+" on a "+
+                    operand_type+", but it takes a number")
+            return "number" if operand_type is not None else None
+
+        if isinstance(node, ast.Compare):
+            types = [self._type(operand, field_types)
+                for operand in [node.left] + node.comparators]
+            for (i, op) in enumerate(node.ops):
+                (left, right) = types[i:i+2]
+                if (
+                    type(op) not in (ast.Eq, ast.NotEq) and
+                    not _is(left, right) and not _is(right, left)
+                ):
+                    raise ValueError("compares a "+left+" and a "+right+" "+
+                        "with "+_SYMBOLS[type(op)])
+            return "boolean"
+
+        if isinstance(node, ast.BoolOp):
+            return _common(self._type(value, field_types)
+                for value in node.values)
+
+        if isinstance(node, ast.IfExp):
+            self._type(node.test, field_types)
+            return _common([
+                self._type(node.body, field_types),
+                self._type(node.orelse, field_types)])
+
+    def evaluate(self, columns, size):
+        """
+        Return the values of the expression for a chunk of size records, as a
+        list, given the (decoded) columns of the fields it references, by name.
+        """
+
+        result = self._evaluate(columns, size)
+        if isinstance(result, _Constant):
+            return [result.value] * size
+        return result
+
+# Derived Fields
+# --------------------------------------------------
+
+def derived_fields(table_spec):
+    """
+    Return the derived fields of the given table_spec, as a list of tuples of
+    (field name, Expression), in an order in which every field comes after the
+    derived fields that it references.
+
+    Raises ValueError if any expression is invalid, references a field that is
+    not in the table, depends on itself (through any number of fields), or
+    is at the end of a chain of more than MAX_DERIVED_DEPTH derived fields.
+    """
+
+    fields = {}
+    for field_spec in table_spec["fields"]:
+        data_type_spec = field_spec["settings"]["dataType"]
+        if data_type_spec["dataType"] != "derived":
+            continue
+
+        name = field_spec["name"]
+        try:
+            expression = Expression(data_type_spec["derived"]["expression"])
+        except ValueError as err:
+            raise ValueError("the expression of field '"+name+"' "+str(err))
+        fields[name] = expression
+
+    field_names = [field_spec["name"] for field_spec in table_spec["fields"]]
+    for (name, expression) in fields.items():
+        for reference in expression.references:
+            if reference not in field_names:
+                raise ValueError("the expression of field '"+name+"' "+
+                    "references field '"+reference+"', which does not exist")
+
+    # Depth-first topological sort, finding the depth of each derived field
+    # (ie. the length of the longest chain of derived fields ending in it)
+    ordered = []
+    depths = {}
+    def visit(name, path):
+        if name in depths or name not in fields:
+            return
+        if name in path:
+            cycle = path[path.index(name):] + [name]
+            if len(cycle) == 2:
+                raise ValueError("field '"+name+"' depends on itself")
+            raise ValueError("fields "+" -> ".join(cycle)+" depend on each "+
+                "other in a cycle")
+        for reference in fields[name].references:
+            visit(reference, path + [name])
+
+        depths[name] = 1 + max([
+            depths[reference] for reference in fields[name].references
+            if reference in fields] + [0])
+        if depths[name] > MAX_DERIVED_DEPTH:
+            raise ValueError("field '"+name+"' is at the end of a chain of "+
+                "more than "+str(MAX_DERIVED_DEPTH)+" derived fields")
+        ordered.append((name, fields[name]))
+
+    for name in fields:
+        visit(name, [])
+    return ordered
+
+def field_types(table_spec, derived=None):
+    """
+    Return the type of the values of each field (by name) of the given
+    table_spec. derived is the table's derived_fields(), if already known.
+
+    Raises ValueError if any derived field's expression is invalid (see
+    derived_fields() and Expression.type()).
+    """
+
+    if derived is None:
+        derived = derived_fields(table_spec)
+
+    types = {
+        field_spec["name"]: generators.value_types.get(
+            field_spec["settings"]["dataType"]["dataType"])
+        for field_spec in table_spec["fields"]}
+    for (name, expression) in derived:
+        try:
+            types[name] = expression.type(types)
+        except ValueError as err:
+            raise ValueError("the expression of field '"+name+"' "+str(err))
+    return types
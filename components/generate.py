@@ -1,44 +1,97 @@
 import io
+import json
+import hashlib
 import zipfile
+import tempfile
 from contextlib import contextmanager
-from components import generators
+from itertools import islice
+from components import consts, plans, storage, column_cache, sorting, generators
 
-def generate_field(field_spec, loaded_generators):
+# How many records write_csv() encodes at a time
+CSV_BATCH_RECORDS = 10000
+
+# The name of the manifest of a table that is written in parts. Files whose
+# names start with '_' are ignored by most loaders that load every file in a
+# directory.
+PART_MANIFEST = "_manifest.json"
+
+def ordered(plan, records, temp_dir=None, progress=None, cancel=None,
+        start=0):
     """
-    Generate data for a given field, given a 'contextual' list of generators.
+    Return the given records of the table with the given plan in the order
+    given by its orderBy setting, ie. as a sorting.SortedRecords, or as-is if
+    it has none.
 
-    If the given field_spec uses a generator that is already loaded, then use
-    the pre-existing generator. If not, then initialise a generator and add it
-    to the loaded_generators list.
+    Sorted runs are spilled into temp_dir (see sorting.SortedRecords). If
+    progress (a jobs.Job) is given, it is told how many runs and merge passes
+    the sort took. start and cancel are as for sorting.SortedRecords.
     """
 
-    # For convenience
-    field_name = field_spec["name"]
-    gen_settings = field_spec["settings"]["dataType"]
-    data_type = gen_settings["dataType"]
+    if plan.order_by is None:
+        return records
 
-    # Get the generator
-    # If the generator is in the schema's enum, but not defined in the generator
-    # module - that would be an 'internal server error'! So don't catch it.
-    generator_constructor = generators.generators[data_type]
+    on_sorted = None
+    if progress is not None:
+        on_sorted = lambda runs, passes: progress.sorted(plan.name, runs, passes)
+    return sorting.SortedRecords(records, plan.order_by, plan.dictionaries,
+        temp_dir=temp_dir, start=start, cancel=cancel, on_sorted=on_sorted)
 
-    # Re-use the created generator, or create a new one
-    if field_name in loaded_generators:
-        generator = loaded_generators[field_name]
-    else:
-        # If there are any parameters for this generator, provide them
-        if data_type in gen_settings:
-            generator = generator_constructor(**gen_settings[data_type])
-        else:
-            generator = generator_constructor()
+def generate_table(table_spec, seed=None, max_records=None):
+    """
+    Generate data for a single table based on table_spec, in the same format
+    as each table returned by generate_tables(), except that its records are
+    generated lazily (ie. "records" is a plans.ChunkedRecords, or a
+    sorting.SortedRecords of one, which can only be iterated over once).
 
-        loaded_generators[field_name] = generator
+    seed and max_records are as for generate_tables().
+    """
+
+    plan = plans.compile_table(table_spec)
 
-    # Generate the next value in the generator's series
-    return next(generator)
+    num_records = plan.num_records
+    if max_records is not None:
+        num_records = min(num_records, max_records)
 
-def generate_tables(tables_spec):
-    """Generate data in tables based on tables_spec."""
+    return {
+        "fields": plan.fields,
+        "records": ordered(plan,
+            plans.ChunkedRecords(plan, seed, num_records), consts.SPILL_DIR),
+        "part_limits": plan.part_limits
+    }
+
+def generate_tables(tables_spec,
+        seed=None, max_records=None, budget=None, cache=None, progress=None,
+        cancel=None):
+    """
+    Generate data in tables based on tables_spec.
+
+    If seed is given, the data generated is reproducible. If max_records is
+    given, at most that many records are generated for each table. As records
+    are generated lazily, those records are the same as the first records that
+    would be generated for the table without max_records (though tables with
+    orderBy are then sorted, so may not start with the same records).
+
+    If budget (a storage.MemoryBudget) is given, the generated records are
+    charged to it, and tables that do not fit into it are spilled to disk. The
+    caller must close() the budget once it is done with the generated tables.
+
+    If cache (a column_cache.ColumnCache) is given and the data is reproducible
+    (ie. seed is given), then only the fields that are not in the cache are
+    generated, and those fields are added to the cache.
+
+    If progress (a jobs.Job) is given, it is told how many records of each
+    table have been generated after each chunk.
+
+    If cancel (a jobs.Cancellation) is given, it is checked before each chunk,
+    so that generation stops with exceptions.CancelledError soon after it is
+    cancelled. Whatever was generated is then left to be freed by closing the
+    budget.
+
+    The records of tables with orderBy are sorted (with an external merge sort,
+    spilling into the budget's spill directory) as they are first read, rather
+    than here, so that sorting streams into the output. progress and cancel
+    apply to sorting too.
+    """
 
     # Output in the format:
     # {
@@ -59,37 +112,75 @@ def generate_tables(tables_spec):
     #       },
     #       <more 'field info' dicts ...>
     #     ],
-    #     "data": [
-    #       [value1, <more values ...>],
+    #     "records": <storage.ColumnStore>, or a <sorting.SortedRecords> of one
+    #       if the table has orderBy (which can only be iterated over once),
+    #       which iterates as:
+    #     [
+    #       (value1, <more values ...>),
     #       <more rows ...>
-    #     ]
+    #     ],
+    #     "part_limits":
+    #       <IF the table is to be written in parts>
+    #         {
+    #           "rows": <int or None>,
+    #           "bytes": <int or None>
+    #         }
+    #       <ELSE>
+    #         None
+    #       </IF>
     #   },
     #   <more tables ...>
     # }
 
     table_gen = {}
     for table_spec in tables_spec:
-        fields = []
-        for field_spec in table_spec["fields"]:
-            # Field Key Settings Spec
-            fkss = field_spec["settings"]["keySettings"]
-
-            fields.append({
-                "name": field_spec["name"],
-                "primary_key": fkss["primaryKey"],
-                "foreign_key":
-                    fkss["foreignKeyParams"] if fkss["foreignKey"] else None
-            })
-
-        loaded_generators = {} # Added to as-needed by generate_field()
-        table_gen.update({
-            table_spec["name"]: {
-                "fields": fields,
-                "records": [[generate_field(field, loaded_generators)
-                    for field in table_spec["fields"] ]
-                    for _ in range(table_spec["settings"]["numRecords"]) ]
-            }
-        })
+        plan = plans.compile_table(table_spec)
+
+        num_records = plan.num_records
+        if max_records is not None:
+            num_records = min(num_records, max_records)
+
+        store = storage.ColumnStore(
+            len(plan.fields), budget, plan.dictionaries)
+        if len(plan.fields) == 0:
+            store.extend_empty(num_records)
+            if progress is not None:
+                progress.generated(plan.name, num_records)
+
+        # Each field's values come from the cache, if possible, or are
+        # generated or derived (and then cached, if possible)
+        sources = []
+        to_cache = []
+        for index in range(len(plan.fields)):
+            chunks = None
+            if cache is not None and seed is not None:
+                key = column_cache.column_key(plan.field_hashes[index],
+                    plan.name, seed, num_records, plans.CHUNK_RECORDS)
+                chunks = cache.get(key)
+                if chunks is None:
+                    to_cache.append((index, key))
+
+            if chunks is None and plan.constructors[index] is not None:
+                chunks = plan.field_chunks(index, seed, num_records)
+            sources.append(chunks)
+
+        for columns in plan.assemble(sources, num_records):
+            if cancel is not None:
+                cancel.check()
+            store.append(list(columns))
+            if progress is not None:
+                progress.generated(plan.name, len(columns[0]))
+
+        for (index, key) in to_cache:
+            store.columns[index].cache(cache, key)
+
+        table_gen[table_spec["name"]] = {
+            "fields": plan.fields,
+            "records": ordered(plan, store,
+                budget.spill_dir if budget is not None else consts.SPILL_DIR,
+                progress, cancel),
+            "part_limits": plan.part_limits
+        }
 
     return table_gen
 
@@ -106,7 +197,7 @@ def toCSV(table_gen, with_names=True):
         table_str += "\n"
 
     table_str += "\n".join([
-        ",".join(str(item) for item in record)
+        ",".join(map(generators.csv_field, record))
         for record in table_gen["records"]
     ])
 
@@ -114,34 +205,417 @@ def toCSV(table_gen, with_names=True):
     yield buffer
     buffer.close()
 
+def _csv_column(column):
+    """
+    Return the given (not dictionary-encoded) column as CSV fields, quoting
+    only the values that need it (see generators.csv_field()).
+    """
+
+    fields = list(map(str, column))
+    text = "".join(fields)
+    if any(char in text for char in ',"\r\n'):
+        return list(map(generators.csv_field, fields))
+    return fields
+
+def _csv_batches(table_gen, batch_size):
+    """
+    Yield the records of table_gen as CSV lines (without line endings), in
+    lists of a batch (or chunk) of records at a time. See write_csv().
+    """
+
+    records = table_gen["records"]
+    if hasattr(records, "chunks") and len(table_gen["fields"]) > 0:
+        for columns in records.chunks():
+            yield list(map(",".join, zip(*[
+                _csv_column(column) if dictionary is None
+                else dictionary.format(column)
+                for (column, dictionary) in zip(columns, records.dictionaries)
+            ])))
+
+    else:
+        records = iter(records)
+        for batch in iter(lambda: list(islice(records, batch_size)), []):
+            yield [
+                ",".join(map(generators.csv_field, record)) for record in batch]
+
+def _csv_header(table_gen):
+    return ",".join([field["name"] for field in table_gen["fields"]]) + "\n"
+
+def _csv_writes(table_gen, file, with_names, batch_size, continued=False):
+    """
+    Write the given table_gen to the given file, as for write_csv(), yielding
+    a tuple of (records, characters) written after each batch.
+    """
+
+    if with_names:
+        yield (0, file.write(_csv_header(table_gen)))
+
+    separator = "\n" if continued else ""
+    for lines in _csv_batches(table_gen, batch_size):
+        yield (len(lines), file.write(separator + "\n".join(lines)))
+        separator = "\n"
+
+def _consume_writes(writes, on_batch, cancel):
+    """
+    Run the given generator of (records, size) writes to the end, reporting
+    each to on_batch and checking cancel (a jobs.Cancellation) between them,
+    if given. Return the total size written and the generator's return value.
+    """
+
+    written = 0
+    try:
+        while True:
+            if cancel is not None:
+                cancel.check()
+            (num_records, batch_written) = next(writes)
+            written += batch_written
+            if on_batch is not None:
+                on_batch(num_records, batch_written)
+    except StopIteration as stop:
+        return (written, stop.value)
+
+def write_csv(table_gen, file,
+        with_names=True, batch_size=CSV_BATCH_RECORDS, on_batch=None,
+        cancel=None, continued=False):
+    """
+    Write the given table_gen to the given file (opened in text mode) in CSV
+    format, returning the number of characters written.
+
+    If on_batch is given, it is called with the number of records and
+    characters written after each batch. If cancel (a jobs.Cancellation) is
+    given, it is checked before each batch. If continued is True, the records
+    continue a CSV file that already has records in it (eg. one that is being
+    resumed), so with_names should be False.
+
+    Unlike toCSV(), the records of table_gen may be any iterable. They are
+    written batch_size records at a time, so only one batch is held in memory
+    at once. If the records can be read in chunks (ie. they are the
+    storage.ColumnStore of generate_tables() or the plans.ChunkedRecords of
+    generate_table()), they are written a chunk at a time instead, formatting
+    each column at once, and formatting dictionary-encoded columns by looking
+    up their pre-formatted values. Either way, the CSV written is identical to
+    that produced by toCSV().
+    """
+
+    (written, _) = _consume_writes(
+        _csv_writes(table_gen, file, with_names, batch_size, continued),
+        on_batch, cancel)
+    return written
+
+class HashingWriter:
+    """
+    A minimal text file-like object that encodes what is written to it (as
+    UTF-8) into a binary file, keeping count of its size and SHA-256 checksum.
+    """
+
+    def __init__(self, binary_file):
+        self.binary_file = binary_file
+        self.sha256 = hashlib.sha256()
+        self.bytes = 0
+
+    def write(self, text):
+        data = text.encode("utf-8")
+        self.sha256.update(data)
+        self.bytes += len(data)
+        self.binary_file.write(data)
+        return len(text)
+
+def part_name(number):
+    """Return the file name of the given part (by index) of a table."""
+
+    return "part-{:05d}.csv".format(number)
+
+class _Part:
+    """A part of a table being written by write_csv_parts()."""
+
+    def __init__(self, part_file, header):
+        self.file = part_file
+        self.writer = HashingWriter(part_file.__enter__())
+        self.writer.write(header)
+        self.rows = 0
+
+    def write(self, lines):
+        written = self.writer.write(
+            ("" if self.rows == 0 else "\n") + "\n".join(lines))
+        self.rows += len(lines)
+        return written
+
+    def close(self, number):
+        self.file.__exit__(None, None, None)
+        return {
+            "file": part_name(number),
+            "rows": self.rows,
+            "bytes": self.writer.bytes,
+            "sha256": self.writer.sha256.hexdigest()
+        }
+
+def _csv_part_writes(table_gen, open_part,
+        max_rows, max_bytes, with_names, batch_size,
+        first_part=0, on_part=None):
+    """
+    Write the given table_gen in parts, as for write_csv_parts(), yielding a
+    tuple of (records, bytes) written after each write, and returning the
+    summaries of the parts.
+    """
+
+    return (yield from _line_part_writes(_csv_batches(table_gen, batch_size),
+        _csv_header(table_gen) if with_names else "",
+        open_part, max_rows, max_bytes, first_part, on_part))
+
+def _line_part_writes(batches, header, open_part,
+        max_rows, max_bytes, first_part=0, on_part=None):
+    """
+    As _csv_part_writes(), but for batches (lists) of CSV lines, each with the
+    given header.
+    """
+
+    parts = []
+    part = None
+
+    def close_part():
+        parts.append(part.close(first_part + len(parts)))
+        if on_part is not None:
+            on_part(parts[-1])
+
+    for lines in batches:
+        # The size of each line in bytes, including the line break before it.
+        # Lines only need encoding to measure them if they are not ASCII.
+        if max_bytes is not None:
+            if all(line.isascii() for line in lines):
+                sizes = [len(line) + 1 for line in lines]
+            else:
+                sizes = [len(line.encode("utf-8")) + 1 for line in lines]
+
+        position = 0
+        while position < len(lines):
+            if part is None:
+                part = _Part(open_part(first_part + len(parts)), header)
+
+            # Take as many lines as fit into the part, but at least one
+            end = len(lines)
+            if max_rows is not None:
+                end = min(end, position + max_rows - part.rows)
+            if max_bytes is not None:
+                size = part.writer.bytes
+                fits = position
+                while fits < end:
+                    if part.rows == 0 and fits == position:
+                        size += sizes[fits] - 1 # No line break before it
+                    elif size + sizes[fits] <= max_bytes:
+                        size += sizes[fits]
+                    else:
+                        break
+                    fits += 1
+                end = fits
+
+            if end > position:
+                written = part.write(lines[position:end])
+                yield (end - position, written)
+                position = end
+
+            # If some lines did not fit, the part is full
+            if position < len(lines) or part.rows == max_rows:
+                close_part()
+                part = None
+
+    # Tables with no records still have a part, with just the header
+    if part is None and first_part + len(parts) == 0:
+        part = _Part(open_part(0), header)
+    if part is not None:
+        close_part()
+
+    return parts
+
+def write_csv_parts(table_gen, open_part,
+        max_rows=None, max_bytes=None,
+        with_names=True, batch_size=CSV_BATCH_RECORDS, on_batch=None,
+        cancel=None, first_part=0, on_part=None):
+    """
+    Write the given table_gen in CSV format, split into parts of at most
+    max_rows records and at most max_bytes bytes each (except that every part
+    has at least one record). Each part is a complete CSV file, with its own
+    header, so each part can be loaded separately.
+
+    open_part is called with the index of each part (from 0) and must return a
+    new binary file (as a context manager) to write the part into.
+
+    Returns a list of summaries of the parts, in the form:
+    [
+      {"file": part_name(i), "rows": <int>, "bytes": <int>, "sha256": <str>},
+      <more parts ...>
+    ]
+
+    Parts are numbered from first_part, so that a table can be written in
+    several goes (eg. when resuming it, with the records that are left). If
+    on_part is given, it is called with the summary of each part once the part
+    is complete and its file is closed.
+
+    on_batch, cancel and the other parameters are as for write_csv().
+    """
+
+    (_, parts) = _consume_writes(
+        _csv_part_writes(table_gen, open_part,
+            max_rows, max_bytes, with_names, batch_size, first_part, on_part),
+        on_batch, cancel)
+    return parts
+
+def write_csv_line_parts(lines, header, open_part,
+        max_rows=None, max_bytes=None, batch_size=CSV_BATCH_RECORDS):
+    """
+    As write_csv_parts(), but for the given iterable of CSV lines (records
+    that are already formatted, without line breaks) and header (with its
+    line break), eg. those of a table that was generated in shards. The parts
+    are identical to those write_csv_parts() writes for the same records.
+    """
+
+    lines = iter(lines)
+    (_, parts) = _consume_writes(
+        _line_part_writes(
+            iter(lambda: list(islice(lines, batch_size)), []),
+            header, open_part, max_rows, max_bytes),
+        None, None)
+    return parts
+
+def part_manifest(fields, parts):
+    """
+    Return the manifest of a table that was written in parts, as a JSON string,
+    given its 'field info' dicts and the summaries of its parts (as returned by
+    write_csv_parts()).
+    """
+
+    return json.dumps({
+        "fields": [field["name"] for field in fields],
+        "rows": sum(part["rows"] for part in parts),
+        "parts": parts
+    }, indent=2)
+
+def _multi_csv_writes(csv_zip_file, multi_table_gen, with_names, batch_size):
+    """
+    Write the given multi_table_gen into the given zipfile.ZipFile, as for
+    toMultiCSV(), yielding a tuple of (records, characters or bytes) written
+    after each batch.
+    """
+
+    for (table_name, table) in multi_table_gen.items():
+        # The size of the CSV is not known before it is written, so allow it
+        # to be larger than the non-ZIP64 limit (2 GiB)
+        if table.get("part_limits") is None:
+            with csv_zip_file.open(table_name+".csv", "w",
+                    force_zip64=True) as csv_member:
+                with io.TextIOWrapper(csv_member,
+                        encoding="utf-8", newline="") as csv:
+                    yield from _csv_writes(table, csv, with_names, batch_size)
+            continue
+
+        # Tables with part limits are written as a directory of parts, each
+        # compressed separately, plus a manifest
+        parts = yield from _csv_part_writes(table,
+            lambda number: csv_zip_file.open(
+                table_name+"/"+part_name(number), "w", force_zip64=True),
+            table["part_limits"]["rows"], table["part_limits"]["bytes"],
+            with_names, batch_size)
+        csv_zip_file.writestr(table_name+"/"+PART_MANIFEST,
+            part_manifest(table["fields"], parts))
+
 # See:
 # - https://stackoverflow.com/questions/28568687/download-multiple-csvs-using-flask/41374226
 # - https://stackoverflow.com/questions/2463770/python-in-memory-zip-library
 @contextmanager
-def toMultiCSV(multi_table_gen, with_names=True):
+def toMultiCSV(multi_table_gen, with_names=True, max_memory=None,
+        progress=None, cancel=None):
     """
     Convert the given multi_table_gen into zero or more CSV-formated files
     contained in a zip archive, returning a file-like object representing the
     zip file.
+
+    Each table is streamed into the archive, so only a batch of its records is
+    encoded in memory at once. Tables with "part_limits" are written as
+    '<table>/part-NNNNN.csv' members (see write_csv_parts()) and a
+    '<table>/_manifest.json' member, rather than a '<table>.csv' member. The
+    archive itself is held in memory, unless max_memory is given, in which
+    case it moves to a temporary file once it is larger than max_memory bytes.
+
+    If progress (a jobs.Job) is given, it is told how many records and bytes
+    have been encoded after each batch. If cancel (a jobs.Cancellation) is
+    given, it is checked before each batch.
     """
 
-    # WARNING: For the time being, use an in-memory zip file. This may lead to
-    # OUT OF MEMORY conditions!!! But it will be a fair bit faster ...
-    csv_zip_buffer = io.BytesIO()
+    if max_memory is None:
+        csv_zip_buffer = io.BytesIO()
+    else:
+        csv_zip_buffer = tempfile.SpooledTemporaryFile(max_size=max_memory)
     csv_zip_file = zipfile.ZipFile(csv_zip_buffer, 'w', zipfile.ZIP_DEFLATED)
 
     try:
-        for (table_name, table) in multi_table_gen.items():
-            with toCSV(table) as csv:
-                csv_zip_file.writestr(table_name+".csv", csv.getvalue())
+        _consume_writes(
+            _multi_csv_writes(csv_zip_file,
+                multi_table_gen, with_names, CSV_BATCH_RECORDS),
+            progress.encoded if progress is not None else None,
+            cancel)
 
     except zipfile.LargeZipFile:
         # TODO/FIXME: WHAT SHOULD THIS RAISE? (look through Werkzeug's list of
         # exceptions)
         raise # For now, just re-raise
 
+    except BaseException:
+        # Do not keep a half-written archive (which may be on disk) around
+        csv_zip_buffer.close()
+        raise
+
     csv_zip_file.close() # Close the zip file to write final metadata
 
     csv_zip_buffer.seek(0) # Reset the 'current position' ready for reading
     yield csv_zip_buffer
     csv_zip_buffer.close()
+
+class _StreamBuffer:
+    """
+    A minimal, unseekable binary file-like object, whose contents are taken
+    (with take()) as they are written.
+    """
+
+    def __init__(self):
+        self._data = []
+
+    def write(self, data):
+        self._data.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._data)
+        self._data = []
+        return data
+
+def stream_multi_csv(multi_table_gen, with_names=True, progress=None,
+        cancel=None):
+    """
+    As toMultiCSV(), but yield the zip archive in pieces (of bytes) as it is
+    written, so that it can be sent while it is being encoded, and is never
+    held in full.
+
+    Encoding only happens as the archive is read, so it stops when the reader
+    stops reading (eg. if the generator is closed). Archives written like this
+    cannot be seeked back into, so each member's sizes and checksum follow its
+    data, rather than preceding it.
+    """
+
+    csv_zip_buffer = _StreamBuffer()
+    csv_zip_file = zipfile.ZipFile(csv_zip_buffer, 'w', zipfile.ZIP_DEFLATED)
+
+    writes = _multi_csv_writes(csv_zip_file,
+        multi_table_gen, with_names, CSV_BATCH_RECORDS)
+    for (num_records, written) in writes:
+        if progress is not None:
+            progress.encoded(num_records, written)
+        data = csv_zip_buffer.take()
+        if len(data) > 0:
+            yield data
+        if cancel is not None:
+            cancel.check()
+
+    csv_zip_file.close()
+    yield csv_zip_buffer.take()
@@ -1,5 +1,9 @@
 import os
+import math
 import random
+import functools
+from array import array
+from components import sampling, samples
 
 # Helpers
 # --------------------------------------------------
@@ -13,9 +17,79 @@ def parse_file(path, delim=None):
 
     with open(os.path.abspath(path), 'r', encoding='utf-8') as file:
         if delim is None or delim == '\n':
-            return [line[:-1] for line in file]
+            return [line.rstrip('\n') for line in file]
         else:
-            return [line[:-1] for line in file].join('\n').split(delim)
+            return [line.rstrip('\n') for line in file].join('\n').split(delim)
+
+def parse_corpus(path):
+    """
+    Parse the corpus file at the given path into a tuple of (values, weights).
+
+    Each line of a corpus file is a value, optionally followed by a tab and its
+    relative frequency. Values without a frequency have a frequency of 1.
+    """
+
+    values = []
+    weights = []
+    for line in parse_file(path):
+        if line == "":
+            continue
+
+        (value, _, weight) = line.partition("\t")
+        values.append(value)
+        weights.append(float(weight) if weight != "" else 1.0)
+
+    return (values, weights)
+
+def csv_field(value):
+    """
+    Return the given value as a CSV field, quoted if it contains a comma, quote
+    or line break.
+    """
+
+    string = str(value)
+    if any(char in string for char in ',"\r\n'):
+        return '"' + string.replace('"', '""') + '"'
+    return string
+
+class Dictionary:
+    """
+    The values that the codes of a dictionary-encoded generator stand for, ie.
+    code i stands for values[i].
+
+    Dictionary-encoded columns are stored as compact arrays of codes, and are
+    only decoded when they are output. Each value is also pre-formatted (as it
+    would be by str(), but quoted if it would not otherwise be a single CSV
+    field), so that formatting a column is a lookup per value.
+    """
+
+    def __init__(self, values):
+        self.values = list(values)
+        self.formatted = [csv_field(value) for value in self.values]
+
+        # The smallest array typecode that can hold every code
+        num_values = len(self.values)
+        self.typecode = next(typecode for typecode in ("B", "H", "I", "Q")
+            if num_values <= 2 ** (8 * array(typecode).itemsize))
+
+    def __len__(self):
+        return len(self.values)
+
+    def encode(self, codes):
+        """Return the given iterable of codes as an array."""
+
+        # Arrays are built much faster from lists than from other iterables
+        return array(self.typecode, list(codes))
+
+    def decode(self, codes):
+        """Return the values of the given codes, as a list."""
+
+        return [self.values[code] for code in codes]
+
+    def format(self, codes):
+        """Return the values of the given codes as strings, as a list."""
+
+        return [self.formatted[code] for code in codes]
 
 # Globals (to this module)
 # --------------------------------------------------
@@ -23,16 +97,92 @@ def parse_file(path, delim=None):
 def relative(path):
     return os.path.join(os.path.abspath(os.path.dirname(__file__)), path)
 
-FORENAMES = parse_file(relative("data/forenames.txt"))
-SURNAMES = parse_file(relative("data/surnames.txt"))
+CORPORA = {
+    "forenames": parse_corpus(relative("data/forenames.txt")),
+    "surnames": parse_corpus(relative("data/surnames.txt"))
+}
+(FORENAMES, _) = CORPORA["forenames"]
+(SURNAMES, _) = CORPORA["surnames"]
+DICTIONARIES = {
+    corpus: Dictionary(values) for (corpus, (values, _)) in CORPORA.items()
+}
+
+# How many values to sample at once from an AliasTable. This does not affect
+# which values are generated, only how quickly.
+SAMPLE_BATCH = 1000
+
+round_fn = round # Keep a reference to this **BUILT-IN FUNCTION**
+
+# Alias tables are cached, as they are expensive to build for large ranges
+ALIAS_TABLE_CACHE_SIZE = 64
+
+@functools.lru_cache(maxsize=ALIAS_TABLE_CACHE_SIZE)
+def corpus_table(corpus, distribution, exponent, weights=None):
+    """
+    Return the AliasTable for sampling codes (indexes) of the values of the
+    named corpus (a key of CORPORA) with the given distribution.
+
+    A 'corpus' distribution follows the corpus' own frequencies, except for the
+    values given in weights (a tuple of (value, weight) pairs), which have the
+    given frequencies instead. A 'zipf' distribution follows a Zipf
+    distribution with the given exponent, with the corpus' first value being
+    the most common.
+    """
+
+    (values, corpus_weights) = CORPORA[corpus]
+    if distribution == "zipf":
+        weights = sampling.zipf_weights(len(values), exponent)
+    elif weights is not None:
+        weights = dict(weights)
+        weights = [weights.get(value, corpus_weight)
+            for (value, corpus_weight) in zip(values, corpus_weights)]
+    else:
+        weights = corpus_weights
+    return sampling.AliasTable(range(len(values)), weights)
+
+def zipf_range(start, end, round):
+    """
+    Return the range of the multiples of round (by index, ie. the values are
+    round * index) between start and end (inclusive).
+    """
+
+    return range(math.ceil(start / round), math.floor(end / round) + 1)
+
+@functools.lru_cache(maxsize=ALIAS_TABLE_CACHE_SIZE)
+def zipf_number_table(start, end, round, exponent):
+    """
+    Return the AliasTable for sampling the multiples of round between start and
+    end (inclusive) with a Zipf distribution, with smaller values being more
+    common.
+    """
+
+    multiples = zipf_range(start, end, round)
+    return sampling.AliasTable(
+        [round_fn(round * multiple, len(str(round))) for multiple in multiples],
+        sampling.zipf_weights(len(multiples), exponent))
+
+def sample_forever(table, rng):
+    """Yield values sampled from the given AliasTable, in batches."""
+
+    while True:
+        yield from table.sample_many(rng, SAMPLE_BATCH)
 
 # Generators
 # --------------------------------------------------
 
+# Every generator takes an rng keyword argument, which is the source of all of
+# its randomness. It may be the random module itself, or a random.Random
+# instance (eg. to make the generator's output reproducible).
+
+# Every generator also takes an offset keyword argument, which is the position
+# in the series that it should start at. This allows a series to be generated
+# in separate parts (eg. in parallel). Generators whose values do not depend on
+# their position ignore it.
+
 # Constant Generators
 # --------------------
 
-def null():
+def null(rng=random, offset=0):
     """Yields None (ie. null)."""
 
     while True:
@@ -41,26 +191,83 @@ def null():
 # Name Generators
 # --------------------
 
-def forename():
-    """Yield a random forename."""
+# Names are dictionary-encoded: these generators yield codes into the
+# DICTIONARIES of their corpus.
 
-    while True:
-        yield random.choice(FORENAMES)
+def _name(corpus, distribution, exponent, weights, rng):
+    if distribution == "uniform":
+        # Chooses the same codes as choosing from the values would
+        codes = range(len(CORPORA[corpus][0]))
+        while True:
+            yield rng.choice(codes)
 
-def surname():
-    """Yield a random surname."""
+    # Alias tables are cached by their arguments, which must be hashable
+    if weights is not None:
+        weights = tuple(sorted(weights.items()))
+    yield from sample_forever(
+        corpus_table(corpus, distribution, exponent, weights), rng)
 
-    while True:
-        yield random.choice(SURNAMES)
+def forename(distribution="uniform", exponent=1, weights=None, rng=random,
+        offset=0):
+    """
+    Yield a random forename (as a code into DICTIONARIES["forenames"]).
+
+    Forenames are equally likely if distribution is 'uniform', follow their
+    frequency in the corpus if it is 'corpus', or follow a Zipf distribution
+    with the given exponent if it is 'zipf'. With the 'corpus' distribution,
+    weights (a dict of forenames to frequencies) overrides the frequencies of
+    the forenames it gives.
+    """
+
+    return _name("forenames", distribution, exponent, weights, rng)
+
+def surname(distribution="uniform", exponent=1, weights=None, rng=random,
+        offset=0):
+    """
+    Yield a random surname (as a code into DICTIONARIES["surnames"]).
+
+    See forename() for the distributions.
+    """
+
+    return _name("surnames", distribution, exponent, weights, rng)
+
+# Sampled Generators
+# --------------------
+
+@functools.lru_cache(maxsize=ALIAS_TABLE_CACHE_SIZE)
+def sample_table(sample):
+    """
+    Return a tuple of (Dictionary, AliasTable of codes) for sampling the values
+    of the sample model with the given ID (see samples.models) in proportion to
+    their weights.
+
+    Raises KeyError if there is no such model.
+    """
+
+    model = samples.models.get(sample)
+    if model is None:
+        raise KeyError("no such sample model: "+str(sample))
+
+    return (Dictionary(model.values),
+        sampling.AliasTable(range(len(model.values)), model.weights))
+
+def sampled(sample, rng=random, offset=0):
+    """
+    Yield a random value of an uploaded sample (as a code into the first item of
+    sample_table(sample)), with values as common as they are in the sample.
+    """
+
+    (_, table) = sample_table(sample)
+    return sample_forever(table, rng)
 
 # Contact Detail Generators
 # --------------------
 
-def phone_number():
+def phone_number(rng=random, offset=0):
     """Yield a random phone number (UK format) as a string."""
 
     while True:
-        yield "".join(str(random.randint(0, 9)) for _ in range(11))
+        yield "".join(str(rng.randint(0, 9)) for _ in range(11))
 
 # Number Generators
 # --------------------
@@ -69,7 +276,9 @@ def number_sequence(
         start=0,
         step=1,
         sequenceType="infinite",
-        loopingSequenceParams=None):
+        loopingSequenceParams=None,
+        rng=random,
+        offset=0):
     """
     Yield the next value in the sequence.
     
@@ -84,31 +293,56 @@ def number_sequence(
     if is_infinite:
         # If it is infinite, this will 'catch' the function - this bit will
         # never end (as a sequence)
+        i = start + step * offset
         while True:
-            yield start
-            start += step
+            yield i
+            i += step
 
     if sequenceType == "looping":
+        loop_at = loopingSequenceParams["loopAt"]
+
+        # Start part-way through the loop that offset is in (if the loop has
+        # any values in it)
+        i = start
+        loop_length = int((loop_at - start) // step) + 1
+        if loop_length > 0:
+            i = start + step * (offset % loop_length)
+
         while True:
-            i = start
             if step < 0:
-                while i >= loopingSequenceParams["loopAt"]:
+                while i >= loop_at:
                     yield i
                     i += step
             elif step > 0:
-                while i <= loopingSequenceParams["loopAt"]:
+                while i <= loop_at:
                     yield i
                     i += step
+            i = start
 
-round_fn = round # Keep a reference to this **BUILT-IN FUNCTION**
-def random_number(start=0, end=1, round=1):
+def random_number(
+        start=0,
+        end=1,
+        round=1,
+        distribution="uniform",
+        exponent=1,
+        rng=random,
+        offset=0):
     """
     Return a random number between start and end (inclusive), rounded to the
     nearest multiple of round.
+
+    If distribution is 'zipf', the multiples of round between start and end
+    follow a Zipf distribution with the given exponent instead, with smaller
+    values being more common. This is useful for foreign keys, where some
+    parent records should be referenced far more often than others.
     """
 
+    if distribution == "zipf":
+        yield from sample_forever(
+            zipf_number_table(start, end, round, exponent), rng)
+
     while True:
-        rnd = random.uniform(start, end)
+        rnd = rng.uniform(start, end)
         yield round_fn(round * round_fn(rnd / round), len(str(round)))
 
 # Public Collection
@@ -120,5 +354,26 @@ generators = {
     "surname": surname,
     "phoneNumber": phone_number,
     "numberSequence": number_sequence,
-    "randomNumber": random_number
+    "randomNumber": random_number,
+    "sampled": sampled
+}
+
+# The type of the values of each generator, for type-checking the expressions
+# of derived fields (see expressions), or None if they may be of any type
+value_types = {
+    "null": None,
+    "forename": "string",
+    "surname": "string",
+    "phoneNumber": "string",
+    "numberSequence": "number",
+    "randomNumber": "number",
+    "sampled": None
+}
+
+# The dictionaries of the generators that are dictionary-encoded, as functions
+# of the generators' settings
+dictionaries = {
+    "forename": lambda settings: DICTIONARIES["forenames"],
+    "surname": lambda settings: DICTIONARIES["surnames"],
+    "sampled": lambda settings: sample_table(settings["sample"])[0]
 }
@@ -0,0 +1,454 @@
+import os
+import re
+import time
+import threading
+from components import exceptions, shared_state
+
+# Job IDs are chosen by the client, so are limited to something that is safe to
+# put in a URL (eg. a UUID)
+JOB_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+# Why work was cancelled
+CANCELLED = "cancelled" # Explicitly, eg. by a client cancelling its job
+DEADLINE = "deadline" # Its deadline passed
+DISCONNECTED = "disconnected" # The client stopped reading the response
+
+class Cancellation:
+    """
+    A token that long-running work checks (with check()) between chunks or
+    batches of records, so that it stops soon after the token is cancelled, or
+    after its deadline (a time.monotonic() time, if not None) passes.
+
+    Any thread may cancel the token. Only the first reason given is kept.
+    """
+
+    def __init__(self, deadline=None):
+        self.deadline = deadline
+        self.reason = None
+
+    def cancel(self, reason):
+        if self.reason is None:
+            self.reason = reason
+
+    @property
+    def cancelled(self):
+        if (
+            self.reason is None and self.deadline is not None and
+            time.monotonic() >= self.deadline
+        ):
+            self.reason = DEADLINE
+        return self.reason is not None
+
+    def check(self):
+        """Raise exceptions.CancelledError if the token is cancelled."""
+
+        if self.cancelled:
+            raise exceptions.CancelledError(self.reason)
+
+class _FlaggedCancellation(Cancellation):
+    """
+    A Cancellation that is also cancelled (explicitly) by creating the file at
+    flag_path, so that other processes can cancel it.
+    """
+
+    def __init__(self, flag_path, deadline=None):
+        super().__init__(deadline)
+        self.flag_path = flag_path
+
+    @property
+    def cancelled(self):
+        if self.reason is None and os.path.exists(self.flag_path):
+            self.reason = CANCELLED
+        return super().cancelled
+
+class Job:
+    """
+    The progress of one generation, as reported to clients while it runs.
+
+    The counters are updated by the thread doing the generation (once per chunk
+    or batch, via generated() and encoded()) without any locking, and read by
+    other threads via snapshot(), so keeping them up to date is cheap.
+
+    A job finishes as 'done', 'failed' or (if its cancellation was cancelled)
+    'cancelled'.
+    """
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.stage = "queued"
+        self.status = None # The HTTP status of the response, once finished
+
+        self.created = time.monotonic()
+        self.started = None
+        self.finished = None
+
+        self.total_rows = {}
+        self.generated_rows = {}
+        self.encoded_rows = 0
+        self.encoded_bytes = 0
+
+        # (runs, merge passes) of each table sorted by orderBy, once sorted
+        self.sorts = {}
+
+        # Cancelling this cancels the generation
+        self.cancellation = Cancellation()
+
+        self._done = threading.Event()
+
+    def start(self, tables_spec):
+        """Start generating the given tables (after being queued)."""
+
+        self.total_rows = {
+            table_spec["name"]: table_spec["settings"]["numRecords"]
+            for table_spec in tables_spec}
+        self.generated_rows = {name: 0 for name in self.total_rows}
+        self.started = time.monotonic()
+        self.stage = "generating"
+
+    def generated(self, table_name, num_rows):
+        """Record that num_rows more rows of the given table were generated."""
+
+        self.generated_rows[table_name] += num_rows
+
+    def sorted(self, table_name, runs, merge_passes):
+        """
+        Record that the given table was sorted in the given number of runs and
+        merge passes (see sorting.SortedRecords).
+        """
+
+        self.sorts[table_name] = (runs, merge_passes)
+
+    def encoding(self):
+        self.stage = "encoding"
+
+    def encoded(self, num_rows, num_bytes):
+        """Record that num_rows more rows were encoded, taking num_bytes."""
+
+        self.encoded_rows += num_rows
+        self.encoded_bytes += num_bytes
+
+    def cancel(self):
+        """Cancel the job (see Cancellation)."""
+
+        self.cancellation.cancel(CANCELLED)
+
+    def finish(self, status):
+        """
+        Finish the job, with the given HTTP status. Only the first call has any
+        effect.
+        """
+
+        if self.finished is not None:
+            return
+
+        self.status = status
+        if self.cancellation.reason is not None:
+            self.stage = "cancelled"
+        else:
+            self.stage = "done" if status < 400 else "failed"
+        self.finished = time.monotonic()
+        self._done.set()
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds for the job to finish."""
+
+        return self._done.wait(timeout)
+
+    def _table_snapshot(self, name):
+        snapshot = {
+            "rows": self.generated_rows[name],
+            "totalRows": self.total_rows[name]
+        }
+        if name in self.sorts:
+            (snapshot["sortRuns"], snapshot["mergePasses"]) = self.sorts[name]
+        return snapshot
+
+    def snapshot(self):
+        """Return the progress of the job, as a JSON-serialisable dict."""
+
+        total_rows = sum(self.total_rows.values())
+        generated_rows = sum(self.generated_rows.values())
+
+        # Generating and encoding each row are counted as equal amounts of work
+        eta = None
+        if self.stage in ("generating", "encoding"):
+            fraction = (
+                (generated_rows + self.encoded_rows) / (2 * total_rows)
+                if total_rows > 0 else 1)
+            if fraction > 0:
+                elapsed = time.monotonic() - self.started
+                eta = elapsed * (1 - fraction) / fraction
+        elif self.stage == "done":
+            eta = 0
+
+        return {
+            "id": self.id,
+            "stage": self.stage,
+            "status": self.status,
+            "cancelReason": self.cancellation.reason,
+            "tables": {
+                name: self._table_snapshot(name) for name in self.total_rows
+            },
+            "rows": generated_rows,
+            "totalRows": total_rows,
+            "encodedRows": self.encoded_rows,
+            "bytesEncoded": self.encoded_bytes,
+            "etaSeconds": eta
+        }
+
+class JobRegistry:
+    """
+    The jobs that are running, or that finished within the last retention
+    seconds (so that clients can still see how they finished).
+    """
+
+    def __init__(self, retention):
+        self.retention = retention
+
+        self._lock = threading.Condition()
+        self._jobs = {}
+
+    def _expire(self):
+        now = time.monotonic()
+        for (job_id, job) in list(self._jobs.items()):
+            if job.finished is not None and now - job.finished > self.retention:
+                del self._jobs[job_id]
+
+    def create(self, job_id):
+        """
+        Create and return a new job with the given ID.
+
+        Raises ValueError if the ID is not valid, or KeyError if a job with that
+        ID is already running (or recently finished).
+        """
+
+        if JOB_ID_PATTERN.fullmatch(job_id) is None:
+            raise ValueError("invalid job ID: "+job_id)
+
+        with self._lock:
+            self._expire()
+            if job_id in self._jobs:
+                raise KeyError(job_id)
+
+            job = Job(job_id)
+            self._jobs[job_id] = job
+            self._lock.notify_all()
+            return job
+
+    def get(self, job_id, timeout=0):
+        """
+        Return the job with the given ID, waiting up to timeout seconds for it
+        to be created (as clients may ask for a job before starting it). Return
+        None if there is no such job.
+        """
+
+        with self._lock:
+            self._lock.wait_for(lambda: job_id in self._jobs, timeout)
+            self._expire()
+            return self._jobs.get(job_id)
+
+# At most how often (in seconds) a shared job publishes its progress
+PUBLISH_INTERVAL = 0.1
+
+class SharedJob(Job):
+    """
+    A job that publishes its progress to the file at path (whenever its stage
+    changes, and otherwise at most every PUBLISH_INTERVAL seconds), and that is
+    cancelled if the file at path+".cancel" is created, so that it can be
+    followed and cancelled from other processes (see SharedJobRegistry).
+    """
+
+    def __init__(self, job_id, path):
+        super().__init__(job_id)
+        self.path = path
+        self.cancellation = _FlaggedCancellation(path+".cancel")
+
+        self._published = None
+        self._publish(True)
+
+    def _publish(self, force=False):
+        now = time.monotonic()
+        if (
+            not force and self._published is not None and
+            now - self._published < PUBLISH_INTERVAL
+        ):
+            return
+
+        self._published = now
+        shared_state.write_json(self.path, {
+            "pid": os.getpid(),
+            "finished": None if self.finished is None else time.time(),
+            "snapshot": self.snapshot()
+        })
+
+    def start(self, tables_spec):
+        super().start(tables_spec)
+        self._publish(True)
+
+    def generated(self, table_name, num_rows):
+        super().generated(table_name, num_rows)
+        self._publish()
+
+    def sorted(self, table_name, runs, merge_passes):
+        super().sorted(table_name, runs, merge_passes)
+        self._publish()
+
+    def encoding(self):
+        super().encoding()
+        self._publish(True)
+
+    def encoded(self, num_rows, num_bytes):
+        super().encoded(num_rows, num_bytes)
+        self._publish()
+
+    def cancel(self):
+        super().cancel()
+        self._publish(True)
+
+    def finish(self, status):
+        if self.finished is None:
+            super().finish(status)
+            self._publish(True)
+
+class PublishedJob:
+    """
+    A job as last published by a SharedJob, which may be running in another
+    process. It has the parts of the interface of Job that clients of a job
+    use.
+
+    The published progress is read when this is created, and again by wait().
+    If the job's process exits without finishing it (eg. if the process was
+    killed), then the job is taken to have failed.
+    """
+
+    def __init__(self, path, published):
+        self.path = path
+        self._published = published
+        self._check_alive()
+
+    def _check_alive(self):
+        published = self._published
+        if (
+            published["finished"] is None and
+            not shared_state.process_alive(published["pid"])
+        ):
+            published["finished"] = time.time()
+            published["snapshot"].update(
+                stage="failed", status=500, etaSeconds=None)
+
+    @property
+    def id(self):
+        return self._published["snapshot"]["id"]
+
+    @property
+    def finished(self):
+        return self._published["finished"]
+
+    def cancel(self):
+        """Cancel the job (see SharedJob)."""
+
+        open(self.path+".cancel", "a").close()
+        if self._published["snapshot"]["cancelReason"] is None:
+            self._published["snapshot"]["cancelReason"] = CANCELLED
+
+    def wait(self, timeout):
+        """
+        Wait up to timeout seconds for the job to finish, reading its progress
+        as it is published.
+        """
+
+        deadline = time.monotonic() + timeout
+        while True:
+            published = shared_state.read_json(self.path)
+            if published is not None:
+                self._published = published
+                self._check_alive()
+            if self.finished is not None:
+                return True
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(remaining, shared_state.POLL_INTERVAL))
+
+    def snapshot(self):
+        """Return the progress of the job, as last read."""
+
+        return self._published["snapshot"]
+
+class SharedJobRegistry:
+    """
+    As JobRegistry, but the jobs are shared by every process that uses the same
+    directory (eg. the workers of a production server, see gunicorn.conf.py).
+
+    Jobs are created as SharedJobs, publishing their progress to a file per job
+    in directory, and are got as PublishedJobs, which read it.
+    """
+
+    def __init__(self, directory, retention):
+        self.directory = directory
+        self.retention = retention
+
+        os.makedirs(directory, exist_ok=True)
+        self._lock_path = os.path.join(directory, "jobs.lock")
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, job_id+".job")
+
+    def _expire(self):
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith(".job"):
+                continue
+
+            path = os.path.join(self.directory, name)
+            published = shared_state.read_json(path)
+            if published is None:
+                continue
+            job = PublishedJob(path, published)
+            if job.finished is not None and now - job.finished > self.retention:
+                for expired_path in (path, path+".cancel"):
+                    try:
+                        os.remove(expired_path)
+                    except FileNotFoundError:
+                        pass
+
+    def create(self, job_id):
+        """As JobRegistry.create(), but create a SharedJob."""
+
+        if JOB_ID_PATTERN.fullmatch(job_id) is None:
+            raise ValueError("invalid job ID: "+job_id)
+
+        with shared_state.locked(self._lock_path):
+            self._expire()
+            path = self._path(job_id)
+            if os.path.exists(path):
+                raise KeyError(job_id)
+
+            # A job that expired may have been cancelled after it finished
+            try:
+                os.remove(path+".cancel")
+            except FileNotFoundError:
+                pass
+            return SharedJob(job_id, path)
+
+    def get(self, job_id, timeout=0):
+        """
+        As JobRegistry.get(), but return a PublishedJob (or None if there is no
+        such job).
+        """
+
+        if JOB_ID_PATTERN.fullmatch(job_id) is None:
+            return None
+
+        path = self._path(job_id)
+        deadline = time.monotonic() + timeout
+        while not os.path.exists(path) and time.monotonic() < deadline:
+            time.sleep(shared_state.POLL_INTERVAL)
+
+        with shared_state.locked(self._lock_path):
+            self._expire()
+            published = shared_state.read_json(path)
+        if published is None:
+            return None
+        return PublishedJob(path, published)
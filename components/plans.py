@@ -0,0 +1,383 @@
+import json
+import random
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from functools import partial
+from itertools import islice, repeat
+from components import generators, expressions
+
+# How many records to generate per chunk. Each chunk of each field is seeded
+# separately, so changing this changes the data generated for a given seed.
+CHUNK_RECORDS = 10000
+
+# How many compiled table plans to keep
+PLAN_CACHE_SIZE = 256
+
+# Seeding
+# --------------------------------------------------
+
+_system_random = random.SystemRandom()
+
+def new_seed():
+    """
+    Return a new seed, drawn from the operating system's source of randomness
+    (so that it is unpredictable, and safe to draw from any thread or process).
+    """
+
+    return _system_random.randrange(2**63)
+
+def derive_seed(seed, *keys):
+    """
+    Derive a new seed from the given seed and keys.
+
+    The same seed and keys always derive the same new seed, but (in practice)
+    different keys derive unrelated seeds.
+    """
+
+    digest = hashlib.sha256(json.dumps([seed] + list(keys)).encode("utf-8"))
+    return int.from_bytes(digest.digest()[:8], "big")
+
+def chunk_rng(seed, table_name, field_name, chunk):
+    """
+    Return a random.Random for the given chunk (by index) of the given field.
+
+    If seed is None, the returned Random is seeded unpredictably. Otherwise, it
+    is seeded from the seed, the table and field names, and the chunk, so that:
+    - each field's values only depend on the seed and its own spec, not on
+      which other tables or fields are generated (or how many of their records
+      are), and
+    - each chunk of a field can be generated independently of the others (eg.
+      in parallel, or on another machine).
+    """
+
+    if seed is None:
+        return random.Random()
+    return random.Random(derive_seed(seed, table_name, field_name, chunk))
+
+def spec_hash(spec):
+    """
+    Return a hash of the structure of the given (JSON-like) spec, ie. one that
+    does not depend on the order of keys in its objects.
+    """
+
+    return hashlib.sha256(
+        json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()
+
+# Plans
+# --------------------------------------------------
+
+class TablePlan:
+    """
+    A table spec compiled into everything needed to generate it, so that
+    generating each record does not need to look anything up in the spec.
+
+    Plans hold no generation state, so one plan can be executed any number of
+    times, including concurrently.
+    """
+
+    def __init__(self,
+            name, num_records, fields, field_names, field_hashes, constructors,
+            dictionaries, part_limits=None, order_by=None, derivations=()):
+        self.name = name
+        self.num_records = num_records
+
+        # The indexes of the fields to sort the table's records by (most
+        # significant first), or None if they are output in generated order
+        self.order_by = order_by
+
+        # The limits on the parts that the table is written in (in the form
+        # {"rows": <int or None>, "bytes": <int or None>}), or None if it is
+        # written as a single file
+        self.part_limits = part_limits
+
+        # The 'field info' dicts of the table, as documented in
+        # generate.generate_tables()
+        self.fields = fields
+        self.field_names = field_names
+
+        # The spec_hash() of each field's spec (and, for derived fields, of the
+        # specs of the fields they depend on)
+        self.field_hashes = field_hashes
+
+        # A generator constructor for each field, with all of its settings
+        # already bound, except rng and offset, or None for derived fields
+        self.constructors = constructors
+
+        # A tuple of (index, expressions.Expression, indexes of the fields it
+        # references) for each derived field, in an order in which every field
+        # comes after the derived fields it references
+        self.derivations = derivations
+
+        # The generators.Dictionary of each dictionary-encoded field, or None
+        # for fields whose values are generated as-is
+        self.dictionaries = dictionaries
+
+    def _chunk_ranges(self, num_records, start):
+        """
+        Generate a tuple of (chunk index, first record, number of records) for
+        each chunk of the records from start, ending on multiples of
+        CHUNK_RECORDS.
+        """
+
+        if num_records is None:
+            num_records = self.num_records - start
+
+        position = start
+        stop = start + num_records
+        while position < stop:
+            chunk = position // CHUNK_RECORDS
+            size = min(stop, (chunk + 1) * CHUNK_RECORDS) - position
+            yield (chunk, position, size)
+            position += size
+
+    def field_chunks(self, index, seed=None, num_records=None, start=0):
+        """
+        Lazily generate the values of the field at the given index (which must
+        not be a derived field) for the records from start onwards, one chunk
+        (a list of up to CHUNK_RECORDS values) at a time. The chunks of
+        dictionary-encoded fields are arrays of codes (see generators.Dictionary)
+        instead.
+
+        Each generated field's values are independent of every other field's,
+        so those fields of a table may be generated separately. Any range of
+        records of a field can also be generated separately, though it is
+        fastest if start is a multiple of CHUNK_RECORDS. Chunks end on
+        multiples of CHUNK_RECORDS.
+        """
+
+        constructor = self.constructors[index]
+        field_name = self.field_names[index]
+        dictionary = self.dictionaries[index]
+        to_chunk = list if dictionary is None else dictionary.encode
+
+        for (chunk, position, size) in self._chunk_ranges(num_records, start):
+            chunk_start = chunk * CHUNK_RECORDS
+            generator = constructor(
+                rng=chunk_rng(seed, self.name, field_name, chunk),
+                offset=chunk_start)
+
+            # Skip to the start, if it is part-way through the chunk
+            if position > chunk_start:
+                deque(islice(generator, position - chunk_start), maxlen=0)
+
+            yield to_chunk(islice(generator, size))
+
+    def assemble(self, sources, num_records=None, start=0):
+        """
+        Lazily generate chunks of records (as chunks() does) from sources: an
+        iterable of chunks for each field (as generated by field_chunks()), or
+        None for each derived field that is to be derived.
+
+        Derived fields are derived from the other fields of each chunk, in
+        order of their dependencies, so every field is generated only once.
+        """
+
+        if len(sources) == 0:
+            return
+
+        sources = [iter(source) if source is not None else None
+            for source in sources]
+        for (_, _, size) in self._chunk_ranges(num_records, start):
+            columns = [next(source) if source is not None else None
+                for source in sources]
+
+            for (index, expression, dependencies) in self.derivations:
+                if columns[index] is None:
+                    columns[index] = expression.evaluate({
+                        self.field_names[dependency]: (
+                            columns[dependency]
+                            if self.dictionaries[dependency] is None
+                            else self.dictionaries[dependency].decode(
+                                columns[dependency]))
+                        for dependency in dependencies
+                    }, size)
+
+            yield columns
+
+    def chunks(self, seed=None, num_records=None, start=0):
+        """
+        Lazily generate the records of the table, one chunk at a time. Each
+        chunk is a list of columns (one for each field), each of which is a
+        list of up to CHUNK_RECORDS values.
+
+        If num_records is not given, the table's records from start to
+        numRecords are generated.
+        """
+
+        return self.assemble([
+            self.field_chunks(index, seed, num_records, start)
+            if constructor is not None else None
+            for (index, constructor) in enumerate(self.constructors)
+        ], num_records, start)
+
+    def records(self, seed=None, num_records=None, start=0):
+        """
+        Lazily generate the records of the table, as tuples of (decoded)
+        values.
+
+        See chunks() for the parameters.
+        """
+
+        if len(self.constructors) == 0:
+            # zip() of no columns would produce no records
+            return repeat((),
+                self.num_records - start if num_records is None
+                else num_records)
+
+        return (record
+            for columns in self.chunks(seed, num_records, start)
+            for record in zip(*decode(columns, self.dictionaries)))
+
+def decode(columns, dictionaries):
+    """
+    Return the given chunk of columns with the dictionary-encoded ones (ie.
+    those with a dictionary in dictionaries) decoded.
+    """
+
+    return [
+        column if dictionary is None else dictionary.decode(column)
+        for (column, dictionary) in zip(columns, dictionaries)]
+
+class ChunkedRecords:
+    """
+    The lazily generated records of a table. Iterating over it generates the
+    records, as TablePlan.records() does. Alternatively, chunks() generates
+    them column-wise, as TablePlan.chunks() does, which storage.ColumnStore
+    also supports.
+
+    Either way, the records can only be generated once.
+    """
+
+    def __init__(self, plan, seed, num_records, start=0):
+        self.dictionaries = plan.dictionaries
+        self.num_records = num_records
+        self._plan = plan
+        self._args = (seed, num_records, start)
+
+    def chunks(self):
+        return self._plan.chunks(*self._args)
+
+    def __iter__(self):
+        return self._plan.records(*self._args)
+
+    def __len__(self):
+        return self.num_records
+
+def compile_field(field_spec):
+    """
+    Return the generator constructor for the given field_spec, or None if it
+    is a derived field.
+    """
+
+    gen_settings = field_spec["settings"]["dataType"]
+    data_type = gen_settings["dataType"]
+    if data_type == "derived":
+        return None
+
+    # Get the generator
+    # If the generator is in the schema's enum, but not defined in the generator
+    # module - that would be an 'internal server error'! So don't catch it.
+    generator_constructor = generators.generators[data_type]
+
+    # If there are any parameters for this generator, bind them
+    if data_type in gen_settings:
+        return partial(generator_constructor, **gen_settings[data_type])
+    else:
+        return generator_constructor
+
+def compile_dictionary(field_spec):
+    """
+    Return the generators.Dictionary of the given field_spec's generator, or None
+    if it is not dictionary-encoded.
+    """
+
+    gen_settings = field_spec["settings"]["dataType"]
+    data_type = gen_settings["dataType"]
+
+    dictionary_for = generators.dictionaries.get(data_type)
+    if dictionary_for is None:
+        return None
+    return dictionary_for(gen_settings.get(data_type, {}))
+
+def _compile_table(table_spec):
+    settings = table_spec["settings"]
+    part_limits = None
+    if "maxRowsPerFile" in settings or "maxBytesPerFile" in settings:
+        part_limits = {
+            "rows": settings.get("maxRowsPerFile"),
+            "bytes": settings.get("maxBytesPerFile")
+        }
+
+    field_names = [field_spec["name"] for field_spec in table_spec["fields"]]
+    field_hashes = [spec_hash(field_spec) for field_spec in table_spec["fields"]]
+
+    # Derived fields' values change when the fields they depend on do, so are
+    # hashed along with them
+    derivations = []
+    for (name, expression) in expressions.derived_fields(table_spec):
+        index = field_names.index(name)
+        dependencies = [
+            field_names.index(reference)
+            for reference in expression.references]
+        field_hashes[index] = spec_hash([field_hashes[index]] + [
+            field_hashes[dependency] for dependency in dependencies])
+        derivations.append((index, expression, dependencies))
+
+    order_by = None
+    if "orderBy" in settings:
+        order_by = [field_names.index(name) for name in settings["orderBy"]]
+
+    fields = []
+    for field_spec in table_spec["fields"]:
+        # Field Key Settings Spec
+        fkss = field_spec["settings"]["keySettings"]
+
+        fields.append({
+            "name": field_spec["name"],
+            "primary_key": fkss["primaryKey"],
+            "foreign_key":
+                fkss["foreignKeyParams"] if fkss["foreignKey"] else None
+        })
+
+    return TablePlan(
+        table_spec["name"],
+        table_spec["settings"]["numRecords"],
+        fields,
+        field_names,
+        field_hashes,
+        [compile_field(field_spec) for field_spec in table_spec["fields"]],
+        [
+            compile_dictionary(field_spec)
+            for field_spec in table_spec["fields"]
+        ],
+        part_limits,
+        order_by,
+        derivations)
+
+# Compiled plans, by spec_hash() of their table spec, least recently used first
+_plan_cache = OrderedDict()
+_plan_cache_lock = threading.Lock()
+
+def compile_table(table_spec):
+    """
+    Compile the given (validated) table_spec into a TablePlan.
+
+    Plans are cached by the structure of their spec, so compiling a table spec
+    that is equivalent to a recently compiled one returns the same plan.
+    """
+
+    key = spec_hash(table_spec)
+    with _plan_cache_lock:
+        if key in _plan_cache:
+            _plan_cache.move_to_end(key)
+            return _plan_cache[key]
+
+    plan = _compile_table(table_spec)
+
+    with _plan_cache_lock:
+        _plan_cache[key] = plan
+        while len(_plan_cache) > PLAN_CACHE_SIZE:
+            _plan_cache.popitem(last=False)
+
+    return plan
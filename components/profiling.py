@@ -0,0 +1,89 @@
+import os
+import time
+import cProfile
+import threading
+from contextlib import contextmanager, nullcontext
+
+class NullProfile:
+    """
+    A profile that records nothing, used for requests that are not profiled.
+
+    Its methods do as little as possible, so that instrumented code costs
+    (practically) nothing when profiling is disabled.
+    """
+
+    enabled = False
+
+    _null_stage = nullcontext()
+
+    def stage(self, name):
+        return self._null_stage
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+class Profile:
+    """
+    Profiles a request with cProfile, and records the wall and CPU time of each
+    of its stages.
+
+    Stages are marked with the stage() context manager. CPU time is that of the
+    current thread only, so it excludes other requests being served at the
+    same time.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+
+        # A list of (name, wall seconds, CPU seconds) tuples, in the order that
+        # the stages finished
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            self.stages.append((name,
+                time.perf_counter() - wall_start,
+                time.thread_time() - cpu_start))
+
+    def start(self):
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+
+    def server_timing(self):
+        """
+        Return the stage times in the format of a 'Server-Timing' header value,
+        in milliseconds. Each stage has a wall time metric (named after the
+        stage) and a CPU time metric (with '-cpu' appended to its name).
+        """
+
+        metrics = []
+        for (name, wall, cpu) in self.stages:
+            metrics.append(name+";dur="+"{:.3f}".format(wall * 1000))
+            metrics.append(name+"-cpu;dur="+"{:.3f}".format(cpu * 1000))
+        return ", ".join(metrics)
+
+    def save(self, directory, tag):
+        """
+        Save the profile (in the format of the pstats module) into directory,
+        with a file name starting with tag, and return its path.
+        """
+
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "-".join([
+            tag, time.strftime("%Y%m%dT%H%M%S"),
+            str(os.getpid()), str(threading.get_ident())
+        ])+".prof")
+        self.profiler.dump_stats(path)
+        return path
@@ -0,0 +1,82 @@
+import os
+import posixpath
+import threading
+import time
+
+def is_inside(path):
+    """
+    Return whether the given '/'-separated path, relative to a directory, leads
+    to something inside that directory (rather than the directory itself, or
+    anything outside of it).
+    """
+
+    path = posixpath.normpath(path)
+    return not (
+        path in (".", "..") or path.startswith("../") or
+        posixpath.isabs(path))
+
+class ResourceIndex:
+    """
+    An in-memory index of the files under a directory (the 'root').
+
+    Looking up a file in the index does not touch the file system. Instead, the
+    index checks whether any directory under root has changed (which happens
+    whenever a file is added, removed or renamed) at most once every
+    check_interval seconds, and rebuilds itself if one has.
+    """
+
+    def __init__(self, root, check_interval=1):
+        self.root = root
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._files = frozenset()
+        self._dir_mtimes = None
+        self._next_check = 0
+
+    def _dir_mtimes_now(self):
+        dir_mtimes = {}
+        for (dir_path, _, _) in os.walk(self.root):
+            try:
+                dir_mtimes[dir_path] = os.stat(dir_path).st_mtime_ns
+            except FileNotFoundError:
+                pass # Removed while walking - the next check will see it
+        return dir_mtimes
+
+    def _scan(self):
+        files = set()
+        for (dir_path, _, file_names) in os.walk(self.root):
+            rel_dir = os.path.relpath(dir_path, self.root)
+            for file_name in file_names:
+                files.add(posixpath.normpath(posixpath.join(
+                    rel_dir.replace(os.sep, "/"), file_name)))
+        return frozenset(files)
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+
+        with self._lock:
+            if now < self._next_check:
+                return # Another thread got here first
+
+            dir_mtimes = self._dir_mtimes_now()
+            if dir_mtimes != self._dir_mtimes:
+                self._files = self._scan()
+                self._dir_mtimes = dir_mtimes
+            self._next_check = now + self.check_interval
+
+    def contains(self, path):
+        """
+        Return whether the given path (relative to root, '/'-separated) is a
+        file in the index.
+
+        Paths that lead outside of root are never in the index.
+        """
+
+        if not is_inside(path):
+            return False
+
+        self._refresh()
+        return posixpath.normpath(path) in self._files
@@ -0,0 +1,339 @@
+"""
+Value/frequency models of uploaded sample data, for generating data that looks
+like it.
+
+A model is built from one column of a sample (CSV or NDJSON) in a single
+streaming pass, in memory bounded by the number of values kept, however big the
+sample is:
+- a Misra-Gries summary counts the most frequent values ('heavy hitters'), so
+  that they are reproduced at (about) their frequency in the sample, and
+- a reservoir sample (Algorithm L) keeps a uniformly random selection of rows,
+  which stands in for the long tail of less frequent values.
+
+Models are identified by a hash of the sample (and which column of it they
+model), so uploading the same sample twice gives the same model.
+"""
+
+import io
+import os
+import csv
+import json
+import math
+import heapq
+import random
+import pickle
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+from components import consts
+
+# Model IDs are hex SHA-256 hashes, so are safe to use as file names
+MODEL_ID_LENGTH = 64
+MODEL_ID_CHARS = frozenset("0123456789abcdef")
+
+# How much of a sample to read at a time
+READ_SIZE = 1024 * 1024
+
+FORMATS = ("csv", "ndjson")
+
+def valid_model_id(model_id):
+    return (
+        isinstance(model_id, str) and len(model_id) == MODEL_ID_LENGTH and
+        MODEL_ID_CHARS.issuperset(model_id))
+
+# Building
+# --------------------------------------------------
+
+class ModelBuilder:
+    """
+    Builds a SampleModel from a stream of values, keeping at most
+    reservoir_size + 2 * heavy_hitters values in memory.
+
+    The reservoir is sampled with a fixed seed, so the same values always build
+    the same model.
+    """
+
+    def __init__(self,
+            reservoir_size=consts.SAMPLE_RESERVOIR_SIZE,
+            heavy_hitters=consts.SAMPLE_HEAVY_HITTERS):
+        self.rows = 0
+
+        # Misra-Gries, with decrements done in batches: the counters may grow
+        # to 2k values, then every counter is reduced by the (k+1)th largest
+        # count, leaving at most k. Each count is then an underestimate, by at
+        # most the total decremented (which is at most rows / (k+1)).
+        self._heavy_hitters = heavy_hitters
+        self._counts = {}
+        self._decremented = 0
+
+        # Algorithm L: rather than drawing a random number per row, draw how
+        # many rows to skip before the next one that replaces a random value
+        # in the reservoir
+        self._rng = random.Random(0)
+        self._reservoir_size = reservoir_size
+        self._reservoir = []
+        self._w = math.exp(math.log(self._rng.random()) / reservoir_size)
+        self._next = reservoir_size + self._skip()
+
+    def _skip(self):
+        return int(math.log(self._rng.random()) / math.log(1 - self._w))
+
+    def _reduce_counts(self):
+        threshold = heapq.nlargest(
+            self._heavy_hitters + 1, self._counts.values())[-1]
+        self._decremented += threshold
+        self._counts = {
+            value: count - threshold
+            for (value, count) in self._counts.items()
+            if count > threshold}
+
+    def extend(self, values):
+        """Add every value of the given iterable to the model."""
+
+        counts = self._counts
+        max_counts = 2 * self._heavy_hitters
+        reservoir = self._reservoir
+        reservoir_size = self._reservoir_size
+        rows = self.rows
+
+        for value in values:
+            if value in counts:
+                counts[value] += 1
+            else:
+                counts[value] = 1
+                if len(counts) > max_counts:
+                    self._reduce_counts()
+                    counts = self._counts
+
+            if rows < reservoir_size:
+                reservoir.append(value)
+            elif rows == self._next:
+                reservoir[self._rng.randrange(reservoir_size)] = value
+                self._w *= math.exp(
+                    math.log(self._rng.random()) / reservoir_size)
+                self._next += 1 + self._skip()
+            rows += 1
+
+        self.rows = rows
+
+    def model(self):
+        """
+        Return the SampleModel of the values added so far.
+
+        Values that the counters are sure are frequent (ie. whose count is
+        more than its possible error) are weighted by their estimated count.
+        The rest of the rows are shared equally between the reservoir's other
+        values.
+        """
+
+        if self.rows == 0:
+            raise ValueError("the sample has no values")
+
+        error = self._decremented
+        weights = {
+            value: count + error / 2
+            for (value, count) in self._counts.items()
+            if count > error}
+
+        tail = [value for value in self._reservoir if value not in weights]
+        tail_rows = self.rows - sum(weights.values())
+        if len(tail) > 0 and tail_rows > 0:
+            tail_weight = tail_rows / len(tail)
+            for value in tail:
+                weights[value] = weights.get(value, 0) + tail_weight
+
+        # Most frequent first
+        values = sorted(weights, key=weights.get, reverse=True)
+        return SampleModel(values, [weights[value] for value in values],
+            self.rows)
+
+class SampleModel:
+    """
+    The distinct values of a sample (or the most representative of them), each
+    with its (estimated) number of rows in the sample as its weight.
+    """
+
+    def __init__(self, values, weights, rows):
+        self.values = values
+        self.weights = weights
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.values)
+
+    def summary(self, top=10):
+        """Return a JSON-serialisable summary of the model."""
+
+        return {
+            "rows": self.rows,
+            "values": len(self.values),
+            "top": [
+                {"value": value, "rows": round(weight)}
+                for (value, weight) in zip(self.values[:top], self.weights)]
+        }
+
+class _HashingReader(io.RawIOBase):
+    """A readable binary stream that hashes what is read from another one."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.sha256 = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.stream.read(len(buffer))
+        self.sha256.update(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+def _csv_values(text, column):
+    reader = csv.reader(text)
+    header = next(reader, None)
+    if header is None:
+        raise ValueError("the sample has no header row")
+
+    if column is None:
+        index = 0
+    elif column in header:
+        index = header.index(column)
+    else:
+        raise ValueError("the sample has no column '"+column+"'")
+
+    for (line, row) in enumerate(reader, 2):
+        if len(row) == 0:
+            continue # Blank lines
+        if index >= len(row):
+            raise ValueError(
+                "line "+str(line)+" of the sample has too few columns")
+        yield row[index]
+
+def _ndjson_values(text, column):
+    for (line, row) in enumerate(text, 1):
+        if row.strip() == "":
+            continue
+        try:
+            record = json.loads(row)
+        except ValueError:
+            raise ValueError("line "+str(line)+" of the sample is not JSON")
+
+        if column is None:
+            value = record
+        elif isinstance(record, dict):
+            value = record.get(column)
+        else:
+            raise ValueError(
+                "line "+str(line)+" of the sample is not a JSON object")
+
+        # Values must be hashable to be counted
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value, sort_keys=True)
+        yield value
+
+def build_model(stream, sample_format="csv", column=None, builder=None):
+    """
+    Build a model of one column of the sample read from the given binary
+    stream, in a single pass. Return a tuple of (model_id, model).
+
+    CSV samples must have a header row. column is the name of the column to
+    model, or None for the first column (of a CSV sample) or the whole record
+    (of an NDJSON sample). Raises ValueError if the sample cannot be parsed.
+    """
+
+    if sample_format not in FORMATS:
+        raise ValueError("unknown sample format: "+str(sample_format))
+    if builder is None:
+        builder = ModelBuilder()
+
+    reader = _HashingReader(stream)
+    text = io.TextIOWrapper(io.BufferedReader(reader, READ_SIZE),
+        encoding="utf-8", newline="" if sample_format == "csv" else None)
+    values = (_csv_values if sample_format == "csv" else _ndjson_values)(
+        text, column)
+    try:
+        builder.extend(values)
+    except UnicodeDecodeError:
+        raise ValueError("the sample is not UTF-8")
+    except csv.Error as err:
+        raise ValueError("the sample is not valid CSV: "+str(err))
+
+    model_id = hashlib.sha256(json.dumps(
+        [reader.sha256.hexdigest(), sample_format, column]).encode("utf-8")
+    ).hexdigest()
+    return (model_id, builder.model())
+
+# Storage
+# --------------------------------------------------
+
+class ModelStore:
+    """
+    Stores models by ID on disk (so that they outlive the process, and are
+    shared by every process using the same directory), keeping the most
+    recently used memory_size of them in memory.
+    """
+
+    def __init__(self, directory, memory_size):
+        self.directory = directory
+        self.memory_size = memory_size
+
+        self._lock = threading.Lock()
+        self._models = OrderedDict()
+
+    def _path(self, model_id):
+        return os.path.join(self.directory, model_id+".model")
+
+    def _remember(self, model_id, model):
+        with self._lock:
+            self._models[model_id] = model
+            self._models.move_to_end(model_id)
+            while len(self._models) > self.memory_size:
+                self._models.popitem(last=False)
+
+    def put(self, model_id, model):
+        """Store the given model under the given ID."""
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(model_id)
+        if not os.path.exists(path):
+            # Write atomically, so that other processes never read part of it
+            (fd, tmp_path) = tempfile.mkstemp(dir=self.directory)
+            try:
+                with os.fdopen(fd, "wb") as model_file:
+                    pickle.dump(
+                        (model.values, model.weights, model.rows), model_file)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+
+        self._remember(model_id, model)
+
+    def get(self, model_id):
+        """Return the model with the given ID, or None if there is none."""
+
+        if not valid_model_id(model_id):
+            return None
+
+        with self._lock:
+            model = self._models.get(model_id)
+            if model is not None:
+                self._models.move_to_end(model_id)
+                return model
+
+        try:
+            with open(self._path(model_id), "rb") as model_file:
+                model = SampleModel(*pickle.load(model_file))
+        except FileNotFoundError:
+            return None
+
+        self._remember(model_id, model)
+        return model
+
+    def __contains__(self, model_id):
+        return self.get(model_id) is not None
+
+# The models available to generators
+models = ModelStore(consts.SAMPLE_MODEL_DIR, consts.SAMPLE_MODEL_MEMORY_SIZE)
@@ -0,0 +1,104 @@
+"""
+Weighted sampling from categorical distributions, using the alias method.
+
+An AliasTable takes O(n) time to build for n outcomes, but can then draw each
+sample in O(1) time (a single random number, one table lookup and one
+comparison), however skewed the weights are. Tables are immutable, so they can
+be built once and shared between generators, requests and threads.
+"""
+
+# The most outcomes an AliasTable may have. Tables are built in pure Python
+# (taking around a second per million outcomes) and held in memory.
+MAX_TABLE_SIZE = 2**22
+
+def zipf_weights(n, exponent):
+    """
+    Return the (unnormalised) weights of a Zipf distribution over n ranks, ie.
+    where the k'th outcome (from 1) has weight 1/k**exponent.
+
+    For large exponents, the weights of all but the first few ranks underflow
+    to 0 (rather than their denominators overflowing), so those ranks are
+    never drawn. The first rank always has weight 1.
+    """
+
+    return [rank ** -exponent for rank in range(1, n + 1)]
+
+class AliasTable:
+    """
+    A table for drawing values with probability proportional to their weights,
+    built using Vose's alias method.
+
+    The table divides [0, n) into n unit-wide columns, one per value. Column i
+    is split at threshold[i]: below it is the column's own value, above it is
+    an 'alias' value. Each sample picks a uniformly random point in [0, n),
+    and so needs only one random number.
+    """
+
+    def __init__(self, values, weights):
+        values = list(values)
+        n = len(values)
+        if n == 0 or n != len(weights):
+            raise ValueError(
+                "an alias table needs one weight for each of at least one value")
+
+        total = sum(weights)
+        if total <= 0 or any(weight < 0 for weight in weights):
+            raise ValueError(
+                "alias table weights must be non-negative, and not all zero")
+
+        # Scale so that the mean probability is 1
+        scaled = [weight * n / total for weight in weights]
+        threshold = [1.0] * n
+        alias = list(range(n))
+
+        small = [i for (i, prob) in enumerate(scaled) if prob < 1]
+        large = [i for (i, prob) in enumerate(scaled) if prob >= 1]
+        while small and large:
+            (less, more) = (small.pop(), large.pop())
+
+            # Fill the rest of the small column with the large one ...
+            threshold[less] = scaled[less]
+            alias[less] = more
+
+            # ... which gives up that much of its own probability
+            scaled[more] -= 1 - scaled[less]
+            (small if scaled[more] < 1 else large).append(more)
+
+        # Anything left over is (up to rounding error) exactly 1, so is its own
+        # column entirely. The defaults already say that.
+
+        self.values = values
+        self.aliases = [values[i] for i in alias]
+        self.thresholds = threshold
+        self.size = n
+
+    def __len__(self):
+        return self.size
+
+    def sample(self, rng):
+        """Draw one value, using the given random.Random (or random module)."""
+
+        point = rng.random() * self.size
+        column = int(point)
+        if point - column < self.thresholds[column]:
+            return self.values[column]
+        return self.aliases[column]
+
+    def sample_many(self, rng, count):
+        """
+        Draw count values, as a list.
+
+        This consumes the same randomness as (and so returns the same values
+        as) calling sample() count times, but is several times faster.
+        """
+
+        (random, size) = (rng.random, self.size)
+        (values, aliases, thresholds) = (
+            self.values, self.aliases, self.thresholds)
+
+        return [
+            values[column] if point - column < thresholds[column]
+            else aliases[column]
+            for point in [random() * size for _ in range(count)]
+            for column in (int(point),)
+        ]
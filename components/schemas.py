@@ -1,6 +1,7 @@
 import json
 import jsonschema
 import posixpath
+import threading
 import warnings
 
 from components import consts
@@ -135,6 +136,10 @@ class Schema:
         validator_class.check_schema(self._schema)
         self._validator = validator_class(self._schema)
 
+        # Validators resolve "$ref"s using a stack of scopes that is shared
+        # between calls, so concurrent validations must not interleave
+        self._validator_lock = threading.Lock()
+
     def get(self):
         """
         Return the parsed JSON object representing the schema. This may be
@@ -189,7 +194,8 @@ class Schema:
     def validate(self, obj):
         """Validate the given parsed JSON obj(ect) against this schema."""
 
-        return self._validator.validate(obj)
+        with self._validator_lock:
+            return self._validator.validate(obj)
 
 # Notes
 # --------------------------------------------------
@@ -0,0 +1,338 @@
+"""
+Split generate specs into shards that can be generated independently (eg. on
+different machines), then merge the shards' output.
+
+A shard manifest is a JSON object of the form:
+{
+  "version": 1,
+  "spec": <the generate spec, with a seed>,
+  "shards": [
+    {
+      "id": "<table>-<number>",
+      "table": "<table name>",
+      "start": <index of the shard's first record>,
+      "stop": <index after the shard's last record>
+    },
+    <more shards ...>
+  ]
+}
+
+Every shard is generated with the spec's seed. The randomness of each chunk of
+each field is derived from that seed (see plans.chunk_rng()), so the merged
+output of the shards is identical to generating the whole spec at once.
+
+Each worker writes '<id>.csv' (the shard's records, without a header) and
+'<id>.json' (its record count, size and SHA-256 checksum) into a shared
+directory. Workers claim shards by creating '<id>.claim' in that directory,
+so any number of workers can work through the same manifest.
+"""
+
+import os
+import json
+import codecs
+import hashlib
+import zipfile
+from components import exceptions, plans, generate
+
+MANIFEST_VERSION = 1
+
+# Splitting
+# --------------------------------------------------
+
+def make_manifest(generate_spec, shard_records):
+    """
+    Return a shard manifest for the given (validated) generate_spec, with at
+    most shard_records records per shard.
+
+    Shards are rounded up to a whole number of chunks (plans.CHUNK_RECORDS),
+    as each chunk is generated separately anyway. If the spec has no seed, one
+    is chosen, so that all shards agree on it.
+
+    Raises exceptions.ShardError if any table has orderBy, as the records of
+    sorted tables depend on the whole table, not only on their position.
+    """
+
+    for table_spec in generate_spec["tables"]:
+        if "orderBy" in table_spec["settings"]:
+            raise exceptions.ShardError(
+                "table '"+table_spec["name"]+"' has orderBy, so cannot be "+
+                "split into shards")
+
+    shard_records = max(
+        -(-shard_records // plans.CHUNK_RECORDS) * plans.CHUNK_RECORDS,
+        plans.CHUNK_RECORDS)
+
+    spec = dict(generate_spec, general=dict(generate_spec["general"]))
+    if spec["general"].get("seed") is None:
+        spec["general"]["seed"] = plans.new_seed()
+
+    shards = []
+    for table_spec in spec["tables"]:
+        num_records = table_spec["settings"]["numRecords"]
+        for (number, start) in enumerate(
+                range(0, num_records, shard_records)):
+            shards.append({
+                "id": table_spec["name"]+"-"+"{:06d}".format(number),
+                "table": table_spec["name"],
+                "start": start,
+                "stop": min(start + shard_records, num_records)
+            })
+
+    return {
+        "version": MANIFEST_VERSION,
+        "spec": spec,
+        "shards": shards
+    }
+
+def load_manifest(path):
+    with open(path, encoding="utf-8") as manifest_file:
+        manifest = json.load(manifest_file)
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise exceptions.ShardError(
+            "unsupported shard manifest version: "+str(manifest.get("version")))
+    return manifest
+
+# Working
+# --------------------------------------------------
+
+def _paths(directory, shard_id):
+    base = os.path.join(directory, shard_id)
+    return {
+        "csv": base+".csv",
+        "summary": base+".json",
+        "claim": base+".claim"
+    }
+
+def run_shard(manifest, shard, directory):
+    """
+    Generate the given shard (one of manifest["shards"]) into directory,
+    returning its summary.
+    """
+
+    spec = manifest["spec"]
+    table_spec = next(table_spec for table_spec in spec["tables"]
+        if table_spec["name"] == shard["table"])
+    plan = plans.compile_table(table_spec)
+
+    paths = _paths(directory, shard["id"])
+    num_records = shard["stop"] - shard["start"]
+
+    # Write to temporary files, so that a shard is never seen half-written
+    with open(paths["csv"]+".tmp", "wb", buffering=1024 * 1024) as csv_file:
+        writer = generate.HashingWriter(csv_file)
+        generate.write_csv({
+            "fields": plan.fields,
+            "records": plans.ChunkedRecords(plan,
+                spec["general"]["seed"], num_records, shard["start"])
+        }, writer, with_names=False)
+
+    summary = {
+        "id": shard["id"],
+        "records": num_records,
+        "bytes": writer.bytes,
+        "sha256": writer.sha256.hexdigest()
+    }
+    with open(paths["summary"]+".tmp", "w", encoding="utf-8") as summary_file:
+        json.dump(summary, summary_file)
+
+    os.replace(paths["csv"]+".tmp", paths["csv"])
+    os.replace(paths["summary"]+".tmp", paths["summary"]) # Marks it as done
+    return summary
+
+def claim_shard(shard, directory):
+    """
+    Claim the given shard for this worker, returning whether it was claimed.
+    Shards that are done, or claimed by another worker, cannot be claimed.
+    """
+
+    paths = _paths(directory, shard["id"])
+    if os.path.exists(paths["summary"]):
+        return False
+
+    try:
+        os.close(os.open(paths["claim"], os.O_CREAT | os.O_EXCL))
+    except FileExistsError:
+        return False
+    return True
+
+def work(manifest, directory, shard_ids=None):
+    """
+    Generate shards of the manifest into directory, yielding the summary of
+    each as it is done.
+
+    If shard_ids is given, only those shards are generated (whether or not
+    they are claimed). Otherwise, every shard that can be claimed is.
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    for shard in manifest["shards"]:
+        if shard_ids is None:
+            if not claim_shard(shard, directory):
+                continue
+        elif shard["id"] not in shard_ids:
+            continue
+
+        yield run_shard(manifest, shard, directory)
+
+# Merging
+# --------------------------------------------------
+
+def _shard_data(shard, directory, buffer_size=1024 * 1024):
+    """
+    Yield the CSV of the given shard in directory, in blocks of bytes, then
+    check it against its checksum.
+    """
+
+    paths = _paths(directory, shard["id"])
+    try:
+        with open(paths["summary"], encoding="utf-8") as summary_file:
+            summary = json.load(summary_file)
+    except FileNotFoundError:
+        raise exceptions.ShardError("shard '"+shard["id"]+"' is not done")
+
+    sha256 = hashlib.sha256()
+    with open(paths["csv"], "rb") as csv_file:
+        while True:
+            data = csv_file.read(buffer_size)
+            if len(data) == 0:
+                break
+            sha256.update(data)
+            yield data
+
+    if sha256.hexdigest() != summary["sha256"]:
+        raise exceptions.ShardError(
+            "checksum of shard '"+shard["id"]+"' does not match its summary")
+
+def _copy_shard(shard, directory, output):
+    for data in _shard_data(shard, directory):
+        output.write(data)
+
+def _shard_lines(shard, directory):
+    """
+    Yield the CSV lines (ie. records, without line breaks) of the given shard
+    in directory.
+
+    Quoted values may contain line breaks, so a line break only ends a record
+    if the record so far has an even number of quotes (as quotes in values
+    are doubled).
+    """
+
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    record = None
+    pending = ""
+    for data in _shard_data(shard, directory):
+        pieces = (pending + decoder.decode(data)).split("\n")
+        pending = pieces.pop()
+        for piece in pieces:
+            record = piece if record is None else record+"\n"+piece
+            if record.count('"') % 2 == 0:
+                yield record
+                record = None
+
+    # Every shard has at least one record, and does not end with a line break
+    pending += decoder.decode(b"", final=True)
+    yield pending if record is None else record+"\n"+pending
+
+def _shards_of(manifest, table_name):
+    return sorted(
+        [shard for shard in manifest["shards"] if shard["table"] == table_name],
+        key=lambda shard: shard["start"])
+
+def merge_table(manifest, table_name, directory, output):
+    """
+    Write the CSV of the given table, assembled from its shards in directory,
+    to output (a binary file). The CSV is identical to that which write_csv()
+    would produce for the whole table.
+    """
+
+    table_spec = next(table_spec for table_spec in manifest["spec"]["tables"]
+        if table_spec["name"] == table_name)
+    output.write((",".join(
+        field_spec["name"] for field_spec in table_spec["fields"]
+    )+"\n").encode("utf-8"))
+
+    for (i, shard) in enumerate(_shards_of(manifest, table_name)):
+        if i > 0:
+            output.write(b"\n")
+        _copy_shard(shard, directory, output)
+
+def merge_table_parts(manifest, table_name, directory, open_part):
+    """
+    Write the CSV of the given table, assembled from its shards in directory,
+    in parts (as the table's maxRowsPerFile and maxBytesPerFile settings say),
+    returning the manifest of the parts (see generate.part_manifest()).
+
+    open_part is as for generate.write_csv_parts(). The parts are identical to
+    those generate.write_csv_parts() would write for the whole table.
+    """
+
+    table_spec = next(table_spec for table_spec in manifest["spec"]["tables"]
+        if table_spec["name"] == table_name)
+    plan = plans.compile_table(table_spec)
+
+    parts = generate.write_csv_line_parts(
+        (line
+            for shard in _shards_of(manifest, table_name)
+            for line in _shard_lines(shard, directory)),
+        ",".join(field["name"] for field in plan.fields)+"\n",
+        open_part,
+        max_rows=plan.part_limits["rows"],
+        max_bytes=plan.part_limits["bytes"])
+    return generate.part_manifest(plan.fields, parts)
+
+def merge(manifest, directory, output_path):
+    """
+    Assemble the shards of the manifest in directory into the final output:
+    a zip file (like the web app produces) if output_path ends with '.zip', or
+    a directory of '<table>.csv' files otherwise (like the CLI's generate
+    command produces). Either way, tables with maxRowsPerFile or
+    maxBytesPerFile are written as '<table>/part-NNNNN.csv' files and a
+    '<table>/_manifest.json' file, rather than a '<table>.csv' file.
+
+    Raises exceptions.ShardError if any shard is not done, or is corrupt.
+    """
+
+    table_specs = manifest["spec"]["tables"]
+
+    if output_path.endswith(".zip"):
+        with zipfile.ZipFile(
+                output_path, "w", zipfile.ZIP_DEFLATED) as zip_file:
+            for table_spec in table_specs:
+                table_name = table_spec["name"]
+                if _in_parts(table_spec):
+                    zip_file.writestr(
+                        table_name+"/"+generate.PART_MANIFEST,
+                        merge_table_parts(manifest, table_name, directory,
+                            lambda number: zip_file.open(
+                                table_name+"/"+generate.part_name(number),
+                                "w", force_zip64=True)))
+                    continue
+
+                with zip_file.open(table_name+".csv", "w",
+                        force_zip64=True) as output:
+                    merge_table(manifest, table_name, directory, output)
+
+    else:
+        os.makedirs(output_path, exist_ok=True)
+        for table_spec in table_specs:
+            table_name = table_spec["name"]
+            if _in_parts(table_spec):
+                table_dir = os.path.join(output_path, table_name)
+                os.makedirs(table_dir, exist_ok=True)
+                part_manifest = merge_table_parts(
+                    manifest, table_name, directory,
+                    lambda number: open(
+                        os.path.join(table_dir, generate.part_name(number)),
+                        "wb", buffering=1024 * 1024))
+                with open(os.path.join(table_dir, generate.PART_MANIFEST), "w",
+                        encoding="utf-8") as manifest_file:
+                    manifest_file.write(part_manifest)
+                continue
+
+            path = os.path.join(output_path, table_name+".csv")
+            with open(path, "wb") as output:
+                merge_table(manifest, table_name, directory, output)
+
+def _in_parts(table_spec):
+    return plans.compile_table(table_spec).part_limits is not None
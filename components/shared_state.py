@@ -0,0 +1,72 @@
+"""
+State that is shared between server processes (eg. the workers of a production
+server, see gunicorn.conf.py), kept in files in a directory that they all use.
+"""
+
+import os
+import json
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Shared state is only needed by production servers, which need fcntl too
+    fcntl = None
+
+# How often (in seconds) to check shared state that is being waited on
+POLL_INTERVAL = 0.05
+
+def process_alive(pid):
+    """Return whether the process with the given pid is still running."""
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True # It exists, but belongs to someone else
+    return True
+
+def read_json(path, default=None):
+    """Return the JSON value in the file at path, or default if it is missing."""
+
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except FileNotFoundError:
+        return default
+
+def write_json(path, value):
+    """
+    Write the given value to the file at path as JSON, replacing it atomically,
+    so that readers never see part of it.
+    """
+
+    (fd, temp_path) = tempfile.mkstemp(
+        prefix=".tmp-", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "w") as temp_file:
+            json.dump(value, temp_file)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+@contextmanager
+def locked(path):
+    """
+    Hold an exclusive lock on the file at path (creating it if needed) for the
+    duration of the with block.
+
+    Each lock is taken through its own open file, so it excludes other threads
+    of the same process as well as other processes. Locks are released if their
+    process exits, so a killed process cannot leave the state locked.
+    """
+
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
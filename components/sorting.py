@@ -0,0 +1,223 @@
+"""
+Sorting tables that are too big to sort in memory, with an external merge sort.
+
+The records are read a chunk at a time and gathered into 'runs' of at most
+run_records records, each of which is sorted in memory and spilled to a
+temporary file. The runs are then merged, fan_in at a time, into longer runs
+until there are at most fan_in of them, which are merged as the sorted records
+are read. Only one run (while it is being sorted), or one block of each run
+being merged, is held in memory at once.
+
+Sorting is stable, so records with equal keys keep the order they were
+generated in, and the sorted records do not depend on run_records or fan_in.
+"""
+
+import os
+import heapq
+import pickle
+import shutil
+import tempfile
+from itertools import islice
+
+from components import consts, plans
+
+# How many records to read and write at a time, when spilling and merging runs
+RUN_BLOCK_RECORDS = 10000
+
+# How many records each chunk of sorted records has
+SORTED_CHUNK_RECORDS = 10000
+
+def sort_value(value):
+    """
+    Return a key for sorting the given value, so that values of different
+    types can be sorted together: numbers first, then everything else (by its
+    string form), then nulls.
+    """
+
+    if value is None:
+        return (2, 0)
+    if isinstance(value, (int, float)):
+        return (0, value)
+    return (1, str(value))
+
+def record_key(key_indexes, dictionaries):
+    """
+    Return a function that returns the sort key of a record (a tuple of values,
+    with dictionary-encoded values as codes) by the fields at key_indexes.
+
+    Dictionary-encoded values are sorted by the values they stand for, not by
+    their codes.
+    """
+
+    # The sort value of every value of a dictionary-encoded field, by code
+    lookups = [
+        None if dictionaries[index] is None
+        else [sort_value(value) for value in dictionaries[index].values]
+        for index in key_indexes]
+
+    if len(key_indexes) == 1:
+        ([index], [lookup]) = (key_indexes, lookups)
+        if lookup is None:
+            return lambda record: sort_value(record[index])
+        return lambda record: lookup[record[index]]
+
+    fields = list(zip(key_indexes, lookups))
+    return lambda record: tuple(
+        sort_value(record[index]) if lookup is None else lookup[record[index]]
+        for (index, lookup) in fields)
+
+def _write_run(path, records):
+    with open(path, "wb") as run_file:
+        records = iter(records)
+        for block in iter(lambda: list(islice(records, RUN_BLOCK_RECORDS)), []):
+            pickle.dump(block, run_file, pickle.HIGHEST_PROTOCOL)
+
+def _read_run(path):
+    with open(path, "rb") as run_file:
+        while True:
+            try:
+                block = pickle.load(run_file)
+            except EOFError:
+                return
+            yield from block
+
+class SortedRecords:
+    """
+    The records of a table, sorted by the fields at key_indexes using an
+    external merge sort.
+
+    records may be anything with a chunks() method that generates the columns
+    of the table a chunk at a time (ie. a storage.ColumnStore or a
+    plans.ChunkedRecords). The records are sorted when they are first read,
+    spilling runs into a temporary directory inside temp_dir (or the system's
+    temporary directory if it is None), which is removed once they are read.
+    Like the records it sorts, this can only be read once.
+
+    If start is given, the first start sorted records are skipped. If cancel
+    (a jobs.Cancellation) is given, it is checked before each chunk and block
+    of records is read or written. If on_sorted is given, it is called with the
+    number of runs and merge passes once the records are sorted (and before
+    they are read).
+    """
+
+    def __init__(self, records, key_indexes, dictionaries,
+            temp_dir=None, run_records=consts.SORT_RUN_RECORDS,
+            fan_in=consts.SORT_FAN_IN, start=0, cancel=None, on_sorted=None):
+        self.records = records
+        self.dictionaries = dictionaries
+        self.key = record_key(key_indexes, dictionaries)
+
+        self.temp_dir = temp_dir
+        self.run_records = run_records
+        self.fan_in = fan_in
+        self.start = start
+        self.cancel = cancel
+        self.on_sorted = on_sorted
+
+        # Known once the records are sorted
+        self.runs = None
+        self.merge_passes = None
+
+    def __len__(self):
+        return len(self.records) - self.start
+
+    def _check(self):
+        if self.cancel is not None:
+            self.cancel.check()
+
+    def _spill(self, directory, run):
+        path = os.path.join(directory, "run-"+str(self.runs))
+        run.sort(key=self.key)
+        _write_run(path, run)
+        self.runs += 1
+        return path
+
+    def _merge(self, directory, paths):
+        """
+        Merge the given runs fan_in at a time until there are at most fan_in,
+        returning their paths.
+        """
+
+        while len(paths) > self.fan_in:
+            self.merge_passes += 1
+            merged = []
+            for group_start in range(0, len(paths), self.fan_in):
+                group = paths[group_start:group_start + self.fan_in]
+                if len(group) == 1:
+                    merged.append(group[0])
+                    continue
+
+                path = os.path.join(directory,
+                    "merge-"+str(self.merge_passes)+"-"+str(len(merged)))
+                records = heapq.merge(
+                    *[_read_run(run_path) for run_path in group],
+                    key=self.key)
+                with open(path, "wb") as run_file:
+                    for block in iter(
+                            lambda: list(islice(records, RUN_BLOCK_RECORDS)),
+                            []):
+                        self._check()
+                        pickle.dump(block, run_file, pickle.HIGHEST_PROTOCOL)
+                for run_path in group:
+                    os.remove(run_path)
+                merged.append(path)
+            paths = merged
+
+        return paths
+
+    def _sorted(self, directory):
+        """Sort the records, returning an iterator of them in order."""
+
+        self.runs = 0
+        self.merge_passes = 0
+
+        paths = []
+        run = []
+        for columns in self.records.chunks():
+            self._check()
+            run.extend(zip(*columns))
+            if len(run) >= self.run_records:
+                paths.append(self._spill(directory, run))
+                run = []
+
+        if len(paths) == 0:
+            # Everything fits into one run, so is sorted in memory
+            run.sort(key=self.key)
+            self.runs = 1
+            records = iter(run)
+        else:
+            if len(run) > 0:
+                paths.append(self._spill(directory, run))
+            del run
+
+            paths = self._merge(directory, paths)
+            self.merge_passes += 1 # The final merge, as the records are read
+            records = heapq.merge(
+                *[_read_run(path) for path in paths], key=self.key)
+
+        if self.on_sorted is not None:
+            self.on_sorted(self.runs, self.merge_passes)
+        return records
+
+    def chunks(self):
+        """
+        Generate the sorted records column-wise, a chunk at a time, as
+        storage.ColumnStore.chunks() does.
+        """
+
+        directory = tempfile.mkdtemp(
+            prefix="dataset-generator-sort-", dir=self.temp_dir)
+        try:
+            records = islice(self._sorted(directory), self.start, None)
+            for chunk in iter(
+                    lambda: list(islice(records, SORTED_CHUNK_RECORDS)), []):
+                self._check()
+                yield [list(column) for column in zip(*chunk)]
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def __iter__(self):
+        """Generate the sorted records, as tuples of (decoded) values."""
+
+        for columns in self.chunks():
+            yield from zip(*plans.decode(columns, self.dictionaries))
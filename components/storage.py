@@ -0,0 +1,263 @@
+import os
+import sys
+import pickle
+from array import array
+import shutil
+import tempfile
+import threading
+from itertools import repeat
+
+# Memory Accounting
+# --------------------------------------------------
+
+# How many values of each column to measure when estimating its size
+_SIZE_SAMPLE = 16
+
+def column_nbytes(column):
+    """
+    Estimate how much memory the given column (a list of values, or an array)
+    uses.
+
+    Only a sample of the values of a list are measured, and values are assumed
+    not to be shared between records, so this is usually an over-estimate.
+    """
+
+    if isinstance(column, array):
+        return sys.getsizeof(column)
+
+    if len(column) == 0:
+        return sys.getsizeof(column)
+
+    step = max(len(column) // _SIZE_SAMPLE, 1)
+    sample = column[::step]
+    per_value = sum(sys.getsizeof(value) for value in sample) / len(sample)
+    return int(sys.getsizeof(column) + per_value * len(column))
+
+class MemoryBudget:
+    """
+    Tracks the memory used by the ColumnStores of one request and, when they
+    use more than limit bytes between them, spills the largest of them to
+    temporary files on disk until they fit again.
+
+    The temporary files are created in a directory of their own (inside
+    spill_dir, or the system's temporary directory if spill_dir is None), which
+    is removed by close().
+    """
+
+    def __init__(self, limit, spill_dir=None):
+        self.limit = limit
+        self.spill_dir = spill_dir
+        self.used = 0
+
+        self._stores = []
+        self._dir = None
+        self._lock = threading.Lock()
+        self._next_file = 0
+
+    def register(self, store):
+        self._stores.append(store)
+
+    def temp_path(self, prefix):
+        """Return a new path in this budget's temporary directory."""
+
+        with self._lock:
+            if self._dir is None:
+                self._dir = tempfile.mkdtemp(
+                    prefix="dataset-generator-", dir=self.spill_dir)
+            self._next_file += 1
+            return os.path.join(self._dir, prefix+"-"+str(self._next_file))
+
+    def charge(self, nbytes):
+        """
+        Record that nbytes more are held in memory, spilling stores to disk if
+        that takes the total over the limit.
+        """
+
+        self.used += nbytes
+        while self.used > self.limit:
+            in_memory = [store for store in self._stores if store.nbytes > 0]
+            if len(in_memory) == 0:
+                break
+            max(in_memory, key=lambda store: store.nbytes).spill()
+
+    def release(self, nbytes):
+        """Record that nbytes are no longer held in memory."""
+
+        self.used -= nbytes
+
+    def close(self):
+        """Close every registered store and remove all temporary files."""
+
+        for store in self._stores:
+            store.close()
+        self._stores = []
+
+        if self._dir is not None:
+            shutil.rmtree(self._dir, ignore_errors=True)
+            self._dir = None
+
+# Storage
+# --------------------------------------------------
+
+class Column:
+    """
+    The values of one field of a table, stored as a sequence of chunks (lists
+    of values, or arrays of codes for dictionary-encoded fields), either in
+    memory or, once spilled, in a file of pickled chunks.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.nbytes = 0
+        self._chunks = []
+        self._file = None
+
+    def append(self, chunk):
+        """Add a chunk to the end of the column, returning its size in memory."""
+
+        if self.path is not None:
+            pickle.dump(chunk, self._file, pickle.HIGHEST_PROTOCOL)
+            return 0
+
+        nbytes = column_nbytes(chunk)
+        self._chunks.append(chunk)
+        self.nbytes += nbytes
+        return nbytes
+
+    def spill(self, path):
+        """
+        Move the column's chunks to a file at path, and write any chunks that
+        are appended from now on straight to that file. Returns how many bytes
+        of memory that freed.
+        """
+
+        self.path = path
+        self._file = open(path, "wb")
+        for chunk in self._chunks:
+            pickle.dump(chunk, self._file, pickle.HIGHEST_PROTOCOL)
+        self._chunks = []
+
+        freed = self.nbytes
+        self.nbytes = 0
+        return freed
+
+    def chunks(self):
+        """
+        Iterate over the column's chunks, reading them back from disk one at a
+        time if the column has been spilled.
+        """
+
+        if self.path is None:
+            yield from self._chunks
+            return
+
+        self._file.flush()
+        with open(self.path, "rb") as column_file:
+            while True:
+                try:
+                    yield pickle.load(column_file)
+                except EOFError:
+                    return
+
+    def cache(self, cache, key):
+        """
+        Put the column's chunks into the given column_cache.ColumnCache under
+        the given key, from memory or from disk.
+        """
+
+        if self.path is None:
+            cache.put(key, list(self._chunks), self.nbytes)
+        else:
+            self._file.flush()
+            cache.put_file(self.path, key)
+
+    def close(self):
+        self._chunks = []
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class ColumnStore:
+    """
+    The records of a generated table, stored column-wise (see Column).
+
+    Iterating over a ColumnStore yields its records (as tuples) in order,
+    streaming them from disk if the store has been spilled. It may be iterated
+    over any number of times.
+
+    Columns with a dictionary (a generators.Dictionary) in dictionaries are
+    stored as codes, and only decoded when iterating over records.
+
+    If budget (a MemoryBudget) is given, the store charges the memory it uses
+    to the budget, which may spill it to disk.
+    """
+
+    def __init__(self, num_columns, budget=None, dictionaries=None):
+        self.columns = [Column() for _ in range(num_columns)]
+        self.dictionaries = (
+            dictionaries if dictionaries is not None else [None] * num_columns)
+        self.num_records = 0
+        self.budget = budget
+        if budget is not None:
+            budget.register(self)
+
+    @property
+    def nbytes(self):
+        """The number of bytes of memory the store uses."""
+
+        return sum(column.nbytes for column in self.columns)
+
+    def append(self, columns):
+        """
+        Add a chunk of records to the end of the store, given as a list of
+        columns (as produced by plans.TablePlan.chunks()).
+        """
+
+        # Stores with no columns are sized by extend_empty() instead
+        if len(self.columns) == 0:
+            return
+
+        self.num_records += len(columns[0])
+        nbytes = sum(column.append(chunk)
+            for (column, chunk) in zip(self.columns, columns))
+        if self.budget is not None:
+            self.budget.charge(nbytes)
+
+    def extend_empty(self, num_records):
+        """Add num_records records to a store with no columns."""
+
+        self.num_records += num_records
+
+    def spill(self):
+        """Move the store's chunks to temporary files (see Column.spill())."""
+
+        freed = sum(
+            column.spill(self.budget.temp_path("column"))
+            for column in self.columns if column.path is None)
+        self.budget.release(freed)
+
+    def chunks(self):
+        """
+        Iterate over the store's chunks, as lists of columns (with
+        dictionary-encoded columns still encoded).
+        """
+
+        return (list(columns)
+            for columns in zip(*[column.chunks() for column in self.columns]))
+
+    def __iter__(self):
+        if len(self.columns) == 0:
+            return repeat((), self.num_records)
+
+        return (record
+            for columns in self.chunks()
+            for record in zip(*[
+                column if dictionary is None else dictionary.decode(column)
+                for (column, dictionary) in zip(columns, self.dictionaries)]))
+
+    def __len__(self):
+        return self.num_records
+
+    def close(self):
+        for column in self.columns:
+            column.close()
@@ -1,7 +1,8 @@
 from collections import OrderedDict
 import sys
 import jsonschema
-from components import validate, exceptions
+from components import validate, exceptions, generators, sampling, samples, \
+    expressions
 
 # Helper Functions/Classes
 # --------------------------------------------------
@@ -134,6 +135,42 @@ def randomNumber_exists_if_required(context):
             "randomNumber missing from "+context_str(context)+", "+
             "dispite dataType being 'randomNumber'")
 
+#   {IF}
+# #/definitions/field-settings["dataType"]["dataType"]
+#   {== "sampled"}
+# #/definitions/field-settings["dataType"]["sampled"]
+#   {EXISTS}
+
+@validate.validator_for(each_field)
+def sampled_exists_if_required(context):
+    field = context["field"]
+
+    if (
+        field["settings"]["dataType"]["dataType"] == "sampled" and
+        "sampled" not in field["settings"]["dataType"]
+    ):
+        raise exceptions.BadSpecificationError(
+            "sampled missing from "+context_str(context)+", "+
+            "dispite dataType being 'sampled'")
+
+#   {IF}
+# #/definitions/field-settings["dataType"]["dataType"]
+#   {== "derived"}
+# #/definitions/field-settings["dataType"]["derived"]
+#   {EXISTS}
+
+@validate.validator_for(each_field)
+def derived_exists_if_required(context):
+    field = context["field"]
+
+    if (
+        field["settings"]["dataType"]["dataType"] == "derived" and
+        "derived" not in field["settings"]["dataType"]
+    ):
+        raise exceptions.BadSpecificationError(
+            "derived missing from "+context_str(context)+", "+
+            "dispite dataType being 'derived'")
+
 #   {IF}
 # #/definitions/field-settings["dataType"]["numberSequence"]["sequenceType"]
 #   {== "looping"}
@@ -222,6 +259,21 @@ def one_primaryKey_per_table(context):
             "multiple primaryKeys defined in "+context_str(context)+" "+
             "(one required)")
 
+# #/definitions/table-settings["orderBy"][*]
+#   {EXISTS IN}
+# #/definitions/table["fields"]
+
+@validate.validator_for(each_table)
+def orderBy_fields_exist(context):
+    table = context["table"]
+
+    field_names = [field["name"] for field in table["fields"]]
+    for name in table["settings"].get("orderBy", []):
+        if name not in field_names:
+            raise exceptions.BadSpecificationError(
+                "field '"+name+"' in orderBy of "+context_str(context)+" "+
+                "does not exist")
+
 #   {IF}
 # #/definitions/field-settings["dataType"]["dataType"]
 #   {== "randomNumber"}
@@ -241,6 +293,114 @@ def randomNumber_start_le_end(context):
                 "start must be less than end in randomNumber parameters in "+
                 context_str(context))
 
+#   {IF}
+# #/definitions/randomNumber["distribution"]
+#   {== "zipf"}
+# #/definitions/randomNumber["round"]
+#   {> 0}
+#   {AND}
+# (multiples of #/definitions/randomNumber["round"] between
+#  #/definitions/randomNumber["start"] and #/definitions/randomNumber["end"])
+#   {BETWEEN 1 AND} sampling.MAX_TABLE_SIZE
+
+@validate.validator_for(each_field)
+def randomNumber_zipf_has_values(context):
+    field = context["field"]
+
+    # Otherwise, this validation step is not applicable
+    if (field["settings"]["dataType"]["dataType"] == "randomNumber"):
+        randomNumber_spec = field["settings"]["dataType"]["randomNumber"]
+        if randomNumber_spec.get("distribution") != "zipf":
+            return
+
+        if randomNumber_spec["round"] <= 0:
+            raise exceptions.BadSpecificationError(
+                "round must be greater than 0 for a zipf distribution in "+
+                "randomNumber parameters in "+context_str(context))
+
+        num_values = len(generators.zipf_range(randomNumber_spec["start"],
+            randomNumber_spec["end"], randomNumber_spec["round"]))
+        if num_values < 1:
+            raise exceptions.BadSpecificationError(
+                "there are no multiples of round between start and end in "+
+                "randomNumber parameters in "+context_str(context))
+        if num_values > sampling.MAX_TABLE_SIZE:
+            raise exceptions.BadSpecificationError(
+                "there are more than "+str(sampling.MAX_TABLE_SIZE)+" "+
+                "multiples of round between start and end (for a zipf "+
+                "distribution) in randomNumber parameters in "+
+                context_str(context))
+
+#   {IF}
+# #/definitions/nameDistribution["weights"]
+#   {EXISTS}
+# #/definitions/nameDistribution["weights"] (keys)
+#   {EXISTS IN}
+# (the names of the corpus)
+#   {AND}
+# (the weights of the corpus' names)
+#   {HAVE A SUM} > 0
+
+NAME_CORPORA = {"forename": "forenames", "surname": "surnames"}
+
+@validate.validator_for(each_field)
+def name_weights_valid(context):
+    field = context["field"]
+
+    # Otherwise, this validation step is not applicable
+    data_type = field["settings"]["dataType"]["dataType"]
+    if data_type not in NAME_CORPORA:
+        return
+    weights = field["settings"]["dataType"].get(data_type, {}).get("weights")
+    if weights is None:
+        return
+
+    (names, corpus_weights) = generators.CORPORA[NAME_CORPORA[data_type]]
+    for name in weights:
+        if name not in names:
+            raise exceptions.BadSpecificationError(
+                "'"+name+"' in weights is not a "+data_type+" in the corpus "+
+                "in "+data_type+" parameters in "+context_str(context))
+
+    if sum(weights.get(name, corpus_weight)
+            for (name, corpus_weight) in zip(names, corpus_weights)) <= 0:
+        raise exceptions.BadSpecificationError(
+            "weights must not all be 0 in "+data_type+" parameters in "+
+            context_str(context))
+
+#   {IF}
+# #/definitions/field-settings["dataType"]["dataType"]
+#   {== "sampled"}
+# #/definitions/sampled["sample"]
+#   {EXISTS IN}
+# samples.models
+
+@validate.validator_for(each_field)
+def sampled_model_exists(context):
+    field = context["field"]
+
+    # Otherwise, this validation step is not applicable
+    if (field["settings"]["dataType"]["dataType"] == "sampled"):
+        sample = field["settings"]["dataType"]["sampled"]["sample"]
+        if sample not in samples.models:
+            raise exceptions.BadSpecificationError(
+                "sample model '"+sample+"' does not exist (it must be "+
+                "uploaded first) in sampled parameters in "+
+                context_str(context))
+
+# #/definitions/derived["expression"]
+#   {IS A VALID EXPRESSION OVER}
+# #/definitions/table["fields"]
+#   {WITHOUT CYCLES}
+
+@validate.validator_for(each_table)
+def derived_expressions_valid(context):
+    try:
+        expressions.field_types(context["table"])
+    except ValueError as err:
+        raise exceptions.BadSpecificationError(
+            str(err)+" in "+context_str(context))
+
 # Collection of All Validators
 # --------------------
 
@@ -0,0 +1,518 @@
+# General
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+import jsonschema
+
+# Specific
+from components import exceptions, schemas, validate, generate, shards, \
+    plans, checkpoints, consts
+from components.validators import validate_generate
+
+# Helpers
+# --------------------------------------------------
+
+def human_bytes(num_bytes):
+    """Return the given number of bytes as a human-readable string."""
+
+    for unit in ["B", "KB", "MB", "GB"]:
+        if num_bytes < 1024:
+            return "{:.1f} {}".format(num_bytes, unit)
+        num_bytes /= 1024
+    return "{:.1f} TB".format(num_bytes)
+
+def load_spec(path):
+    """
+    Load and validate the generate spec at the given path, exiting with an error
+    message if it is not valid.
+    """
+
+    with open(path, encoding="utf-8") as spec_file:
+        generate_spec = json.load(spec_file)
+
+    # Relative to <webroot>/schemas, as for the web app
+    generate_schema = schemas.Schema("/generate")
+    try:
+        generate_schema.validate(generate_spec)
+        validate.validate(validate_generate.all,
+            generate_spec, generate_schema)
+
+    except (
+        jsonschema.exceptions.ValidationError,
+        exceptions.BadSpecificationError
+    ) as err:
+        sys.exit("invalid generate spec '"+path+"': "+str(err))
+
+    if generate_spec["general"]["output-format"] != "multi-table":
+        # TODO: support single-table
+        sys.exit("output format '"+generate_spec["general"]["output-format"]+
+            "' is not supported")
+
+    return generate_spec
+
+def load_manifest(path):
+    """
+    Load the shard manifest at the given path, exiting with an error message if
+    it is not supported.
+    """
+
+    try:
+        return shards.load_manifest(path)
+    except exceptions.ShardError as err:
+        sys.exit("invalid shard manifest '"+path+"': "+str(err))
+
+# Generate
+# --------------------------------------------------
+
+def _table_dir(output_dir, table_spec):
+    path = os.path.join(output_dir, table_spec["name"])
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _open_csv(path, num_bytes):
+    """
+    Open the CSV file at the given path for writing, keeping its first
+    num_bytes bytes (as written before a checkpoint) and discarding the rest.
+    Return a tuple of (binary file, generate.HashingWriter for it).
+    """
+
+    if num_bytes == 0:
+        csv_file = open(path, "wb", buffering=1024 * 1024)
+        return (csv_file, generate.HashingWriter(csv_file))
+
+    csv_file = open(path, "r+b", buffering=1024 * 1024)
+    csv_file.truncate(num_bytes)
+    writer = generate.HashingWriter(csv_file)
+    for block in iter(lambda: csv_file.read(1024 * 1024), b""):
+        writer.sha256.update(block)
+    writer.bytes = num_bytes
+    return (csv_file, writer)
+
+def _resumable_bytes(path, state):
+    """
+    Return how many bytes of the CSV file at the given path can be kept, given
+    its last checkpoint (state), ie. 0 if it must be written from the start.
+    """
+
+    if state is None or not os.path.exists(path):
+        return 0
+    if os.path.getsize(path) < state["bytes"]:
+        return 0 # Something else has changed the file since the checkpoint
+    return state["bytes"]
+
+def write_table(task):
+    """
+    Generate one table (or one part of a table) and stream it into CSV files in
+    the output directory, returning a summary of what was written.
+
+    This is run in a worker process, so takes a single (picklable) tuple of
+    (table_spec, seed, output_dir, part, checkpoint). part is None to write the
+    whole table, or a tuple of (number, start, stop) to write only the records
+    from start to stop as the given part. checkpoint is None, or a tuple of
+    (path, interval) to save the progress of the task to the given path every
+    interval seconds, and to resume from the checkpoint there if there is one.
+    """
+
+    (table_spec, seed, output_dir, part, checkpoint) = task
+
+    start = time.perf_counter()
+    plan = plans.compile_table(table_spec)
+    summary = {
+        "table": table_spec["name"],
+        "records": table_spec["settings"]["numRecords"]
+    }
+
+    def records_from(first, stop):
+        """Return the records from first to stop, in the order written."""
+
+        if plan.order_by is None:
+            return plans.ChunkedRecords(plan, seed, stop - first, first)
+
+        # Tables with orderBy are never split into tasks (see table_tasks()),
+        # so the whole table is sorted, then the records before first skipped
+        return generate.ordered(plan,
+            plans.ChunkedRecords(plan, seed, plan.num_records),
+            consts.SPILL_DIR, start=first)
+
+    def summarise_sort(records):
+        if plan.order_by is not None and records.runs is not None:
+            summary["sortRuns"] = records.runs
+            summary["mergePasses"] = records.merge_passes
+
+    checkpointer = None
+    state = None
+    if checkpoint is not None:
+        checkpointer = checkpoints.Checkpointer(*checkpoint)
+        state = checkpointer.state
+        if state is not None and "summary" in state:
+            return dict(state["summary"], seconds=0, resumed=True)
+
+    if part is not None or plan.part_limits is None:
+        # A single file, which can be resumed from the last record written
+        if part is not None:
+            (number, file_start, file_stop) = part
+            path = os.path.join(_table_dir(output_dir, table_spec),
+                generate.part_name(number))
+        else:
+            (file_start, file_stop) = (0, plan.num_records)
+            path = os.path.join(output_dir, table_spec["name"]+".csv")
+
+        num_bytes = _resumable_bytes(path, state)
+        done = state["rows"] if num_bytes > 0 else 0
+        summary["resumedRecords"] = done
+
+        def on_batch(num_records, _):
+            nonlocal done
+            done += num_records
+            if checkpointer is not None and checkpointer.due():
+                checkpoints.sync(csv_file)
+                checkpointer.save({"rows": done, "bytes": writer.bytes})
+
+        records = records_from(file_start + done, file_stop)
+        (csv_file, writer) = _open_csv(path, num_bytes)
+        with csv_file:
+            generate.write_csv({
+                "fields": plan.fields,
+                "records": records
+            }, writer, with_names=num_bytes == 0, continued=done > 0,
+                on_batch=on_batch)
+            if checkpointer is not None:
+                checkpoints.sync(csv_file)
+
+        summary["bytes"] = writer.bytes
+        summarise_sort(records)
+        if part is not None:
+            summary.update({
+                "records": file_stop - file_start,
+                "parts": [{
+                    "file": generate.part_name(number),
+                    "rows": file_stop - file_start,
+                    "bytes": writer.bytes,
+                    "sha256": writer.sha256.hexdigest()
+                }]
+            })
+
+    else:
+        # Where parts end depends on the size of the records before them, so
+        # they must be written one after another. They are resumed from the
+        # last complete part.
+        table_dir = _table_dir(output_dir, table_spec)
+        parts = list(state["parts"]) if state is not None else []
+        done = sum(part["rows"] for part in parts)
+        summary["resumedRecords"] = done
+
+        def on_part(part_summary):
+            parts.append(part_summary)
+            if checkpointer is not None:
+                checkpoints.sync_path(
+                    os.path.join(table_dir, part_summary["file"]))
+                checkpointer.save({"parts": parts})
+
+        if len(parts) == 0 or done < plan.num_records:
+            records = records_from(done, plan.num_records)
+            generate.write_csv_parts({
+                "fields": plan.fields,
+                "records": records
+            },
+                lambda number: open(
+                    os.path.join(table_dir, generate.part_name(number)), "wb",
+                    buffering=1024 * 1024),
+                max_rows=plan.part_limits["rows"],
+                max_bytes=plan.part_limits["bytes"],
+                first_part=len(parts),
+                on_part=on_part)
+            summarise_sort(records)
+
+        summary.update({
+            "bytes": sum(part["bytes"] for part in parts),
+            "parts": parts
+        })
+
+    summary["seconds"] = time.perf_counter() - start
+    if checkpointer is not None:
+        checkpointer.save({"summary": summary})
+    return summary
+
+def table_tasks(table_spec, seed, output_dir, checkpoint_dir=None,
+        checkpoint_interval=None):
+    """
+    Return the tasks (see write_table()) to generate the given table, with
+    their checkpoints in checkpoint_dir, if given.
+
+    Tables that are split into parts by number of records only are split into
+    one task per part, so that large tables can be generated in parallel,
+    unless they have orderBy (as every part then depends on the whole table).
+    """
+
+    def checkpoint(name):
+        if checkpoint_dir is None:
+            return None
+        return (
+            os.path.join(checkpoint_dir, name+".checkpoint.json"),
+            checkpoint_interval)
+
+    plan = plans.compile_table(table_spec)
+    limits = plan.part_limits
+    if (
+        limits is None or limits["bytes"] is not None or
+        plan.order_by is not None
+    ):
+        return [(table_spec, seed, output_dir, None,
+            checkpoint(table_spec["name"]))]
+
+    num_records = plan.num_records
+    return [
+        (table_spec, seed, output_dir,
+            (number, start, min(start + limits["rows"], num_records)),
+            checkpoint(table_spec["name"]+"."+generate.part_name(number)))
+        for (number, start) in enumerate(
+            range(0, max(num_records, 1), limits["rows"]))]
+
+def task_cost(task):
+    (table_spec, _, _, part, _) = task
+    num_records = table_spec["settings"]["numRecords"]
+    if part is not None:
+        num_records = part[2] - part[1]
+    return num_records * len(table_spec["fields"])
+
+# The checkpoint of a whole run of the generate command
+RUN_CHECKPOINT = "run.checkpoint.json"
+
+def resume_run(checkpoint_dir, generate_spec):
+    """
+    Return the seed to generate the given spec with, resuming the run whose
+    checkpoints are in checkpoint_dir if there is one, or starting a new one.
+
+    Runs are always seeded (with a random seed, if the spec has none), so
+    that resumed tables are identical to uninterrupted ones.
+    """
+
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path = os.path.join(checkpoint_dir, RUN_CHECKPOINT)
+    run = checkpoints.load(path)
+    spec_hash = plans.spec_hash(generate_spec)
+
+    if run is not None:
+        if run["spec"] != spec_hash:
+            sys.exit("the checkpoints in '"+checkpoint_dir+"' are for a "+
+                "different spec (remove them to start again)")
+        print("Resuming from the checkpoints in '{}' (seed {})".format(
+            checkpoint_dir, run["seed"]), file=sys.stderr)
+        return run["seed"]
+
+    seed = generate_spec["general"].get("seed")
+    if seed is None:
+        seed = plans.new_seed()
+    checkpoints.save(path, {"spec": spec_hash, "seed": seed})
+    return seed
+
+def finish_run(checkpoint_dir, tasks):
+    """Remove the checkpoints of a run that has finished."""
+
+    for (_, _, _, _, (path, _)) in tasks:
+        os.remove(path)
+    os.remove(os.path.join(checkpoint_dir, RUN_CHECKPOINT))
+    try:
+        os.rmdir(checkpoint_dir)
+    except OSError:
+        pass # Not empty, so not only used for checkpoints
+
+def generate_command(args):
+    generate_spec = load_spec(args.spec)
+    seed = generate_spec["general"].get("seed")
+    if args.checkpoint_dir is not None:
+        seed = resume_run(args.checkpoint_dir, generate_spec)
+    tables_spec = generate_spec["tables"]
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # Tables (and parts of tables) are independent of each other, so each can
+    # be generated by its own worker. Start the biggest first to finish as
+    # soon as possible.
+    tasks = sorted(
+        [task
+            for table_spec in tables_spec
+            for task in table_tasks(table_spec, seed, args.output_dir,
+                args.checkpoint_dir, args.checkpoint_interval)],
+        key=task_cost, reverse=True)
+
+    start = time.perf_counter()
+    summaries = []
+    with multiprocessing.Pool(min(args.workers, max(len(tasks), 1))) as pool:
+        for summary in pool.imap_unordered(write_table, tasks):
+            summaries.append(summary)
+            name = summary["table"]
+            if len(summary.get("parts", [])) == 1:
+                name += "/" + summary["parts"][0]["file"]
+            if summary.get("resumed"):
+                status = "already generated"
+            elif summary.get("resumedRecords", 0) > 0:
+                status = "resumed from record {}".format(
+                    summary["resumedRecords"])
+            else:
+                status = None
+            if "mergePasses" in summary:
+                status = ((status+", ") if status is not None else "")+(
+                    "sorted in {} runs, {} merge passes".format(
+                        summary["sortRuns"], summary["mergePasses"]))
+            print("[{}/{}] {}: {} records, {} in {:.2f}s{}".format(
+                len(summaries), len(tasks), name,
+                summary["records"], human_bytes(summary["bytes"]),
+                summary["seconds"],
+                " ("+status+")" if status is not None else ""),
+                file=sys.stderr)
+
+    # Write the manifest of each table that was written in parts
+    for table_spec in tables_spec:
+        parts = sorted(
+            [part
+                for summary in summaries
+                if summary["table"] == table_spec["name"]
+                for part in summary.get("parts", [])],
+            key=lambda part: part["file"])
+        if len(parts) > 0:
+            manifest_path = os.path.join(
+                args.output_dir, table_spec["name"], generate.PART_MANIFEST)
+            with open(manifest_path, "w", encoding="utf-8") as manifest_file:
+                manifest_file.write(generate.part_manifest(
+                    plans.compile_table(table_spec).fields, parts))
+
+    if args.checkpoint_dir is not None:
+        finish_run(args.checkpoint_dir, tasks)
+
+    seconds = time.perf_counter() - start
+    total_records = sum(summary["records"] for summary in summaries)
+    total_bytes = sum(summary["bytes"] for summary in summaries)
+    print("Generated {} tables: {} records, {} in {:.2f}s ({:.0f} records/s)"
+        .format(len(tables_spec), total_records, human_bytes(total_bytes),
+            seconds, total_records / seconds if seconds > 0 else 0),
+        file=sys.stderr)
+
+# Shards
+# --------------------------------------------------
+
+def split_command(args):
+    generate_spec = load_spec(args.spec)
+    try:
+        manifest = shards.make_manifest(generate_spec, args.shard_records)
+    except exceptions.ShardError as err:
+        sys.exit("cannot split spec '"+args.spec+"': "+str(err))
+
+    with open(args.manifest, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+    print("Split into {} shards (seed {})".format(
+        len(manifest["shards"]), manifest["spec"]["general"]["seed"]),
+        file=sys.stderr)
+
+def work_command(args):
+    manifest = load_manifest(args.manifest)
+
+    start = time.perf_counter()
+    num_shards = 0
+    for summary in shards.work(manifest, args.dir, args.shard):
+        num_shards += 1
+        print("{}: {} records, {} (sha256 {})".format(
+            summary["id"], summary["records"], human_bytes(summary["bytes"]),
+            summary["sha256"]), file=sys.stderr)
+
+    print("Generated {} shards in {:.2f}s".format(
+        num_shards, time.perf_counter() - start), file=sys.stderr)
+
+def merge_command(args):
+    manifest = load_manifest(args.manifest)
+    try:
+        shards.merge(manifest, args.dir, args.output)
+    except exceptions.ShardError as err:
+        sys.exit("cannot merge shards: "+str(err))
+
+    print("Merged {} shards into {}".format(
+        len(manifest["shards"]), args.output), file=sys.stderr)
+
+# Command Line
+# --------------------------------------------------
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Generate datasets from generate spec files, without "+
+            "running the web app.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    generate_parser = subparsers.add_parser("generate",
+        help="generate every table in a spec into a directory of CSV files")
+    generate_parser.add_argument("spec",
+        help="path to a generate spec JSON file, as POSTed to the web app")
+    generate_parser.add_argument("-o", "--output-dir", required=True,
+        help="directory to write '<table>.csv' files into")
+    generate_parser.add_argument("-j", "--workers", type=int,
+        default=os.cpu_count() or 1,
+        help="number of tables to generate in parallel (default: CPU count)")
+    generate_parser.add_argument("-c", "--checkpoint-dir",
+        help="directory to save checkpoints in while generating. If the "+
+            "command is interrupted, running it again with the same spec "+
+            "and directories resumes from the last checkpoints. The "+
+            "checkpoints are removed once every table is generated.")
+    generate_parser.add_argument("--checkpoint-interval", type=float,
+        default=60,
+        help="seconds between the checkpoints of each table (default: 60)")
+    generate_parser.set_defaults(func=generate_command)
+
+    split_parser = subparsers.add_parser("split",
+        help="split a spec into a manifest of shards, which can each be "+
+            "generated separately (eg. on different machines)")
+    split_parser.add_argument("spec",
+        help="path to a generate spec JSON file, as POSTed to the web app")
+    split_parser.add_argument("-o", "--manifest", required=True,
+        help="path to write the shard manifest JSON file to")
+    split_parser.add_argument("-n", "--shard-records", type=int,
+        default=1000000,
+        help="maximum number of records per shard (default: 1000000)")
+    split_parser.set_defaults(func=split_command)
+
+    work_parser = subparsers.add_parser("work",
+        help="generate shards of a manifest into a (shared) directory. Any "+
+            "number of workers may work on the same manifest and directory.")
+    work_parser.add_argument("manifest",
+        help="path to a shard manifest, as written by 'split'")
+    work_parser.add_argument("-d", "--dir", required=True,
+        help="directory to write shards into")
+    work_parser.add_argument("-s", "--shard", action="append",
+        help="ID of a shard to generate (may be repeated). If not given, "+
+            "generate every shard not already claimed by another worker.")
+    work_parser.set_defaults(func=work_command)
+
+    merge_parser = subparsers.add_parser("merge",
+        help="merge the shards of a manifest into the final output, "+
+            "verifying their checksums")
+    merge_parser.add_argument("manifest",
+        help="path to a shard manifest, as written by 'split'")
+    merge_parser.add_argument("-d", "--dir", required=True,
+        help="directory that the shards were written into")
+    merge_parser.add_argument("-o", "--output", required=True,
+        help="path of a zip file (if it ends in '.zip') or directory to "+
+            "write '<table>.csv' files into")
+    merge_parser.set_defaults(func=merge_command)
+
+    args = parser.parse_args(argv)
+    for path_arg in [
+        "spec", "output_dir", "checkpoint_dir", "manifest", "dir", "output"
+    ]:
+        if getattr(args, path_arg, None) is not None:
+            setattr(args, path_arg, os.path.abspath(getattr(args, path_arg)))
+    return args
+
+def main(argv):
+    args = parse_args(argv)
+
+    # Schemas and data files are located relative to the webroot, which is this
+    # file's directory (user-given paths have already been made absolute)
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    args.func(args)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -2,19 +2,51 @@
 # NOTE: use sqlalchemy?
 
 # General
+import os
+import math
+import time
+import shutil
 import posixpath
 import json
+import hashlib
+import hmac
+import random
 import jsonschema
 from components import schemas
 
 # Specific
-from components import exceptions, consts, validate, generate
+from components import exceptions, consts, validate, generate, admission, \
+    estimate, resources, plans, profiling, storage, \
+    column_cache, jobs, samples
 from components.validators import validate_generate
 
 # Flask
 import flask
 app = flask.Flask(__name__)
 
+# HTTP Caching
+# --------------------------------------------------
+
+def etag_for(body):
+    """Return a strong ETag for the given response body (a str)."""
+
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+def cacheable_response(body, etag, max_age, mimetype="application/json"):
+    """
+    Return a response for the given body that clients may cache for max_age
+    seconds, then revalidate using the given etag.
+
+    If the request's 'If-None-Match' header matches etag, then the response is
+    '304 Not Modified' (with no body) instead.
+    """
+
+    response = flask.Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response.make_conditional(flask.request)
+
 # Resource API
 # --------------------------------------------------
 
@@ -26,13 +58,25 @@ resourceTypes = {
     "image": "images"
 }
 
+# Which resources of each type exist, so that looking them up does not touch
+# the file system
+resourceIndexes = {
+    resourceType: resources.ResourceIndex(
+        posixpath.join("static", resourceDir),
+        check_interval=consts.RESOURCE_INDEX_CHECK_INTERVAL)
+    for (resourceType, resourceDir) in resourceTypes.items()
+}
+
+# Return an identity mapping of valid types, which makes it usable as an enum on
+# the client-side.
+typesBody = json.dumps({
+    "image": "image"
+})
+typesETag = etag_for(typesBody)
+
 @app.route(posixpath.normpath(resourceAPI["route"] + '/types'))
 def list_types():
-    # Return an identity mapping of valid types, which makes it usable as an
-    # enum on the client-side.
-    return json.dumps({
-        "image": "image"
-    })
+    return cacheable_response(typesBody, typesETag, consts.RESOURCES_MAX_AGE)
 
 @app.route(posixpath.normpath(resourceAPI["route"] + '/resource'))
 def get_resource():
@@ -40,29 +84,46 @@ def get_resource():
 
     resourceType = args["resourceType"]
     resource = args["resource"]
+    if resourceType not in resourceTypes:
+        return "", 404 # NOT FOUND
+    if not resources.is_inside(resource):
+        return "", 400 # BAD REQUEST
 
     relativePath = posixpath.normpath( "/".join([
         "static", resourceTypes[resourceType], resource
     ]) )
 
-    return json.dumps({
+    body = json.dumps({
         "path": "/" + relativePath,
-        "exists": posixpath.isfile(posixpath.abspath(relativePath))
+        "exists": resourceIndexes[resourceType].contains(resource)
     })
+    return cacheable_response(body, etag_for(body), consts.RESOURCES_MAX_AGE)
 
 # Schemas API
 # --------------------------------------------------
 
 schemasAPI = consts.APIs["schemas"]
 
+# Schemas do not change while the server is running, so each is serialised (and
+# its ETag computed) only once, when it is first requested. Maps schema names to
+# (body, etag) tuples.
+serialisedSchemas = {}
+
 @app.route(posixpath.normpath(schemasAPI["route"] + "/<name>"), methods=["GET"])
 def get_schema(**url_vars):
-    try:
-        schema = schemas.Schema(url_vars["name"])
-    except FileNotFoundError:
-        return "", 404 # NOT FOUND
+    name = url_vars["name"]
+
+    if name not in serialisedSchemas:
+        try:
+            schema = schemas.Schema(name)
+        except FileNotFoundError:
+            return "", 404 # NOT FOUND
 
-    return json.dumps(schema.get())
+        body = json.dumps(schema.get())
+        serialisedSchemas[name] = (body, etag_for(body))
+
+    (body, etag) = serialisedSchemas[name]
+    return cacheable_response(body, etag, consts.SCHEMAS_MAX_AGE)
 
 # Data API
 # --------------------------------------------------
@@ -73,14 +134,87 @@ dataAPI = consts.APIs["data"]
 # Schema("/generate") => import <webroot>/schemas/generate.schema.json
 generate_schema = schemas.Schema("/generate")
 
-@app.route(posixpath.normpath(dataAPI["route"] + "/generate"), methods=["POST"])
-def generate_endpoint():
-    global generate_schema
+def create_process_state(shared_dir=None):
+    """
+    Create the state that each server process keeps for itself.
 
-    generate_spec = flask.request.get_json()
+    This is called when this module is imported, and again in each worker
+    process forked from a preloaded production server (see gunicorn.conf.py),
+    so that workers do not share locks or caches. Admission control and jobs
+    must be the same for every worker, though, so the production server gives
+    every worker the same shared_dir to keep them in (see
+    admission.SharedAdmissionController and jobs.SharedJobRegistry). Without
+    shared_dir, they are kept in memory.
+    """
+
+    global admission_controller, generated_columns, generation_jobs
+
+    limits = (
+        consts.MAX_CONCURRENT_GENERATIONS,
+        consts.MAX_QUEUED_GENERATIONS,
+        consts.QUEUE_TIMEOUT)
+    budgets = {
+        "max_rows_global": consts.MAX_ROWS_GLOBAL,
+        "max_rows_per_client": consts.MAX_ROWS_PER_CLIENT,
+        "retry_after": consts.RETRY_AFTER
+    }
+    if shared_dir is None:
+        admission_controller = admission.AdmissionController(
+            *limits, **budgets)
+    else:
+        admission_controller = admission.SharedAdmissionController(
+            os.path.join(shared_dir, "admission"), *limits, **budgets)
+
+    # Generated columns of seeded specs, so that iteratively editing and
+    # generating a spec only regenerates what changed
+    generated_columns = column_cache.ColumnCache(
+        consts.COLUMN_CACHE_MEMORY,
+        consts.COLUMN_CACHE_DISK,
+        column_cache_dir(os.getpid()))
+
+    # Generations that clients can follow the progress of, by job ID
+    if shared_dir is None:
+        generation_jobs = jobs.JobRegistry(consts.JOB_RETENTION)
+    else:
+        generation_jobs = jobs.SharedJobRegistry(
+            os.path.join(shared_dir, "jobs"), consts.JOB_RETENTION)
+
+def column_cache_dir(pid):
+    """
+    Return the directory that the server process with the given pid caches
+    columns in, or None if it uses a temporary directory.
+    """
+
+    if consts.COLUMN_CACHE_DIR is None:
+        return None
+    return os.path.join(consts.COLUMN_CACHE_DIR, str(pid))
+
+def remove_process_state(pid):
+    """
+    Remove what the server process with the given pid left on disk, once it has
+    exited (temporary directories are removed by the process itself).
+    """
+
+    cache_dir = column_cache_dir(pid)
+    if cache_dir is not None:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+create_process_state()
+
+# Benchmark this machine once, so that estimates are quick to make
+estimator = estimate.Estimator(estimate.calibrate(),
+    memory_budget=consts.MEMORY_BUDGET)
+
+def validate_generate_spec(generate_spec):
+    """
+    Validate the given generation spec (ie. instructions for what things to
+    generate and how to generate them).
+
+    Return None if it is valid, or an error response if it is not.
+    """
+
+    global generate_schema
 
-    # Validate the provided generation spec (ie. instructions for what things to
-    # generate and how to generate them)
     try:
         generate_schema.validate(generate_spec)
         validate.validate(validate_generate.all,
@@ -104,31 +238,438 @@ def generate_endpoint():
         # See: https://stackoverflow.com/a/25398605
         return "", 503 # SERVICE UNAVAILABLE
 
-    # Generate the tables according to the generation spec
-    generated_tables = generate.generate_tables(generate_spec["tables"])
-
-    # Generate the CSV data and return the file to the client
-    output_format = generate_spec["general"]["output-format"]
-    if output_format == "multi-table":
-        # Equivilent to `with <EXPR> as <VAR>: <BLOCK>...</BLOCK>`, but without
-        # calling __exit__() to close the file.
-        # See https://www.python.org/dev/peps/pep-0343/.
-        mgr = generate.toMultiCSV(generated_tables) # <EXPR>
-        multi_csv = type(mgr).__enter__(mgr) # <VAR>
-        # <BLOCK>
-        return flask.send_file(
-            multi_csv, mimetype="application/zip",
-            as_attachment=True, attachment_filename="generated-tables.zip")
-        # </BLOCK>
-
-        # The file will be 'closed' when it is GCed after it goes out of scope.
-        # This will work on a io.BytesIO instance (as toMultiCSV() returns)
-        # because it is an in-memory file-like object - ie. not a 'real' file.
-        # While leaving the file to be closed by the GC, even in the case of
-        # 'virtual' files, is not good form, closing it explicitly raises a
-        # ValueError.
-
-    # TODO: support single-table
+    return None
+
+def should_profile():
+    """
+    Return whether to profile the current request.
+
+    Requests are profiled if they have an 'X-Profile' header that matches the
+    operator-configured PROFILE_TOKEN, or at random, at PROFILE_SAMPLE_RATE.
+    """
+
+    token = flask.request.headers.get("X-Profile")
+    if (
+        token is not None and consts.PROFILE_TOKEN != "" and
+        hmac.compare_digest(token, consts.PROFILE_TOKEN)
+    ):
+        return True
+
+    return (
+        consts.PROFILE_SAMPLE_RATE > 0 and
+        random.random() < consts.PROFILE_SAMPLE_RATE)
+
+# The status to respond with (or to record, if the client has gone) when a
+# generation is cancelled, by the reason it was cancelled
+CANCELLED_STATUSES = {
+    jobs.CANCELLED: 499, # CLIENT CLOSED REQUEST (non-standard, as in nginx)
+    jobs.DISCONNECTED: 499,
+    jobs.DEADLINE: 504 # GATEWAY TIMEOUT
+}
+
+def request_deadline():
+    """
+    Return the deadline (a time.monotonic() time) for generating the current
+    request, or None if it has no deadline.
+
+    Generations may take up to MAX_GENERATION_SECONDS, but clients may ask for
+    a shorter deadline with the 'deadline' query parameter (in seconds).
+    Raises ValueError if that is not a positive number.
+    """
+
+    seconds = consts.MAX_GENERATION_SECONDS
+    requested = flask.request.args.get("deadline")
+    if requested is not None:
+        requested = float(requested)
+        if not requested > 0 or math.isinf(requested):
+            raise ValueError("deadline must be a positive number of seconds")
+        if seconds <= 0 or requested < seconds:
+            seconds = requested
+
+    if seconds <= 0:
+        return None
+    return time.monotonic() + seconds
+
+def generate_response(generate_spec, profile, job=None):
+    """
+    Generate the given spec, returning the response to send.
+
+    Generation stops early if the job (if given) is cancelled, or if the
+    request's deadline passes (see request_deadline()). Multi-table output is
+    streamed to the client as it is encoded (unless the request is being
+    profiled), and encoding stops if the client stops reading it. Either way,
+    everything held for the generation is freed as soon as it stops.
+    """
+
+    cancellation = job.cancellation if job is not None else jobs.Cancellation()
+    try:
+        cancellation.deadline = request_deadline()
+    except ValueError:
+        return "", 400 # BAD REQUEST
+
+    with profile.stage("validate"):
+        error_response = validate_generate_spec(generate_spec)
+    if error_response is not None:
+        return error_response
+
+    client = flask.request.remote_addr
+    cost = admission.request_cost(generate_spec["tables"])
+
+    # Only generate if there is capacity to do so, otherwise reject the request
+    # quickly, so that one client (or a handful of big specs) cannot take down
+    # every in-flight request.
+    try:
+        with profile.stage("admit"):
+            admission_controller.acquire(client, cost, cancellation.deadline)
+    except exceptions.BudgetExceededError:
+        return "", 413 # PAYLOAD TOO LARGE
+    except exceptions.OverloadedError as err:
+        # TOO MANY REQUESTS
+        return "", 429, {"Retry-After": str(err.retry_after)}
+    except exceptions.CancelledError as err:
+        # The deadline passed while queued
+        cancellation.cancel(err.reason)
+        return "", CANCELLED_STATUSES[err.reason]
+
+    # Tables that do not fit into the budget are spilled to disk
+    budget = storage.MemoryBudget(consts.MEMORY_BUDGET, consts.SPILL_DIR)
+
+    def release():
+        # Free the generated tables (and any spilled files), and the capacity
+        # they were admitted with
+        budget.close()
+        admission_controller.release(client, cost)
+
+    # Every generation is seeded, so that it only uses its own random number
+    # generators, and can be reproduced. Only columns of seeds that clients
+    # chose are worth caching, though.
+    seed = generate_spec["general"].get("seed")
+    cache = generated_columns
+    if seed is None:
+        (seed, cache) = (plans.new_seed(), None)
+
+    streaming = False
+    try:
+        # Generate the tables according to the generation spec
+        if job is not None:
+            job.start(generate_spec["tables"])
+        with profile.stage("generate"):
+            generated_tables = generate.generate_tables(
+                generate_spec["tables"],
+                seed=seed,
+                budget=budget,
+                cache=cache,
+                progress=job,
+                cancel=cancellation)
+
+        # Generate the CSV data and return the file to the client
+        output_format = generate_spec["general"]["output-format"]
+        if output_format == "multi-table":
+            if job is not None:
+                job.encoding()
+
+            if not profile.enabled:
+                response = streamed_zip_response(generated_tables,
+                    job, cancellation, release)
+                response.headers["X-Dataset-Seed"] = str(seed)
+                streaming = True
+                return response
+
+            # Profiled requests are encoded before responding, so that the
+            # encoding is profiled.
+            # Equivilent to `with <EXPR> as <VAR>: <BLOCK>...</BLOCK>`, but
+            # without calling __exit__() to close the file.
+            # See https://www.python.org/dev/peps/pep-0343/.
+            with profile.stage("encode"):
+                mgr = generate.toMultiCSV(generated_tables,
+                    max_memory=consts.MEMORY_BUDGET, progress=job,
+                    cancel=cancellation) # <EXPR>
+                multi_csv = type(mgr).__enter__(mgr) # <VAR>
+            # <BLOCK>
+            response = flask.send_file(
+                multi_csv, mimetype="application/zip",
+                as_attachment=True, attachment_filename="generated-tables.zip")
+            response.headers["X-Dataset-Seed"] = str(seed)
+            return response
+            # </BLOCK>
+
+            # The file will be closed when the response is closed, or when it
+            # is GCed after it goes out of scope. Closing a spooled temporary
+            # file also deletes it, if it has been moved to disk.
+
+        # TODO: support single-table
+
+    except exceptions.CancelledError as err:
+        return "", CANCELLED_STATUSES[err.reason]
+
+    finally:
+        # The zip file holds everything needed for the response, so the
+        # generated tables can go now (or once they are streamed)
+        if not streaming:
+            release()
+
+def streamed_zip_response(generated_tables, job, cancellation, release):
+    """
+    Return a response that streams the given generated tables to the client as
+    a zip file, as they are encoded. release() is called as soon as the
+    response is finished with, whether it was sent in full or not.
+    """
+
+    status = None
+
+    def stream():
+        nonlocal status
+        try:
+            yield from generate.stream_multi_csv(generated_tables,
+                progress=job, cancel=cancellation)
+            status = 200 # OK
+        except exceptions.CancelledError as err:
+            # The response has already started, so the only way to tell the
+            # client that it is incomplete is to abort it
+            status = CANCELLED_STATUSES[err.reason]
+            raise
+        except Exception:
+            status = 500 # INTERNAL SERVER ERROR
+            raise
+
+    def close():
+        nonlocal status
+        if status is None:
+            # The client stopped reading the response before it finished
+            cancellation.cancel(jobs.DISCONNECTED)
+            status = CANCELLED_STATUSES[jobs.DISCONNECTED]
+        release()
+        if job is not None:
+            job.finish(status)
+
+    response = flask.Response(stream(), mimetype="application/zip",
+        headers={
+            "Content-Disposition":
+                "attachment; filename=generated-tables.zip",
+            "X-Accel-Buffering": "no" # Do not buffer in reverse proxies
+        })
+    response.call_on_close(close)
+    return response
+
+def tracked_generate_response(generate_spec, profile):
+    """
+    As generate_response(), but if the request has a 'job' query parameter, the
+    progress of the generation can be followed under that job ID (see
+    job_progress_endpoint()), and it can be cancelled (see
+    cancel_job_endpoint()).
+    """
+
+    job_id = flask.request.args.get("job")
+    if job_id is None:
+        return generate_response(generate_spec, profile)
+
+    try:
+        job = generation_jobs.create(job_id)
+    except ValueError:
+        return "", 400 # BAD REQUEST
+    except KeyError:
+        return "", 409 # CONFLICT
+
+    try:
+        response = flask.make_response(
+            generate_response(generate_spec, profile, job))
+    except BaseException:
+        job.finish(500) # INTERNAL SERVER ERROR
+        raise
+
+    # The job finishes once the response is sent. Streamed responses finish it
+    # themselves first, with how the stream ended. File responses are passed
+    # straight to the server, so are never closed through the response.
+    if response.direct_passthrough:
+        job.finish(response.status_code)
+    else:
+        response.call_on_close(lambda: job.finish(response.status_code))
+    return response
+
+@app.route(posixpath.normpath(dataAPI["route"] + "/generate"), methods=["POST"])
+def generate_endpoint():
+    generate_spec = flask.request.get_json()
+
+    if not should_profile():
+        return tracked_generate_response(
+            generate_spec, profiling.NullProfile())
+
+    # Profile the request, storing the profile and reporting how long each
+    # stage took in the response
+    profile = profiling.Profile()
+    profile.start()
+    try:
+        response = flask.make_response(
+            tracked_generate_response(generate_spec, profile))
+    finally:
+        profile.stop()
+
+    profile.save(consts.PROFILE_DIR, plans.spec_hash(generate_spec))
+    response.headers["Server-Timing"] = profile.server_timing()
+    return response
+
+def progress_events(job):
+    """
+    Yield server-sent events reporting the progress of the given job, at most
+    once every PROGRESS_INTERVAL seconds (and only when it has changed), until
+    it finishes.
+    """
+
+    last_snapshot = None
+    while True:
+        finished = job.wait(consts.PROGRESS_INTERVAL)
+        snapshot = job.snapshot()
+        if snapshot != last_snapshot:
+            yield "event: progress\ndata: "+json.dumps(snapshot)+"\n\n"
+            last_snapshot = snapshot
+
+        if finished:
+            # A final event, named after how the job finished
+            yield (
+                "event: "+snapshot["stage"]+"\n"+
+                "data: "+json.dumps(snapshot)+"\n\n")
+            return
+
+@app.route(
+    posixpath.normpath(dataAPI["route"] + "/jobs/<job_id>/progress"),
+    methods=["GET"])
+def job_progress_endpoint(job_id):
+    """
+    Stream the progress of the generation with the given job ID (as given to
+    the generate endpoint), as server-sent events.
+
+    Clients may connect before starting the generation, so this waits up to
+    JOB_WAIT seconds for the job to start.
+    """
+
+    job = generation_jobs.get(job_id, timeout=consts.JOB_WAIT)
+    if job is None:
+        return "", 404 # NOT FOUND
+
+    return flask.Response(
+        flask.stream_with_context(progress_events(job)),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no" # Do not buffer in reverse proxies
+        })
+
+@app.route(
+    posixpath.normpath(dataAPI["route"] + "/jobs/<job_id>"),
+    methods=["DELETE"])
+def cancel_job_endpoint(job_id):
+    """
+    Cancel the generation with the given job ID. It stops (and frees what it
+    holds) soon after, then its request fails, and its progress stream ends
+    with a 'cancelled' event.
+    """
+
+    job = generation_jobs.get(job_id)
+    if job is None:
+        return "", 404 # NOT FOUND
+    if job.finished is not None:
+        return "", 409 # CONFLICT
+
+    job.cancel()
+    return json.dumps(job.snapshot()), 202 # ACCEPTED
+
+@app.route(posixpath.normpath(dataAPI["route"] + "/estimate"), methods=["POST"])
+def estimate_endpoint():
+    generate_spec = flask.request.get_json()
+
+    error_response = validate_generate_spec(generate_spec)
+    if error_response is not None:
+        return error_response
+
+    return json.dumps(estimator.estimate(generate_spec))
+
+@app.route(posixpath.normpath(dataAPI["route"] + "/preview"), methods=["POST"])
+def preview_endpoint():
+    generate_spec = flask.request.get_json()
+
+    try:
+        num_records = int(
+            flask.request.args.get("records", consts.PREVIEW_RECORDS))
+    except ValueError:
+        return "", 400 # BAD REQUEST
+    if num_records < 0 or num_records > consts.MAX_PREVIEW_RECORDS:
+        return "", 400 # BAD REQUEST
+
+    error_response = validate_generate_spec(generate_spec)
+    if error_response is not None:
+        return error_response
+
+    # Only the previewed records are generated, so this is cheap regardless of
+    # how many records the tables are set to have. If the spec is seeded, the
+    # preview is the same as the start of the generated tables, except for
+    # tables with orderBy, whose previewed records are sorted among themselves.
+    seed = generate_spec["general"].get("seed")
+    if seed is None:
+        seed = plans.new_seed()
+
+    preview = {}
+    for table_spec in generate_spec["tables"]:
+        table = generate.generate_table(table_spec,
+            seed=seed, max_records=num_records)
+        preview[table_spec["name"]] = {
+            "fields": table["fields"],
+            "records": list(table["records"])
+        }
+
+    return json.dumps(preview), {"X-Dataset-Seed": str(seed)}
+
+# Samples
+# --------------------------------------------------
+
+SAMPLE_MIMETYPES = {
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson"
+}
+
+@app.route(posixpath.normpath(dataAPI["route"] + "/samples"), methods=["POST"])
+def upload_sample_endpoint():
+    """
+    Build a model of one column of the sample data in the request body, for use
+    by 'sampled' fields, and return its ID.
+
+    The body is CSV (with a header row) or NDJSON, as given by the 'format'
+    query parameter or the Content-Type. The 'column' query parameter names the
+    column (or NDJSON key) to model; by default, the first column (or the whole
+    NDJSON value) is modelled. The body is streamed, so samples may be much
+    bigger than memory.
+    """
+
+    sample_format = flask.request.args.get("format",
+        SAMPLE_MIMETYPES.get(flask.request.mimetype, "csv"))
+    column = flask.request.args.get("column")
+
+    try:
+        (model_id, model) = samples.build_model(
+            flask.request.stream, sample_format, column)
+    except ValueError:
+        return "", 400 # BAD REQUEST
+
+    samples.models.put(model_id, model)
+    return (
+        json.dumps(dict(model.summary(), sample=model_id)),
+        201, # CREATED
+        {"Location": posixpath.join(
+            dataAPI["route"], "samples", model_id)})
+
+@app.route(
+    posixpath.normpath(dataAPI["route"] + "/samples/<model_id>"),
+    methods=["GET"])
+def get_sample_endpoint(model_id):
+    """Return a summary of the sample model with the given ID."""
+
+    model = samples.models.get(model_id)
+    if model is None:
+        return "", 404 # NOT FOUND
+
+    # Models never change, so can be cached for as long as a schema can
+    body = json.dumps(dict(model.summary(), sample=model_id))
+    return cacheable_response(body, model_id, consts.SCHEMAS_MAX_AGE)
 
 # Index Page
 # --------------------------------------------------
@@ -139,4 +680,5 @@ def index():
 
 
 if __name__ == "__main__":
-    app.run(host=consts.HOST, port=consts.PORT)
+    # The development server. See gunicorn.conf.py for production.
+    app.run(host=consts.HOST, port=consts.PORT, threaded=True)
@@ -0,0 +1,57 @@
+# Production server configuration. Run with:
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Each of these may be overridden through the environment, as for the app's
+# own settings (see components/consts.py).
+
+# General
+import os
+import shutil
+import tempfile
+import multiprocessing
+
+def _env(name, default):
+    return os.environ.get("DATASET_GENERATOR_"+name, default)
+
+bind = _env("BIND", "127.0.0.1:5000")
+
+# Generation is CPU-bound, so use one worker process per core to use them all.
+# Each worker also serves several requests at once in threads, so that slow
+# clients (and progress streams) do not hold up its other requests.
+workers = int(_env("WORKERS", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(_env("THREADS", 4))
+
+# Large generations can take minutes before the response starts
+timeout = int(_env("WORKER_TIMEOUT", 600))
+
+# Import the app (loading its schemas and name corpora, and calibrating its
+# estimator) once, before forking the workers, so that workers start quickly
+# and share that memory.
+preload_app = True
+
+# Admission control and jobs are shared by every worker, through files in a
+# directory that the master creates before forking them (see
+# create_process_state() in dataset-generator.py), so that admission limits
+# apply to the whole server, and any worker can report a job's progress or
+# cancel it.
+_shared_dir = None
+
+def on_starting(server):
+    global _shared_dir
+    _shared_dir = tempfile.mkdtemp(prefix="dataset-generator-server-")
+
+def post_fork(server, worker):
+    # Each worker needs its own column cache (and locks)
+    import wsgi
+    wsgi.dataset_generator.create_process_state(_shared_dir)
+
+def child_exit(server, worker):
+    # Called in the master, however the worker exited (even if it was killed)
+    import wsgi
+    wsgi.dataset_generator.remove_process_state(worker.pid)
+
+def on_exit(server):
+    import wsgi
+    wsgi.dataset_generator.remove_process_state(os.getpid())
+    shutil.rmtree(_shared_dir, ignore_errors=True)
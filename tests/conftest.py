@@ -0,0 +1,50 @@
+import os
+import sys
+import importlib.util
+
+import pytest
+
+# The tests import the app's components as the app does: from the root of the
+# repository, which is also where the schemas are read from
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from components import generate
+
+import reference
+
+@pytest.fixture(scope="session")
+def app_module():
+    # The app's module name is not a valid identifier (see wsgi.py)
+    module_spec = importlib.util.spec_from_file_location(
+        "dataset_generator", "dataset-generator.py")
+    dataset_generator = importlib.util.module_from_spec(module_spec)
+    module_spec.loader.exec_module(dataset_generator)
+    return dataset_generator
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+@pytest.fixture(scope="module")
+def cli():
+    # The CLI's module name is not a valid identifier. It must be importable
+    # by the name it is loaded as, though, so that its worker processes can
+    # be given its functions.
+    module_spec = importlib.util.spec_from_file_location(
+        "dataset_generator_cli", "dataset-generator-cli.py")
+    cli = importlib.util.module_from_spec(module_spec)
+    sys.modules[module_spec.name] = cli
+    module_spec.loader.exec_module(cli)
+    yield cli
+    del sys.modules[module_spec.name]
+
+@pytest.fixture(scope="session")
+def reference_spec():
+    return reference.reference_spec()
+
+@pytest.fixture(scope="session")
+def reference_csv(reference_spec):
+    return reference.csv_of(
+        generate.generate_table(reference_spec, seed=reference.SEED))
@@ -0,0 +1,78 @@
+"""Helpers for building (and validating) generate specs in tests."""
+
+import jsonschema
+
+from components import schemas, validate, exceptions
+from components.validators import validate_generate
+
+def field(name, data_type, settings=None, primary_key=False):
+    data_type_spec = {"dataType": data_type}
+    if settings is not None:
+        data_type_spec[data_type] = settings
+
+    return {
+        "name": name,
+        "settings": {
+            "keySettings": {"primaryKey": primary_key, "foreignKey": False},
+            "dataType": data_type_spec
+        }
+    }
+
+def id_field(name="id"):
+    return field(name, "numberSequence",
+        {"start": 1, "step": 1, "sequenceType": "infinite"}, primary_key=True)
+
+def derived(name, expression):
+    return field(name, "derived", {"expression": expression})
+
+def table(name, num_records, fields, **settings):
+    return {
+        "name": name,
+        "settings": dict(settings, numRecords=num_records),
+        "fields": fields
+    }
+
+def mixed_table(name, num_records, **settings):
+    """A table with a field of (nearly) every data type."""
+
+    return table(name, num_records, [
+        id_field(),
+        field("forename", "forename", {"distribution": "corpus"}),
+        field("surname", "surname", {"distribution": "zipf", "exponent": 1.1}),
+        field("phone", "phoneNumber"),
+        field("group", "numberSequence", {
+            "start": 5, "step": -1, "sequenceType": "looping",
+            "loopingSequenceParams": {"loopAt": -5}
+        }),
+        field("score", "randomNumber", {"start": 0, "end": 100, "round": 0.5}),
+        field("rank", "randomNumber", {
+            "start": 1, "end": 1000, "round": 1,
+            "distribution": "zipf", "exponent": 1.5
+        }),
+        field("nothing", "null"),
+        derived("email",
+            'lower(forename) + "." + lower(surname) + "@example.com"'),
+        derived("double", "score * 2 + id % 7")
+    ], **settings)
+
+def spec(tables, seed=None):
+    general = {"output-format": "multi-table"}
+    if seed is not None:
+        general["seed"] = seed
+    return {"general": general, "tables": tables}
+
+def check(generate_spec):
+    """
+    Validate the given generate spec as the app does, raising
+    jsonschema.exceptions.ValidationError or
+    exceptions.BadSpecificationError if it is not valid.
+    """
+
+    generate_schema = schemas.Schema("/generate")
+    generate_schema.validate(generate_spec)
+    validate.validate(validate_generate.all, generate_spec, generate_schema)
+
+INVALID = (
+    jsonschema.exceptions.ValidationError,
+    exceptions.BadSpecificationError
+)
@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+
+from components import admission, exceptions
+
+from specs import id_field, table, spec
+
+API = "/data-api/1.0.0"
+
+@pytest.fixture(params=["memory", "shared"])
+def controller(request, tmp_path):
+    limits = (1, 1, 0.5)
+    if request.param == "memory":
+        return admission.AdmissionController(*limits)
+    return admission.SharedAdmissionController(str(tmp_path), *limits)
+
+def test_queued_requests_are_admitted_when_a_slot_is_released(controller):
+    controller.acquire("a", 1)
+    threading.Timer(0.1, controller.release, ("a", 1)).start()
+
+    controller.acquire("b", 1)
+    with pytest.raises(exceptions.OverloadedError):
+        controller.acquire("c", 1) # Times out in the queue
+
+def test_budgets():
+    controller = admission.AdmissionController(2, 0, 0,
+        max_rows_global=100, max_rows_per_client=60)
+    with pytest.raises(exceptions.BudgetExceededError):
+        controller.acquire("a", 61)
+
+    with controller.admit("a", 60):
+        with pytest.raises(exceptions.OverloadedError):
+            controller.acquire("a", 1)
+        with pytest.raises(exceptions.OverloadedError):
+            controller.acquire("b", 41)
+        with controller.admit("b", 40):
+            pass
+    controller.acquire("a", 60)
+
+@pytest.fixture
+def admission_controller(app_module, monkeypatch):
+    controller = admission.AdmissionController(1, 0, 0,
+        max_rows_global=1000, retry_after=7)
+    monkeypatch.setattr(app_module, "admission_controller", controller)
+    return controller
+
+def people_spec(num_records):
+    return spec([table("people", num_records, [id_field()])])
+
+def test_generate_is_admitted(client, admission_controller):
+    response = client.post(API+"/generate", json=people_spec(1000))
+    assert response.status_code == 200
+    response.close()
+
+    # Its slot is given back once it has been sent
+    admission_controller.acquire("a", 1000)
+
+def test_generate_is_rejected_when_overloaded(client, admission_controller):
+    with admission_controller.admit("a", 1):
+        response = client.post(API+"/generate", json=people_spec(10))
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "7"
+
+def test_generate_is_rejected_when_too_big(client, admission_controller):
+    response = client.post(API+"/generate", json=people_spec(1001))
+    assert response.status_code == 413
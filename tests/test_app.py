@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from components import generate, plans
+
+from specs import field, id_field, derived, table, spec
+from reference import SEED, csv_of, generate_people
+
+API = "/data-api/1.0.0"
+
+def people_spec():
+    return spec([table("people", 1000, [
+        id_field(),
+        field("forename", "forename"),
+        derived("initial", "upper(forename)")
+    ], maxRowsPerFile=100)], seed=5)
+
+def test_preview(client):
+    response = client.post(API+"/preview?records=3", json=people_spec())
+    assert response.status_code == 200
+    assert response.headers["X-Dataset-Seed"] == "5"
+
+    preview = json.loads(response.data)
+    assert list(preview) == ["people"]
+    assert set(preview["people"]) == {"fields", "records"}
+    assert [field["name"] for field in preview["people"]["fields"]] == [
+        "id", "forename", "initial"]
+    assert len(preview["people"]["records"]) == 3
+    for (id, forename, initial) in preview["people"]["records"]:
+        assert initial == forename.upper()
+
+def test_preview_rejects_invalid_specs(client):
+    generate_spec = people_spec()
+    generate_spec["tables"][0]["fields"].append(derived("bad", "missing"))
+    assert client.post(API+"/preview", json=generate_spec).status_code == 422
+    assert client.post(API+"/preview?records=x",
+        json=people_spec()).status_code == 400
+
+@pytest.mark.parametrize("max_records", [1, 10000, 12345])
+def test_previews_are_a_prefix(reference_spec, reference_csv, max_records):
+    table_gen = generate_people(reference_spec, max_records=max_records)
+    lines = csv_of(table_gen).split("\n")
+    assert lines == reference_csv.split("\n")[:max_records + 1]
+
+def test_preview_records_are_the_first_generated(client, reference_spec,
+        reference_csv):
+    response = client.post(API+"/preview?records=5",
+        json=spec([reference_spec], seed=SEED))
+    records = json.loads(response.data)["people"]["records"]
+
+    with generate.toCSV({
+            "fields": plans.compile_table(reference_spec).fields,
+            "records": [tuple(record) for record in records]
+            }, with_names=False) as buffer:
+        assert buffer.read().split("\n") == reference_csv.split("\n")[1:6]
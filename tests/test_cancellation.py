@@ -0,0 +1,95 @@
+import time
+import threading
+
+import pytest
+
+from components import admission, exceptions, generate, jobs
+
+from specs import id_field, field, table, spec
+
+API = "/data-api/1.0.0"
+
+@pytest.fixture(params=["memory", "shared"])
+def controller(request, tmp_path):
+    limits = (1, 1, 0.5)
+    if request.param == "memory":
+        return admission.AdmissionController(*limits)
+    return admission.SharedAdmissionController(str(tmp_path), *limits)
+
+@pytest.fixture
+def admission_controller(app_module, monkeypatch):
+    controller = admission.AdmissionController(1, 1, 5)
+    monkeypatch.setattr(app_module, "admission_controller", controller)
+    return controller
+
+def people_spec(num_records):
+    return spec([table("people", num_records, [
+        id_field(),
+        field("phone", "phoneNumber")
+    ])], seed=1)
+
+def test_cancellations_keep_their_first_reason():
+    cancellation = jobs.Cancellation()
+    assert not cancellation.cancelled
+    cancellation.check()
+
+    cancellation.cancel(jobs.DISCONNECTED)
+    cancellation.cancel(jobs.CANCELLED)
+    assert cancellation.cancelled
+    with pytest.raises(exceptions.CancelledError) as raised:
+        cancellation.check()
+    assert raised.value.reason == jobs.DISCONNECTED
+
+def test_cancellations_have_deadlines():
+    cancellation = jobs.Cancellation(deadline=time.monotonic() + 0.05)
+    assert not cancellation.cancelled
+    time.sleep(0.05)
+    assert cancellation.cancelled
+    assert cancellation.reason == jobs.DEADLINE
+
+def test_cancelled_generations_stop():
+    cancellation = jobs.Cancellation()
+    cancellation.cancel(jobs.CANCELLED)
+    with pytest.raises(exceptions.CancelledError):
+        generate.generate_tables(people_spec(100)["tables"],
+            cancel=cancellation)
+
+def test_queued_requests_stop_at_their_deadline(controller):
+    controller.acquire("a", 1)
+
+    started = time.monotonic()
+    with pytest.raises(exceptions.CancelledError) as raised:
+        controller.acquire("b", 1, deadline=started + 0.1)
+    assert raised.value.reason == jobs.DEADLINE
+    assert time.monotonic() - started < 0.4 # Before the queue timeout
+
+    # The queue is free again
+    threading.Timer(0.1, controller.release, ("a", 1)).start()
+    controller.acquire("b", 1)
+
+@pytest.mark.parametrize("deadline", ["0", "-1", "inf", "soon"])
+def test_invalid_deadlines_are_rejected(client, deadline):
+    response = client.post(API+"/generate?deadline="+deadline,
+        json=people_spec(10))
+    assert response.status_code == 400
+
+def test_requests_time_out_in_the_queue(client, admission_controller):
+    with admission_controller.admit("a", 1):
+        started = time.monotonic()
+        response = client.post(API+"/generate?deadline=0.1",
+            json=people_spec(10))
+    assert response.status_code == 504
+    assert time.monotonic() - started < 2 # Before the queue timeout
+
+def test_disconnected_clients_release_their_slot(client,
+        admission_controller):
+    response = client.post(API+"/generate", json=people_spec(200000),
+        buffered=False)
+    assert response.status_code == 200
+    next(iter(response.response)) # Start reading, then stop
+    response.close()
+
+    # Its slot is free again, without waiting in the queue
+    started = time.monotonic()
+    with admission_controller.admit("a", 1):
+        assert time.monotonic() - started < 1
@@ -0,0 +1,82 @@
+import os
+import json
+
+import pytest
+
+from components import checkpoints
+
+from specs import mixed_table, spec
+
+@pytest.fixture
+def spec_path(tmp_path):
+    path = str(tmp_path / "spec.json")
+    with open(path, "w") as spec_file:
+        json.dump(spec([
+            mixed_table("people", 25000),
+            mixed_table("parts", 25000, maxRowsPerFile=10000),
+            mixed_table("sized", 25000, maxBytesPerFile=500000),
+            mixed_table("sorted", 25000, orderBy=["surname", "score"])
+        ], seed=9), spec_file)
+    return path
+
+def read_files(directory):
+    files = {}
+    for (dir_path, _, names) in os.walk(directory):
+        for name in names:
+            path = os.path.join(dir_path, name)
+            with open(path, "rb") as output_file:
+                files[os.path.relpath(path, directory)] = output_file.read()
+    return files
+
+def interrupt_after(monkeypatch, num_saves):
+    """
+    Make the generation stop (as if the process was killed) just before the
+    given number of checkpoints have been saved.
+    """
+
+    save = checkpoints.Checkpointer.save
+    saves = 0
+    def interrupted_save(self, state):
+        nonlocal saves
+        saves += 1
+        if saves == num_saves:
+            raise RuntimeError("interrupted")
+        save(self, state)
+    monkeypatch.setattr(checkpoints.Checkpointer, "save", interrupted_save)
+
+# The first checkpoint of each table is saved before any records are written,
+# so each of these interrupts a different table, or part of one
+@pytest.mark.parametrize("num_saves", [1, 3, 5, 7, 11, 14])
+def test_resumed_runs_are_identical(cli, spec_path, tmp_path, monkeypatch,
+        capsys, num_saves):
+    single = str(tmp_path / "single")
+    cli.main(["generate", spec_path, "-o", single, "-j", "1"])
+
+    resumed = str(tmp_path / "resumed")
+    checkpoint_dir = str(tmp_path / "checkpoints")
+    args = ["generate", spec_path, "-o", resumed, "-j", "1",
+        "-c", checkpoint_dir, "--checkpoint-interval", "0"]
+
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, num_saves)
+        with pytest.raises(RuntimeError):
+            cli.main(args)
+    assert os.path.exists(os.path.join(checkpoint_dir, cli.RUN_CHECKPOINT))
+
+    capsys.readouterr()
+    cli.main(args)
+    err = capsys.readouterr().err
+    if num_saves > 2:
+        assert "resumed from record" in err or "already generated" in err
+    assert read_files(resumed) == read_files(single)
+    assert not os.path.exists(checkpoint_dir)
+
+def test_checkpoints_of_other_specs_are_not_resumed(cli, spec_path, tmp_path):
+    checkpoint_dir = str(tmp_path / "checkpoints")
+    os.makedirs(checkpoint_dir)
+    checkpoints.save(os.path.join(checkpoint_dir, cli.RUN_CHECKPOINT),
+        {"spec": "another spec", "seed": 1})
+
+    with pytest.raises(SystemExit):
+        cli.main(["generate", spec_path, "-o", str(tmp_path / "output"),
+            "-c", checkpoint_dir])
@@ -0,0 +1,43 @@
+import os
+import json
+
+import pytest
+
+from specs import mixed_table, spec
+from reference import SEED, csv_of, generate_people
+
+def write_spec(generate_spec, path):
+    with open(path, "w") as spec_file:
+        json.dump(generate_spec, spec_file)
+    return path
+
+def test_lazy_and_stored_tables_are_identical(reference_spec, reference_csv):
+    assert csv_of(generate_people(reference_spec)) == reference_csv
+
+@pytest.mark.parametrize("batch_size", [1, 7, 9999, 10001])
+def test_batch_sizes(reference_spec, reference_csv, batch_size):
+    table_gen = generate_people(reference_spec)
+    records = list(table_gen["records"])
+    assert csv_of(dict(table_gen, records=records),
+        batch_size=batch_size) == reference_csv
+
+def test_generate_writes_each_table(cli, reference_spec, reference_csv,
+        tmp_path):
+    spec_path = write_spec(spec([
+        reference_spec, mixed_table("empty", 0)
+    ], seed=SEED), str(tmp_path / "spec.json"))
+    output_dir = str(tmp_path / "output")
+    cli.main(["generate", spec_path, "-o", output_dir, "-j", "2"])
+
+    assert sorted(os.listdir(output_dir)) == ["empty.csv", "people.csv"]
+    with open(os.path.join(output_dir, "people.csv"), encoding="utf-8",
+            newline="") as csv_file:
+        assert csv_file.read() == reference_csv
+
+def test_generate_rejects_invalid_specs(cli, tmp_path):
+    spec_path = write_spec(spec([mixed_table("people", -1)]),
+        str(tmp_path / "spec.json"))
+    with pytest.raises(SystemExit) as raised:
+        cli.main(["generate", spec_path, "-o", str(tmp_path / "output")])
+    assert str(raised.value.code).startswith("invalid generate spec")
+    assert not os.path.exists(str(tmp_path / "output"))
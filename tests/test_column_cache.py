@@ -0,0 +1,73 @@
+import os
+import copy
+
+from components import plans, column_cache
+
+from reference import csv_of, generate_people
+
+def cache_in(tmp_path, max_memory=64 * 1024 ** 2, max_disk=64 * 1024 ** 2):
+    return column_cache.ColumnCache(max_memory, max_disk, str(tmp_path))
+
+def generated_fields(monkeypatch):
+    """Record the name of every field that is generated (not cached)."""
+
+    generated = []
+    field_chunks = plans.TablePlan.field_chunks
+    def recorded_field_chunks(self, index, *args, **kwargs):
+        generated.append(self.field_names[index])
+        return field_chunks(self, index, *args, **kwargs)
+    monkeypatch.setattr(plans.TablePlan, "field_chunks", recorded_field_chunks)
+    return generated
+
+def test_cached_columns(reference_spec, reference_csv, tmp_path):
+    cache = cache_in(tmp_path)
+    for _ in range(2): # Generating, then from the cache
+        table_gen = generate_people(reference_spec, cache=cache)
+        assert csv_of(table_gen) == reference_csv
+
+def test_only_edited_fields_are_regenerated(reference_spec, tmp_path,
+        monkeypatch):
+    cache = cache_in(tmp_path)
+    generate_people(reference_spec, cache=cache)
+
+    edited_spec = copy.deepcopy(reference_spec)
+    (score,) = [field_spec for field_spec in edited_spec["fields"]
+        if field_spec["name"] == "score"]
+    score["settings"]["dataType"]["randomNumber"]["end"] = 10
+
+    generated = generated_fields(monkeypatch)
+    edited = generate_people(edited_spec, cache=cache)
+    assert generated == ["score"]
+
+    # Derived fields are derived again from the edited fields
+    plan = plans.compile_table(edited_spec)
+    for record in list(edited["records"])[:100]:
+        (id, score, double) = [record[plan.field_names.index(name)]
+            for name in ("id", "score", "double")]
+        assert 0 <= score <= 10
+        assert double == score * 2 + id % 7
+
+def test_unseeded_tables_are_not_cached(reference_spec, tmp_path,
+        monkeypatch):
+    cache = cache_in(tmp_path)
+    generate_people(reference_spec, seed=None, cache=cache)
+
+    generated = generated_fields(monkeypatch)
+    generate_people(reference_spec, seed=None, cache=cache)
+    assert len(generated) == len(reference_spec["fields"]) - 2 # Not derived
+
+def test_columns_move_to_disk_then_are_dropped(tmp_path):
+    cache = cache_in(tmp_path, max_memory=100, max_disk=1000)
+    columns = {key: [[key] * 10] for key in ("a", "b", "c")}
+    for (key, chunks) in columns.items():
+        cache.put(key, chunks, 60)
+
+    # Only the last fits into memory, and the others onto disk
+    assert [list(cache.get(key)) for key in columns] == list(columns.values())
+    assert sorted(os.listdir(str(tmp_path))) == ["a.column", "b.column"]
+
+    cache.max_disk = 0
+    cache.put("d", [["d"]], 60)
+    assert cache.get("a") is None and cache.get("b") is None
+    assert list(cache.get("d")) == [["d"]]
+    assert os.listdir(str(tmp_path)) == []
@@ -0,0 +1,70 @@
+import io
+import csv
+import zipfile
+
+from components import generate
+
+from specs import field, id_field, derived, table, spec, check
+
+def people_spec(num_records):
+    return spec([table("people", num_records, [
+        id_field(),
+        field("forename", "forename"),
+        field("surname", "surname"),
+        derived("name", 'surname + ", " + forename'),
+        derived("quoted", '"\\"" + forename + "\\"\\n"'),
+        field("nothing", "null")
+    ])], seed=3)
+
+def generate_people(num_records=25000):
+    generate_spec = people_spec(num_records)
+    check(generate_spec)
+    return generate.generate_tables(generate_spec["tables"], seed=3)["people"]
+
+def parse(text):
+    return list(csv.reader(io.StringIO(text, newline="")))
+
+def expected_rows(table_gen):
+    return [
+        [field["name"] for field in table_gen["fields"]]
+    ] + [
+        ["None" if value is None else str(value) for value in record]
+        for record in table_gen["records"]
+    ]
+
+def test_write_csv_is_well_formed():
+    expected = expected_rows(generate_people())
+
+    output = io.StringIO()
+    generate.write_csv(generate_people(), output)
+    rows = parse(output.getvalue())
+
+    assert all(len(row) == len(expected[0]) for row in rows)
+    assert rows == expected
+    assert rows[1][3] == rows[1][2] + ", " + rows[1][1]
+
+def test_record_wise_csv_is_the_same():
+    # Records that cannot be read in chunks are written record by record
+    table_gen = generate_people(100)
+    records = list(table_gen["records"])
+
+    chunked = io.StringIO()
+    generate.write_csv(generate_people(100), chunked)
+    record_wise = io.StringIO()
+    generate.write_csv(dict(table_gen, records=records), record_wise,
+        batch_size=7)
+    with generate.toCSV(dict(table_gen, records=records)) as buffer:
+        in_memory = buffer.read()
+
+    assert record_wise.getvalue() == chunked.getvalue()
+    assert in_memory == chunked.getvalue()
+    assert parse(in_memory) == expected_rows(dict(table_gen, records=records))
+
+def test_multi_csv_is_well_formed():
+    expected = expected_rows(generate_people(1000))
+
+    with generate.toMultiCSV({"people": generate_people(1000)}) as buffer:
+        with zipfile.ZipFile(buffer) as archive:
+            text = archive.read("people.csv").decode("utf-8")
+
+    assert parse(text) == expected
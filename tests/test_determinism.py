@@ -0,0 +1,45 @@
+"""
+Generations with the same seed give byte-identical output, and generations
+with different seeds do not, even when several run in threads at once (as the
+requests of a threaded server do).
+"""
+
+import threading
+
+from reference import SEED, csv_of, generate_people
+
+def test_seeds_matter(reference_spec, reference_csv):
+    table_gen = generate_people(reference_spec, seed=SEED + 1)
+    assert csv_of(table_gen) != reference_csv
+
+def run_in_threads(fns):
+    """Run the given functions in threads at once, returning their results."""
+
+    results = [None] * len(fns)
+    def run(index):
+        results[index] = fns[index]()
+
+    threads = [
+        threading.Thread(target=run, args=(index,))
+        for index in range(len(fns))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_concurrent_generations(reference_spec, reference_csv):
+    outputs = run_in_threads(
+        [lambda: csv_of(generate_people(reference_spec))] * 4)
+    assert outputs == [reference_csv] * len(outputs)
+
+def test_concurrent_generations_with_other_seeds(reference_spec):
+    seeds = [SEED + offset for offset in range(1, 5)]
+    expected = [csv_of(generate_people(reference_spec, seed=seed))
+        for seed in seeds]
+
+    outputs = run_in_threads([
+        lambda seed=seed: csv_of(generate_people(reference_spec, seed=seed))
+        for seed in seeds])
+    assert outputs == expected
+    assert len(set(outputs)) == len(seeds)
@@ -0,0 +1,59 @@
+import random
+from array import array
+from itertools import islice
+
+import pytest
+
+from components import generators, plans
+
+from specs import field, id_field, table
+
+@pytest.mark.parametrize(("num_values", "typecode"), [
+    (1, "B"), (256, "B"), (257, "H"), (65536, "H"), (65537, "I")
+])
+def test_codes_are_as_narrow_as_possible(num_values, typecode):
+    dictionary = generators.Dictionary(range(num_values))
+    assert len(dictionary) == num_values
+    assert dictionary.typecode == typecode
+
+    codes = dictionary.encode([0, num_values - 1])
+    assert codes == array(typecode, [0, num_values - 1])
+    assert dictionary.decode(codes) == [0, num_values - 1]
+
+def test_values_round_trip():
+    values = ["Ann", "O'Neil, Jr.", 'say "hi"', "two\nlines", 3.5, None]
+    dictionary = generators.Dictionary(values)
+    codes = dictionary.encode(iter([5, 0, 1, 2, 3, 4, 0]))
+
+    assert dictionary.decode(codes) == [
+        None, "Ann", "O'Neil, Jr.", 'say "hi"', "two\nlines", 3.5, "Ann"]
+    assert dictionary.format(codes) == [
+        "None", "Ann", '"O\'Neil, Jr."', '"say ""hi"""', '"two\nlines"',
+        "3.5", "Ann"]
+    assert dictionary.format(codes) == [
+        generators.csv_field(value) for value in dictionary.decode(codes)]
+
+def test_names_are_dictionary_encoded():
+    plan = plans.compile_table(table("people", 100, [
+        id_field(),
+        field("forename", "forename"),
+        field("surname", "surname", {"distribution": "zipf", "exponent": 1})
+    ]))
+    dictionaries = generators.DICTIONARIES
+
+    for (index, corpus) in [(1, "forenames"), (2, "surnames")]:
+        assert plan.dictionaries[index] is dictionaries[corpus]
+        (chunk,) = plan.field_chunks(index, seed=1)
+        assert isinstance(chunk, array)
+        assert chunk.typecode == dictionaries[corpus].typecode
+
+    (forenames,) = plan.field_chunks(1, seed=1)
+    assert [record[1] for record in plan.records(seed=1)] == \
+        dictionaries["forenames"].decode(forenames)
+
+def test_uniform_names_are_chosen_as_from_the_values():
+    codes = generators.forename(rng=random.Random(5))
+    rng = random.Random(5)
+    expected = [rng.choice(generators.FORENAMES) for _ in range(20)]
+    assert generators.DICTIONARIES["forenames"].decode(
+        islice(codes, 20)) == expected
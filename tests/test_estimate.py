@@ -0,0 +1,67 @@
+import io
+import json
+import time
+
+import pytest
+
+from components import estimate, generate
+
+from specs import mixed_table, spec, check
+
+API = "/data-api/1.0.0"
+
+NUM_RECORDS = 5000
+
+@pytest.fixture(scope="module")
+def estimator():
+    return estimate.Estimator(estimate.calibrate(
+        num_records=2000, num_traced_records=200))
+
+@pytest.fixture(scope="module")
+def generate_spec():
+    generate_spec = spec([mixed_table("people", NUM_RECORDS)], seed=11)
+    check(generate_spec)
+    return generate_spec
+
+def test_estimates_match_generated_output(estimator, generate_spec):
+    estimates = estimator.estimate(generate_spec)
+    people = estimates["tables"]["people"]
+
+    table_gen = generate.generate_tables(generate_spec["tables"], seed=11)[
+        "people"]
+    output = io.StringIO()
+    generate.write_csv(table_gen, output)
+    csv_bytes = output.getvalue().encode("utf-8")
+
+    assert people["rows"] == estimates["total"]["rows"] == NUM_RECORDS
+    assert people["cells"] == NUM_RECORDS * 10
+    assert people["uncompressedBytes"] == pytest.approx(len(csv_bytes),
+        rel=0.1)
+    assert people["compressedBytes"] == pytest.approx(
+        len(estimate._deflate(csv_bytes)), rel=0.25)
+    assert people["peakMemoryBytes"] >= people["recordsMemoryBytes"] > 0
+    assert people["wallTimeSeconds"] > 0
+
+def test_estimate_endpoint(client, generate_spec):
+    response = client.post(API+"/estimate", json=generate_spec)
+    assert response.status_code == 200
+
+    estimates = json.loads(response.data)
+    assert list(estimates["tables"]) == ["people"]
+    assert estimates["total"]["rows"] == NUM_RECORDS
+    assert estimates["total"]["uncompressedBytes"] == \
+        estimates["tables"]["people"]["uncompressedBytes"]
+
+def test_huge_specs_are_estimated_quickly(client):
+    huge_spec = spec([mixed_table("people", 10 ** 9)])
+    start = time.perf_counter()
+    response = client.post(API+"/estimate", json=huge_spec)
+    seconds = time.perf_counter() - start
+
+    assert response.status_code == 200
+    assert json.loads(response.data)["total"]["rows"] == 10 ** 9
+    assert seconds < 2
+
+def test_invalid_specs_are_not_estimated(client):
+    invalid_spec = spec([mixed_table("people", -1)])
+    assert client.post(API+"/estimate", json=invalid_spec).status_code == 422
@@ -0,0 +1,123 @@
+import tracemalloc
+
+import pytest
+
+from components import expressions, generate
+
+from specs import field, id_field, derived, table, spec, check, INVALID
+
+def people(*fields, num_records=10):
+    return spec([table("people", num_records, [
+        id_field(),
+        field("forename", "forename"),
+        field("surname", "surname"),
+        field("score", "randomNumber", {"start": 0, "end": 10, "round": 1}),
+        field("nothing", "null"),
+        *fields
+    ])], seed=1)
+
+def test_valid_expressions_are_accepted():
+    check(people(
+        derived("name", 'forename + " " + upper(surname)'),
+        derived("double", "score * 2 + id % 7"),
+        derived("rounded", "round(double / 3, 1)")))
+
+@pytest.mark.parametrize("expression", [
+    "forename +",                  # Bad syntax
+    "__import__('os')",            # Unknown function
+    "forename.upper()",            # Attribute access
+    "[id]",                        # Unsupported syntax
+    "missing + 1",                 # Unknown field
+    "forename * 2",                # Repeating a string
+    "forename - 1",                # Type error
+    "upper(id)",                   # Type error in a function call
+    "min()",                       # Bad number of arguments
+    '"%99999999d" % id',           # Formatting a string
+    '("%99999999d" if id > 0 else 0) % id', # ... of a type not known
+    "nothing * 2",                 # Multiplying a value of unknown type
+    "nothing + nothing",           # Adding values of unknown types
+])
+def test_invalid_expressions_are_rejected(expression):
+    with pytest.raises(INVALID):
+        check(people(derived("bad", expression)))
+
+def test_cycles_are_rejected():
+    with pytest.raises(INVALID):
+        check(people(derived("a", "b + 1"), derived("b", "a + 1")))
+    with pytest.raises(INVALID):
+        check(people(derived("a", "a + 1")))
+
+def chain(depth, expression):
+    """
+    A chain of depth derived fields, s1 to s<depth>, each of which is the
+    given expression of the last (where s0 is the score field).
+    """
+
+    return [
+        derived("s"+str(index),
+            expression.replace("x", "s"+str(index - 1) if index > 1 else "score"))
+        for index in range(1, depth + 1)]
+
+def test_long_chains_of_derived_fields_are_rejected():
+    check(people(*chain(expressions.MAX_DERIVED_DEPTH, "x + 1")))
+    with pytest.raises(INVALID):
+        check(people(*chain(expressions.MAX_DERIVED_DEPTH + 1, "x + 1")))
+    with pytest.raises(INVALID):
+        check(people(*chain(40, "x + x")))
+
+def generate_values(generate_spec, field_name):
+    check(generate_spec)
+    (table_spec,) = generate_spec["tables"]
+    tables = generate.generate_tables([table_spec], seed=1)
+    records = list(tables[table_spec["name"]]["records"])
+    index = [
+        field_spec["name"] for field_spec in table_spec["fields"]
+    ].index(field_name)
+    return [record[index] for record in records]
+
+def test_growing_strings_are_capped():
+    depth = expressions.MAX_DERIVED_DEPTH
+    generate_spec = people(
+        derived("s0", "str(score)"),
+        *[derived("s"+str(index), "s{0} + s{0}".format(index - 1))
+            for index in range(1, depth)],
+        num_records=1)
+
+    values = generate_values(generate_spec, "s"+str(depth - 1))
+    assert values == [None]
+
+    # Values are only null once they are too big
+    sizes = [len(value) for value in generate_values(generate_spec, "s8")]
+    assert sizes[0] <= expressions.MAX_STRING_LENGTH
+
+def test_growing_integers_are_capped():
+    depth = expressions.MAX_DERIVED_DEPTH
+    generate_spec = people(
+        derived("i0", "id + 1"),
+        *[derived("i"+str(index), "i{0} * i{0}".format(index - 1))
+            for index in range(1, depth)],
+        num_records=1)
+
+    assert generate_values(generate_spec, "i"+str(depth - 1)) == [None]
+    assert generate_values(generate_spec, "i3") == [2 ** 8]
+
+def test_strings_are_not_formatted():
+    # Even if the expression's types are not known until it is evaluated
+    expression = expressions.Expression("format % n")
+    assert expression.evaluate(
+        {"format": ["%99999999d"] * 3, "n": [1, 2, 3]}, 3) == [None] * 3
+
+def test_values_are_limited_as_they_are_produced():
+    size = 1000
+    expression = expressions.Expression("s + s + s")
+    column = ["x" * expressions.MAX_STRING_LENGTH] * size
+
+    tracemalloc.start()
+    try:
+        assert expression.evaluate({"s": column}, size) == [None] * size
+        (_, peak) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # Far less than a column of the too-big values would take
+    assert peak < size * expressions.MAX_STRING_LENGTH
@@ -0,0 +1,36 @@
+import pytest
+
+from components import jobs
+
+@pytest.mark.parametrize("registry", [
+    lambda tmp_path: jobs.JobRegistry(60),
+    lambda tmp_path: jobs.SharedJobRegistry(str(tmp_path), 60)
+])
+def test_job_ids_must_be_url_safe(registry, tmp_path):
+    registry = registry(tmp_path)
+
+    registry.create("0b5e0b7a-job_1")
+    for job_id in ["", "job\n", "job/../x", "job 1", "a" * 65]:
+        with pytest.raises(ValueError):
+            registry.create(job_id)
+
+def test_job_progress():
+    registry = jobs.JobRegistry(60)
+    job = registry.create("job")
+    assert registry.get("job") is job
+    assert registry.get("other") is None
+
+    job.start([
+        {"name": "a", "settings": {"numRecords": 10}},
+        {"name": "b", "settings": {"numRecords": 30}}
+    ])
+    job.generated("a", 10)
+    job.generated("b", 10)
+    snapshot = job.snapshot()
+    assert (snapshot["stage"], snapshot["rows"], snapshot["totalRows"]) == (
+        "generating", 20, 40)
+
+    job.finish(200)
+    job.finish(500) # Only the first finish counts
+    assert job.wait(0)
+    assert (job.snapshot()["stage"], job.snapshot()["status"]) == ("done", 200)
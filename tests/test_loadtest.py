@@ -0,0 +1,26 @@
+import os
+import importlib.util
+
+import pytest
+
+@pytest.fixture(scope="module")
+def loadtest():
+    module_spec = importlib.util.spec_from_file_location(
+        "loadtest", os.path.join("tools", "loadtest.py"))
+    loadtest = importlib.util.module_from_spec(module_spec)
+    module_spec.loader.exec_module(loadtest)
+    return loadtest
+
+def test_gunicorn_is_run_by_its_script(loadtest, tmp_path, monkeypatch):
+    script = tmp_path / "gunicorn"
+    script.write_text("#!/bin/sh\n")
+    script.chmod(0o755)
+    monkeypatch.setattr(loadtest.sys, "executable", str(tmp_path / "python"))
+
+    assert loadtest.gunicorn_path() == str(script)
+
+def test_missing_gunicorn_fails_clearly(loadtest, monkeypatch):
+    monkeypatch.setattr(loadtest, "gunicorn_path", lambda: None)
+    with pytest.raises(SystemExit) as exited:
+        loadtest.start_server("gunicorn", 5099)
+    assert "gunicorn is not installed" in str(exited.value)
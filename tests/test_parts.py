@@ -0,0 +1,69 @@
+import io
+import json
+import hashlib
+
+import pytest
+
+from components import generate
+
+from reference import generate_people
+
+def write_parts(table_gen, **kwargs):
+    parts = []
+    def open_part(number):
+        assert number == len(parts)
+        parts.append(io.BytesIO())
+        parts[-1].close = lambda: None # Keep it readable
+        return parts[-1]
+
+    summaries = generate.write_csv_parts(table_gen, open_part, **kwargs)
+    return ([part.getvalue() for part in parts], summaries)
+
+def split_parts(parts, header):
+    rows = []
+    for part in parts:
+        (part_header, *part_rows) = part.decode("utf-8").split("\n")
+        assert part_header == header
+        rows.append(part_rows)
+    return rows
+
+@pytest.mark.parametrize("max_rows", [1000, 9999, 30000])
+def test_parts(reference_spec, reference_csv, max_rows):
+    (parts, summaries) = write_parts(generate_people(reference_spec),
+        max_rows=max_rows)
+
+    (header, *records) = reference_csv.split("\n")
+    rows = split_parts(parts, header)
+    assert all(len(part_rows) <= max_rows for part_rows in rows)
+    assert [row for part_rows in rows for row in part_rows] == records
+    assert [summary["rows"] for summary in summaries] == [
+        len(part_rows) for part_rows in rows]
+
+@pytest.mark.parametrize("max_bytes", [1, 100000, 999999])
+def test_sized_parts(reference_spec, reference_csv, max_bytes):
+    (parts, summaries) = write_parts(generate_people(reference_spec),
+        max_bytes=max_bytes)
+
+    (header, *records) = reference_csv.split("\n")
+    rows = split_parts(parts, header)
+    assert [row for part_rows in rows for row in part_rows] == records
+
+    # Every part has at least one record, however small max_bytes is
+    for (part, part_rows) in zip(parts, rows):
+        assert len(part) <= max_bytes or len(part_rows) == 1
+    assert [summary["bytes"] for summary in summaries] == [
+        len(part) for part in parts]
+
+def test_part_manifests(reference_spec):
+    table_gen = generate_people(reference_spec)
+    (parts, summaries) = write_parts(table_gen, max_rows=10000)
+
+    manifest = json.loads(generate.part_manifest(table_gen["fields"],
+        summaries))
+    assert manifest["fields"] == [
+        field_spec["name"] for field_spec in reference_spec["fields"]]
+    assert manifest["rows"] == 25000
+    assert [part["file"] for part in manifest["parts"]] == [
+        "part-00000.csv", "part-00001.csv", "part-00002.csv"]
+    assert [part["sha256"] for part in manifest["parts"]] == [
+        hashlib.sha256(part).hexdigest() for part in parts]
@@ -0,0 +1,52 @@
+import copy
+
+from components import plans
+
+from specs import field, id_field, table, spec, check
+from reference import SEED
+
+def test_plans_are_cached_by_structure(reference_spec):
+    plan = plans.compile_table(reference_spec)
+
+    # The same spec, with its keys in another order
+    reordered = {key: copy.deepcopy(reference_spec[key])
+        for key in reversed(list(reference_spec))}
+    assert plans.compile_table(reordered) is plan
+
+    changed = copy.deepcopy(reference_spec)
+    changed["settings"]["numRecords"] += 1
+    assert plans.compile_table(changed) is not plan
+
+def test_plans(reference_spec):
+    plan = plans.compile_table(reference_spec)
+    assert plan.name == "people"
+    assert plan.field_names == [
+        field_spec["name"] for field_spec in reference_spec["fields"]]
+    assert plan.fields[0] == {
+        "name": "id", "primary_key": True, "foreign_key": None}
+    assert plan.constructors[plan.field_names.index("email")] is None
+    assert plan.dictionaries[plan.field_names.index("forename")] is not None
+    assert plan.dictionaries[plan.field_names.index("phone")] is None
+
+def test_fields_only_depend_on_their_own_spec(reference_spec):
+    people = plans.compile_table(reference_spec)
+    some_people = table("people", 12345, [
+        field("phone", "phoneNumber"),
+        id_field("other_id")
+    ])
+    check(spec([some_people]))
+    plan = plans.compile_table(some_people)
+
+    phones = [value
+        for chunk in plan.field_chunks(0, SEED)
+        for value in chunk]
+    all_phones = [value
+        for chunk in people.field_chunks(people.field_names.index("phone"),
+            SEED)
+        for value in chunk]
+    assert phones == all_phones[:12345]
+
+def test_records_of_tables_without_fields():
+    plan = plans.compile_table(table("nothing", 3, []))
+    assert list(plan.records(SEED)) == [(), (), ()]
+    assert list(plan.records(SEED, start=1)) == [(), ()]
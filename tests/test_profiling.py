@@ -0,0 +1,83 @@
+import io
+import os
+import pstats
+import zipfile
+
+import pytest
+
+from components import consts, profiling
+
+from specs import field, id_field, table, spec
+
+API = "/data-api/1.0.0"
+
+TOKEN = "let-me-profile"
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(consts, "PROFILE_TOKEN", TOKEN)
+    monkeypatch.setattr(consts, "PROFILE_SAMPLE_RATE", 0)
+    monkeypatch.setattr(consts, "PROFILE_DIR", str(tmp_path / "profiles"))
+    return tmp_path / "profiles"
+
+def people_spec():
+    return spec([table("people", 1000, [
+        id_field(),
+        field("forename", "forename")
+    ])], seed=2)
+
+def test_stages_are_timed(tmp_path):
+    profile = profiling.Profile()
+    profile.start()
+    with profile.stage("generate"):
+        sum(range(10000))
+    with profile.stage("encode"):
+        pass
+    profile.stop()
+
+    assert [name for (name, _, _) in profile.stages] == ["generate", "encode"]
+    metrics = [metric.split(";dur=")
+        for metric in profile.server_timing().split(", ")]
+    assert [name for (name, _) in metrics] == [
+        "generate", "generate-cpu", "encode", "encode-cpu"]
+    assert all(float(duration) >= 0 for (_, duration) in metrics)
+
+    path = profile.save(str(tmp_path), "tag")
+    assert os.path.basename(path).startswith("tag-")
+    assert pstats.Stats(path).total_calls > 0
+
+def test_null_profiles_record_nothing():
+    profile = profiling.NullProfile()
+    profile.start()
+    with profile.stage("generate"):
+        pass
+    profile.stop()
+    assert not profile.enabled
+
+def test_profiled_requests(client, profile_dir):
+    response = client.post(API+"/generate", json=people_spec(),
+        headers={"X-Profile": TOKEN})
+    assert response.status_code == 200
+
+    stages = [metric.split(";")[0]
+        for metric in response.headers["Server-Timing"].split(", ")]
+    assert {"validate", "generate", "encode"} <= set(stages)
+    assert "generate-cpu" in stages
+
+    (profile_name,) = os.listdir(str(profile_dir))
+    assert profile_name.endswith(".prof")
+    assert pstats.Stats(str(profile_dir / profile_name)).total_calls > 0
+
+    # The output is the same as an unprofiled request's
+    zip_file = zipfile.ZipFile(io.BytesIO(response.data))
+    assert zip_file.namelist() == ["people.csv"]
+
+@pytest.mark.parametrize("headers", [{}, {"X-Profile": "guess"}])
+def test_other_requests_are_not_profiled(client, profile_dir, headers):
+    response = client.post(API+"/generate", json=people_spec(),
+        headers=headers)
+    assert response.status_code == 200
+    response.close()
+
+    assert "Server-Timing" not in response.headers
+    assert not profile_dir.exists()
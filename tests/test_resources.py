@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+from components import resources
+
+API = "/resource-api/1.0.0"
+
+@pytest.fixture
+def index(tmp_path):
+    (tmp_path / "icons").mkdir()
+    (tmp_path / "icons" / "table.svg").write_text("<svg/>")
+    return resources.ResourceIndex(str(tmp_path), check_interval=0)
+
+@pytest.fixture
+def images(app_module, index, monkeypatch):
+    monkeypatch.setitem(app_module.resourceIndexes, "image", index)
+    return index
+
+def test_index_contains_files(index, tmp_path):
+    assert index.contains("icons/table.svg")
+    assert index.contains("./icons/../icons/table.svg")
+    assert not index.contains("icons")
+    assert not index.contains("icons/chair.svg")
+
+    (tmp_path / "icons" / "chair.svg").write_text("<svg/>")
+    assert index.contains("icons/chair.svg")
+    (tmp_path / "icons" / "table.svg").unlink()
+    assert not index.contains("icons/table.svg")
+
+def test_index_is_only_rebuilt_after_its_check_interval(tmp_path):
+    index = resources.ResourceIndex(str(tmp_path), check_interval=3600)
+    assert not index.contains("new.svg")
+    (tmp_path / "new.svg").write_text("<svg/>")
+    assert not index.contains("new.svg")
+
+@pytest.mark.parametrize("path", [
+    "..", "../images/icons/table.svg", "icons/../../x", "/etc/passwd", "."
+])
+def test_paths_outside_the_root_are_not_resources(index, path):
+    assert not resources.is_inside(path)
+    assert not index.contains(path)
+
+def get_resource(client, resource, **headers):
+    return client.get(API+"/resource",
+        query_string={"resourceType": "image", "resource": resource},
+        headers=headers)
+
+def test_unchanged_resources_are_not_modified(client, images):
+    response = get_resource(client, "icons/table.svg")
+    assert response.status_code == 200
+    assert json.loads(response.data) == {
+        "path": "/static/images/icons/table.svg", "exists": True}
+    assert response.headers["Cache-Control"].startswith("public")
+
+    response = get_resource(client, "icons/table.svg",
+        **{"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+    assert response.data == b""
+
+def test_etags_change_when_resources_do(client, images, tmp_path):
+    before = get_resource(client, "icons/chair.svg")
+    assert json.loads(before.data)["exists"] is False
+
+    (tmp_path / "icons" / "chair.svg").write_text("<svg/>")
+    after = get_resource(client, "icons/chair.svg",
+        **{"If-None-Match": before.headers["ETag"]})
+    assert after.status_code == 200
+    assert json.loads(after.data)["exists"] is True
+    assert after.headers["ETag"] != before.headers["ETag"]
+
+@pytest.mark.parametrize("resource", [
+    "../css/app.css", "../../dataset-generator.py", "/etc/passwd"
+])
+def test_path_traversal_is_rejected(client, images, resource):
+    assert get_resource(client, resource).status_code == 400
+
+def test_unknown_resource_types_are_not_found(client):
+    response = client.get(API+"/resource",
+        query_string={"resourceType": "video", "resource": "a.mp4"})
+    assert response.status_code == 404
+
+def test_types_are_cacheable(client):
+    response = client.get(API+"/types")
+    assert json.loads(response.data) == {"image": "image"}
+    response = client.get(API+"/types",
+        headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
@@ -0,0 +1,123 @@
+import io
+import json
+import random
+
+import pytest
+
+from components import samples, generate
+
+from specs import field, id_field, table, spec, check
+
+API = "/data-api/1.0.0"
+
+@pytest.fixture
+def models(tmp_path, monkeypatch):
+    models = samples.ModelStore(str(tmp_path / "models"), 4)
+    monkeypatch.setattr(samples, "models", models)
+    return models
+
+def summary(response):
+    return json.loads(response.data)
+
+def build(values, **kwargs):
+    builder = samples.ModelBuilder(**kwargs)
+    builder.extend(values)
+    return builder.model()
+
+def weights_of(model):
+    return dict(zip(model.values, model.weights))
+
+def test_small_samples_are_counted_exactly():
+    model = build(["a", "b", "a", "c", "a", "b"])
+    assert model.rows == 6
+    assert model.values == ["a", "b", "c"]
+    assert model.weights == [3, 2, 1]
+
+def test_heavy_hitters_are_counted():
+    values = ["a"] * 600 + ["b"] * 300 + [str(i) for i in range(100)]
+    random.Random(1).shuffle(values)
+    model = build(values, reservoir_size=20, heavy_hitters=10)
+    weights = weights_of(model)
+
+    # Each count is off by at most half of rows / (heavy_hitters + 1)
+    assert model.values[:2] == ["a", "b"]
+    assert weights["a"] == pytest.approx(600, abs=1000 / 11 / 2)
+    assert weights["b"] == pytest.approx(300, abs=1000 / 11 / 2)
+    assert sum(model.weights) == pytest.approx(1000)
+
+def test_the_tail_is_weighted_by_the_reservoir():
+    model = build([str(i) for i in range(1000)], reservoir_size=100,
+        heavy_hitters=10)
+    assert model.rows == 1000
+    assert len(model) == 100
+    assert model.weights == [pytest.approx(10)] * 100
+
+def test_models_are_built_from_a_column():
+    sample = b"name,colour\nann,red\nbob,blue\ncat,red\n"
+    (_, model) = samples.build_model(io.BytesIO(sample), "csv", "colour")
+    assert weights_of(model) == {"red": 2, "blue": 1}
+
+    sample = b'{"n": 1, "c": "red"}\n\n{"n": 2, "c": {"b": 1, "a": 2}}\n'
+    (_, model) = samples.build_model(io.BytesIO(sample), "ndjson", "c")
+    assert model.values == ["red", '{"a": 2, "b": 1}']
+
+def test_the_same_upload_gives_the_same_model(client, models):
+    sample = b"name,colour\nann,red\nbob,blue\ncat,red\n"
+    first = client.post(API+"/samples?column=colour", data=sample,
+        content_type="text/csv")
+    second = client.post(API+"/samples?column=colour", data=sample,
+        content_type="text/csv")
+    assert first.status_code == second.status_code == 201
+    assert summary(first)["sample"] == summary(second)["sample"]
+    assert summary(first)["rows"] == 3
+    assert summary(first)["top"] == [
+        {"value": "red", "rows": 2}, {"value": "blue", "rows": 1}]
+
+    other = client.post(API+"/samples?column=name", data=sample,
+        content_type="text/csv")
+    assert summary(other)["sample"] != summary(first)["sample"]
+
+    response = client.get(first.headers["Location"])
+    assert response.status_code == 200
+    assert summary(response) == summary(first)
+    assert samples.valid_model_id(summary(first)["sample"])
+    assert summary(first)["sample"] in models
+
+def test_unknown_models_are_not_found(client, models):
+    assert client.get(API+"/samples/"+"0" * 64).status_code == 404
+    assert client.get(API+"/samples/../schemas").status_code == 404
+
+@pytest.mark.parametrize(("query", "sample"), [
+    ("format=csv", b""),
+    ("format=csv", b"name\n\xff\xfe\n"),
+    ("format=csv&column=colour", b"name,colour\nann,red\nbob\n"),
+    ("format=csv&column=missing", b"name,colour\nann,red\n"),
+    ("format=ndjson", b'{"name": "ann"}\nnot json\n'),
+    ("format=ndjson&column=name", b'{"name": "ann"}\n["bob"]\n'),
+    ("format=xml", b"<name>ann</name>"),
+])
+def test_bad_samples_are_rejected(client, models, query, sample):
+    response = client.post(API+"/samples?"+query, data=sample)
+    assert response.status_code == 400
+
+def test_sampled_fields_are_reproducible(client, models):
+    sample = "\n".join(["colour"] + ["red"] * 50 + ["blue"] * 30 +
+        ["colour " + str(i) for i in range(20)])
+    model_id = summary(client.post(API+"/samples", data=sample,
+        content_type="text/csv"))["sample"]
+
+    generate_spec = spec([table("things", 5000, [
+        id_field(),
+        field("colour", "sampled", {"sample": model_id})
+    ])], seed=3)
+    check(generate_spec)
+
+    def colours(seed):
+        tables = generate.generate_tables(generate_spec["tables"], seed=seed)
+        return [record[1] for record in tables["things"]["records"]]
+
+    colours_3 = colours(3)
+    assert colours_3 == colours(3)
+    assert colours_3 != colours(4)
+    assert set(colours_3) <= set(sample.split("\n")[1:])
+    assert colours_3.count("red") == pytest.approx(2500, rel=0.1)
@@ -0,0 +1,69 @@
+import random
+from collections import Counter
+
+import pytest
+
+from components import sampling, generate
+
+from specs import field, id_field, table, spec, check, INVALID
+
+def test_zipf_weights():
+    assert sampling.zipf_weights(3, 1) == [1, 1 / 2, 1 / 3]
+
+def test_large_zipf_exponents_only_draw_the_first_ranks():
+    weights = sampling.zipf_weights(5, 2000.5)
+    assert weights == [1, 0, 0, 0, 0]
+
+    table = sampling.AliasTable("abcde", weights)
+    assert {table.sample(random.Random(seed)) for seed in range(100)} == {"a"}
+
+def test_large_zipf_exponents_generate():
+    zipf = {"distribution": "zipf", "exponent": 2000.5}
+    generate_spec = spec([table("people", 100, [
+        id_field(),
+        field("surname", "surname", zipf),
+        field("score", "randomNumber",
+            dict(zipf, start=0, end=100, round=1))
+    ])], seed=1)
+    check(generate_spec)
+
+    tables = generate.generate_tables(generate_spec["tables"], seed=1)
+    records = list(tables["people"]["records"])
+    assert len({record[1] for record in records}) == 1
+    assert {record[2] for record in records} == {0}
+
+def forenames(settings, num_records=10000):
+    generate_spec = spec([table("people", num_records, [
+        id_field(),
+        field("forename", "forename", settings)
+    ])], seed=1)
+    check(generate_spec)
+
+    tables = generate.generate_tables(generate_spec["tables"], seed=1)
+    return Counter(record[1] for record in tables["people"]["records"])
+
+def test_corpus_weights_are_followed():
+    weights = {"Jennifer": 200, "Samson": 100, "Tyrone": 0}
+    corpus = forenames({"distribution": "corpus", "weights": weights})
+    uniform = forenames({"distribution": "uniform"})
+    assert corpus != uniform
+
+    # The other forenames have a weight of 1 each
+    others = len(generate.generators.FORENAMES) - len(weights)
+    assert corpus["Tyrone"] == 0 < uniform["Tyrone"]
+    assert corpus["Jennifer"] == pytest.approx(2 * corpus["Samson"], rel=0.15)
+    assert corpus["Jennifer"] + corpus["Samson"] == \
+        pytest.approx(10000 * 300 / (300 + others), rel=0.05)
+
+@pytest.mark.parametrize("weights", [
+    {"Nobody": 1},
+    {"Jennifer": -1},
+    {name: 0 for name in generate.generators.FORENAMES}
+])
+def test_invalid_corpus_weights(weights):
+    with pytest.raises(INVALID):
+        check(spec([table("people", 10, [
+            id_field(),
+            field("forename", "forename",
+                {"distribution": "corpus", "weights": weights})
+        ])]))
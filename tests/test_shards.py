@@ -0,0 +1,165 @@
+"""
+Merged shards are identical to generating their spec on a single node, whether
+merged into a directory (as the CLI writes) or a zip file (as the web app
+writes), including tables written in parts. Any range of records of a table
+can be generated on its own, so each shard can be generated independently.
+"""
+
+import io
+import os
+import json
+import zipfile
+
+import pytest
+
+from components import generate, plans, shards, exceptions
+
+import reference
+from specs import field, id_field, derived, mixed_table, table, spec, check
+
+SEED = 7
+SHARD_RECORDS = 7000 # So that shards and parts end on different records
+
+@pytest.mark.parametrize("start", [1, 9999, 10000, 24999])
+def test_records_from_any_start(reference_spec, reference_csv, start):
+    plan = plans.compile_table(reference_spec)
+    records = plans.ChunkedRecords(plan, reference.SEED,
+        reference.NUM_RECORDS - start, start)
+    lines = reference.csv_of({"fields": plan.fields, "records": records},
+        with_names=False).split("\n")
+    assert lines == reference_csv.split("\n")[start + 1:]
+
+def test_merged_tables_match_the_reference(reference_spec, reference_csv,
+        tmp_path):
+    generate_spec = spec([reference_spec], seed=reference.SEED)
+    manifest = shards.make_manifest(generate_spec, 10000)
+    assert [shard["id"] for shard in manifest["shards"]] == [
+        "people-000000", "people-000001", "people-000002"]
+
+    # Two workers share the shards between them
+    shard_dir = str(tmp_path)
+    first = shards.work(manifest, shard_dir)
+    summaries = [next(first)]
+    summaries.extend(shards.work(manifest, shard_dir))
+    summaries.extend(first)
+    assert sorted(summary["id"] for summary in summaries) == [
+        "people-000000", "people-000001", "people-000002"]
+
+    output = io.BytesIO()
+    shards.merge_table(manifest, "people", shard_dir, output)
+    assert output.getvalue().decode("utf-8") == reference_csv
+
+def test_missing_and_corrupt_shards_are_not_merged(reference_spec, tmp_path):
+    generate_spec = spec([reference_spec], seed=reference.SEED)
+    manifest = shards.make_manifest(generate_spec, 10000)
+    shard_dir = str(tmp_path)
+    for _ in shards.work(manifest, shard_dir,
+            ["people-000000", "people-000001"]):
+        pass
+
+    with pytest.raises(exceptions.ShardError, match="not done"):
+        shards.merge_table(manifest, "people", shard_dir, io.BytesIO())
+
+    for _ in shards.work(manifest, shard_dir, ["people-000002"]):
+        pass
+    shard_path = os.path.join(shard_dir, "people-000001.csv")
+    with open(shard_path, "r+b") as shard_file:
+        shard_file.write(b"X")
+    with pytest.raises(exceptions.ShardError, match="checksum"):
+        shards.merge_table(manifest, "people", shard_dir, io.BytesIO())
+
+def quoted_table(name, num_records, **settings):
+    """A table whose values need quoting, some of them over several lines."""
+
+    return table(name, num_records, [
+        id_field(),
+        field("forename", "forename"),
+        derived("note", 'forename + ",\\n\\"" + str(len(forename)) + "\\n"'),
+        field("nothing", "null")
+    ], **settings)
+
+@pytest.fixture(scope="module")
+def generate_spec():
+    generate_spec = spec([
+        mixed_table("people", 25000),
+        mixed_table("parts", 25000, maxRowsPerFile=10000),
+        mixed_table("sized", 25000, maxBytesPerFile=500000),
+        quoted_table("quoted", 25000, maxRowsPerFile=6000)
+    ], seed=SEED)
+    check(generate_spec)
+    return generate_spec
+
+@pytest.fixture(scope="module")
+def manifest(generate_spec):
+    return shards.make_manifest(generate_spec, SHARD_RECORDS)
+
+@pytest.fixture(scope="module")
+def shard_dir(manifest, tmp_path_factory):
+    shard_dir = str(tmp_path_factory.mktemp("shards"))
+    for _ in shards.work(manifest, shard_dir):
+        pass
+    return shard_dir
+
+def read_files(directory):
+    files = {}
+    for (dir_path, _, names) in os.walk(directory):
+        for name in names:
+            path = os.path.join(dir_path, name)
+            with open(path, "rb") as output_file:
+                name = os.path.relpath(path, directory).replace(os.sep, "/")
+                files[name] = output_file.read()
+    return files
+
+def test_merged_directories_match_single_runs(cli, generate_spec, manifest,
+        shard_dir, tmp_path):
+    spec_path = str(tmp_path / "spec.json")
+    with open(spec_path, "w") as spec_file:
+        json.dump(generate_spec, spec_file)
+    single = str(tmp_path / "single")
+    cli.main(["generate", spec_path, "-o", single, "-j", "1"])
+
+    merged = str(tmp_path / "merged")
+    shards.merge(manifest, shard_dir, merged)
+
+    merged_files = read_files(merged)
+    assert merged_files == read_files(single)
+    assert "people.csv" in merged_files
+    assert "parts/part-00002.csv" in merged_files
+    assert "sized/_manifest.json" in merged_files
+    assert "quoted/part-00004.csv" in merged_files
+
+def test_merged_zips_match_single_runs(generate_spec, manifest, shard_dir,
+        tmp_path):
+    with generate.toMultiCSV(generate.generate_tables(
+            generate_spec["tables"], seed=SEED)) as single_file:
+        single = zipfile.ZipFile(io.BytesIO(single_file.read()))
+
+    merged_path = str(tmp_path / "merged.zip")
+    shards.merge(manifest, shard_dir, merged_path)
+    merged = zipfile.ZipFile(merged_path)
+
+    assert sorted(merged.namelist()) == sorted(single.namelist())
+    for name in single.namelist():
+        assert merged.read(name) == single.read(name), name
+
+def test_merged_parts_are_summarised(manifest, shard_dir):
+    parts = []
+    def open_part(number):
+        parts.append(io.BytesIO())
+        parts[-1].close = lambda: None # Keep it readable
+        return parts[-1]
+
+    part_manifest = json.loads(shards.merge_table_parts(
+        manifest, "quoted", shard_dir, open_part))
+    assert part_manifest["fields"] == ["id", "forename", "note", "nothing"]
+    assert part_manifest["rows"] == 25000
+    assert [part["rows"] for part in part_manifest["parts"]] == \
+        [6000, 6000, 6000, 6000, 1000]
+    assert [part["bytes"] for part in part_manifest["parts"]] == \
+        [len(part.getvalue()) for part in parts]
+
+def test_sorted_tables_are_not_split():
+    generate_spec = spec([mixed_table("sorted", 100, orderBy=["surname"])],
+        seed=SEED)
+    with pytest.raises(exceptions.ShardError):
+        shards.make_manifest(generate_spec, 10)
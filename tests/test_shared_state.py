@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from components import admission, jobs, exceptions
+
+def shared_controller(directory, **budgets):
+    return admission.SharedAdmissionController(
+        str(directory), 2, 0, 0.2, **budgets)
+
+def test_admission_is_shared_between_controllers(tmp_path):
+    # Two controllers using the same directory, as two workers would
+    first = shared_controller(tmp_path, max_rows_per_client=100)
+    second = shared_controller(tmp_path, max_rows_per_client=100)
+
+    first.acquire("a", 60)
+    with pytest.raises(exceptions.OverloadedError):
+        second.acquire("a", 60) # Over the client's budget
+    second.acquire("b", 60)
+    with pytest.raises(exceptions.OverloadedError):
+        first.acquire("c", 1) # No more slots
+
+    first.release("a", 60)
+    second.acquire("a", 60)
+
+def test_slots_of_exited_processes_are_given_back(tmp_path):
+    controller = shared_controller(tmp_path)
+
+    pid = os.fork()
+    if pid == 0:
+        controller.acquire("a", 1)
+        controller.acquire("a", 1)
+        os._exit(0) # Without releasing them
+    os.waitpid(pid, 0)
+
+    controller.acquire("a", 1)
+    controller.acquire("a", 1)
+
+def test_jobs_are_shared_between_registries(tmp_path):
+    running = jobs.SharedJobRegistry(str(tmp_path), 60)
+    other = jobs.SharedJobRegistry(str(tmp_path), 60)
+
+    job = running.create("job-1")
+    with pytest.raises(KeyError):
+        other.create("job-1")
+
+    job.start([{"name": "people", "settings": {"numRecords": 10}}])
+    job.generated("people", 10)
+    job.encoding()
+
+    published = other.get("job-1")
+    assert published.snapshot()["stage"] == "encoding"
+    assert published.snapshot()["rows"] == 10
+    assert not published.wait(0)
+    assert other.get("job-2") is None
+
+    # Cancelling it elsewhere cancels the generation
+    published.cancel()
+    with pytest.raises(exceptions.CancelledError):
+        job.cancellation.check()
+
+    job.finish(499)
+    assert published.wait(1)
+    assert published.snapshot()["stage"] == "cancelled"
+
+def test_jobs_of_exited_processes_fail(tmp_path):
+    registry = jobs.SharedJobRegistry(str(tmp_path), 60)
+
+    pid = os.fork()
+    if pid == 0:
+        registry.create("orphan")
+        os._exit(0) # Without finishing it
+    os.waitpid(pid, 0)
+
+    job = registry.get("orphan")
+    assert job.finished is not None
+    assert job.snapshot()["stage"] == "failed"
@@ -0,0 +1,108 @@
+import os
+import random
+
+import pytest
+
+from components import sorting, generators, generate
+
+from specs import mixed_table, spec, check
+
+class Records:
+    """Records that can be read in chunks, as a storage.ColumnStore can."""
+
+    def __init__(self, records, chunk_records=7):
+        self.records = records
+        self.chunk_records = chunk_records
+
+    def chunks(self):
+        for start in range(0, len(self.records), self.chunk_records):
+            yield [list(column) for column in
+                zip(*self.records[start:start + self.chunk_records])]
+
+    def __len__(self):
+        return len(self.records)
+
+def shuffled_records(num_records, seed=0):
+    # (key, position) records, with many equal keys, so that whether equal
+    # keys keep their order can be seen
+    rng = random.Random(seed)
+    return [(rng.randrange(20), position) for position in range(num_records)]
+
+def sort(records, key_indexes=(0,), dictionaries=None, **kwargs):
+    if dictionaries is None:
+        dictionaries = [None] * len(records[0])
+    return sorting.SortedRecords(
+        Records(records), list(key_indexes), dictionaries, **kwargs)
+
+@pytest.mark.parametrize("run_records,fan_in", [
+    (1000, 16), # One run, sorted in memory
+    (100, 16), # Runs merged as they are read
+    (10, 3), # Runs merged in several passes
+    (1, 2) # As many runs and passes as possible
+])
+def test_sorts_stably(tmp_path, run_records, fan_in):
+    records = shuffled_records(500)
+    sorted_records = sort(records, temp_dir=str(tmp_path),
+        run_records=run_records, fan_in=fan_in)
+
+    assert list(sorted_records) == sorted(records, key=lambda r: r[0])
+    # Runs are gathered from whole chunks, so may be a little longer
+    if run_records >= len(records):
+        assert (sorted_records.runs, sorted_records.merge_passes) == (1, 0)
+    elif sorted_records.runs <= fan_in:
+        assert sorted_records.merge_passes == 1
+    else:
+        assert sorted_records.merge_passes > 1
+
+    # Its runs are removed once it is read
+    assert os.listdir(str(tmp_path)) == []
+
+def test_sorts_by_several_fields(tmp_path):
+    records = [(key % 3, (key * 7 + position) % 4, position)
+        for (key, position) in shuffled_records(200)]
+
+    sorted_records = sort(records, (1, 0), temp_dir=str(tmp_path),
+        run_records=17, fan_in=2)
+    assert list(sorted_records) == sorted(records, key=lambda r: (r[1], r[0]))
+
+def test_sorts_mixed_types_with_nulls_last(tmp_path):
+    records = [(value, position) for (position, value) in enumerate(
+        [None, "b", 3, 1.5, "a", None, -2, "10", 3])]
+
+    values = [record[0] for record in
+        sort(records, temp_dir=str(tmp_path), run_records=2, fan_in=2)]
+    assert values == [-2, 1.5, 3, 3, "10", "a", "b", None, None]
+
+def test_sorts_dictionary_encoded_fields_by_value(tmp_path):
+    dictionary = generators.Dictionary(["pear", "apple", "fig"])
+    codes = [(code, position)
+        for (position, code) in enumerate([0, 1, 2, 0, 2, 1, 1])]
+
+    sorted_records = sort(codes, dictionaries=[dictionary, None],
+        temp_dir=str(tmp_path), run_records=3, fan_in=2)
+    assert list(sorted_records) == [
+        ("apple", 1), ("apple", 5), ("apple", 6),
+        ("fig", 2), ("fig", 4),
+        ("pear", 0), ("pear", 3)]
+
+@pytest.mark.parametrize("start", [0, 1, 250, 499, 500])
+def test_skips_the_first_records(tmp_path, start):
+    records = shuffled_records(500)
+    sorted_records = sort(records, temp_dir=str(tmp_path),
+        run_records=30, fan_in=4, start=start)
+
+    assert len(sorted_records) == 500 - start
+    assert list(sorted_records) == sorted(records, key=lambda r: r[0])[start:]
+
+def test_generated_tables_are_sorted_stably():
+    generate_spec = spec([
+        mixed_table("people", 3000, orderBy=["group", "surname"])
+    ], seed=4)
+    check(generate_spec)
+
+    records = list(generate.generate_tables(
+        generate_spec["tables"], seed=4)["people"]["records"])
+    assert len(records) == 3000
+    # (group, surname, id), as records with equal keys keep their id order
+    keys = [(record[4], record[2], record[0]) for record in records]
+    assert keys == sorted(keys)
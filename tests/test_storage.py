@@ -0,0 +1,27 @@
+import os
+
+from components import storage
+
+from reference import csv_of, generate_people
+
+def test_spilled_tables(reference_spec, reference_csv, tmp_path):
+    budget = storage.MemoryBudget(1024, str(tmp_path))
+    try:
+        table_gen = generate_people(reference_spec, budget=budget)
+        assert budget.used <= budget.limit
+        assert len(os.listdir(str(tmp_path))) == 1 # The budget's directory
+        assert csv_of(table_gen) == reference_csv
+    finally:
+        budget.close()
+    assert os.listdir(str(tmp_path)) == []
+
+def test_tables_within_the_budget_are_not_spilled(reference_spec,
+        reference_csv, tmp_path):
+    budget = storage.MemoryBudget(1024 ** 3, str(tmp_path))
+    try:
+        table_gen = generate_people(reference_spec, budget=budget)
+        assert 0 < budget.used <= budget.limit
+        assert os.listdir(str(tmp_path)) == []
+        assert csv_of(table_gen) == reference_csv
+    finally:
+        budget.close()
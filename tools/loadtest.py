@@ -0,0 +1,433 @@
+"""
+Load test the app's HTTP API.
+
+Starts the app locally (or targets one that is already running), then replays
+a weighted mix of requests - generate specs, schema fetches and resource
+lookups - at a given concurrency and (optionally) arrival rate. Reports the
+latency percentiles, throughput and errors of each kind of request, and the
+server's memory (RSS) over time.
+
+Only uses the standard library, so it runs offline, on one Linux box (RSS is
+read from /proc). Run from the repository root, eg.
+  python ./tools/loadtest.py --concurrency 4 --duration 60
+  python ./tools/loadtest.py --server gunicorn --rate 2 --duration 120
+  python ./tools/loadtest.py --url http://localhost:5000 --spec my-spec.json:3
+"""
+
+# General
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import signal
+import argparse
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from queue import Queue, Empty
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SPECS = ["small:6", "orders:2", "people:1"]
+SPECS_DIR = os.path.join(ROOT, "tools", "loadtest-specs")
+
+# Requests
+# --------------------------------------------------
+
+class Request:
+    """A request to replay, with the name it is reported under."""
+
+    def __init__(self, name, method, path, body=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.body = body
+
+def load_requests(spec_args, schema_weight, resource_weight):
+    """
+    Return a list of (Request, weight) tuples for the given '--spec' arguments
+    and weights of the other kinds of request.
+
+    Each spec argument is a path to a generate spec JSON file (or the name of
+    one of the bundled specs), optionally followed by ':<weight>'.
+    """
+
+    requests = []
+    for spec_arg in spec_args:
+        (path, _, weight) = spec_arg.partition(":")
+        if not os.path.exists(path):
+            path = os.path.join(SPECS_DIR, path+".json")
+        with open(path, encoding="utf-8") as spec_file:
+            body = spec_file.read().encode("utf-8")
+
+        name = "generate:"+os.path.splitext(os.path.basename(path))[0]
+        requests.append((
+            Request(name, "POST", "/data-api/1.0.0/generate", body),
+            float(weight) if weight != "" else 1.0))
+
+    if schema_weight > 0:
+        requests.append((
+            Request("schema", "GET", "/schemas-api/1.0.0/generate"),
+            schema_weight))
+    if resource_weight > 0:
+        requests.append((
+            Request("resource", "GET", "/resource-api/1.0.0/resource"+
+                "?resourceType=image&resource=object-types/table.png"),
+            resource_weight))
+
+    return requests
+
+def send(base_url, request, timeout):
+    """
+    Send the given request and read the whole response, returning a tuple of
+    (status, response size in bytes). The status is None if the request failed
+    without a response.
+    """
+
+    http_request = urllib.request.Request(base_url + request.path,
+        data=request.body, method=request.method,
+        headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(http_request, timeout=timeout) as response:
+            return (response.status, len(response.read()))
+    except urllib.error.HTTPError as err:
+        return (err.code, len(err.read()))
+    except (urllib.error.URLError, OSError):
+        return (None, 0)
+
+# Server
+# --------------------------------------------------
+
+def gunicorn_path():
+    """
+    Return the path of the gunicorn script, preferring the one installed with
+    this Python (eg. in the same environment), or None if there is none.
+
+    gunicorn must be run by its script, as older versions (including the
+    pinned one) cannot be run with 'python -m gunicorn'.
+    """
+
+    local = os.path.join(os.path.dirname(sys.executable), "gunicorn")
+    if os.access(local, os.X_OK):
+        return local
+    return shutil.which("gunicorn")
+
+def start_server(kind, port):
+    """Start the app (on the dev server or gunicorn), returning its Popen."""
+
+    env = dict(os.environ, DATASET_GENERATOR_PORT=str(port),
+        DATASET_GENERATOR_BIND="127.0.0.1:"+str(port))
+    if kind == "dev":
+        command = [sys.executable, os.path.join(ROOT, "dataset-generator.py")]
+    else:
+        gunicorn = gunicorn_path()
+        if gunicorn is None:
+            sys.exit("gunicorn is not installed (install it, or use "+
+                "--server dev)")
+        command = [gunicorn,
+            "-c", os.path.join(ROOT, "gunicorn.conf.py"), "wsgi:app"]
+
+    return subprocess.Popen(command, cwd=ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True) # So it (and its workers) can be stopped
+
+def wait_until_ready(base_url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        (status, _) = send(base_url,
+            Request("ready", "GET", "/schemas-api/1.0.0/generate"), timeout=1)
+        if status == 200:
+            return True
+        time.sleep(0.2)
+    return False
+
+def stop_server(server):
+    os.killpg(server.pid, signal.SIGTERM)
+    try:
+        server.wait(10)
+    except subprocess.TimeoutExpired:
+        os.killpg(server.pid, signal.SIGKILL)
+        server.wait()
+
+def _process_tree(pid):
+    pids = [pid]
+    for (dir_path, _, file_names) in os.walk("/proc/"+str(pid)+"/task"):
+        if "children" in file_names:
+            with open(os.path.join(dir_path, "children")) as children_file:
+                for child in children_file.read().split():
+                    pids.extend(_process_tree(int(child)))
+    return pids
+
+def rss_bytes(pid):
+    """
+    Return the total resident memory of the given process and all of its
+    descendants (eg. server workers), or None if it cannot be read.
+    """
+
+    total = 0
+    try:
+        for tree_pid in _process_tree(pid):
+            with open("/proc/"+str(tree_pid)+"/status") as status_file:
+                for line in status_file:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+    except (FileNotFoundError, ProcessLookupError):
+        pass # Exited while being measured
+    return total if total > 0 else None
+
+# Load
+# --------------------------------------------------
+
+class Results:
+    """The outcomes of requests, collected from many threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.bytes = defaultdict(int)
+        self.rss = [] # (seconds since start, bytes)
+
+    def record(self, name, status, latency, num_bytes):
+        with self.lock:
+            self.statuses[name][status] += 1
+            self.bytes[name] += num_bytes
+            if status is not None and status < 400:
+                self.latencies[name].append(latency)
+
+def run_load(base_url, requests, args, results, server_pid):
+    """
+    Replay requests until the duration is up (or the number of requests is
+    reached), returning how long that took.
+
+    With a rate, requests arrive at random (as a Poisson process) at that many
+    per second, and are sent by up to concurrency threads at once. Latency is
+    measured from when each request arrived, so it includes any time spent
+    waiting for a free thread. Without a rate, each thread sends its next
+    request as soon as the last one finishes.
+    """
+
+    rng = random.Random(args.seed)
+    (kinds, weights) = zip(*requests)
+
+    start = time.monotonic()
+    stop = start + args.duration
+    pending = Queue(maxsize=0 if args.rate > 0 else args.concurrency)
+    done = threading.Event()
+
+    def worker():
+        while True:
+            try:
+                (request, arrived) = pending.get(timeout=0.1)
+            except Empty:
+                if done.is_set():
+                    return
+                continue
+            if arrived is None:
+                arrived = time.monotonic()
+
+            (status, num_bytes) = send(base_url, request, args.timeout)
+            results.record(request.name, status,
+                time.monotonic() - arrived, num_bytes)
+
+    def sample_rss():
+        while not done.wait(args.rss_interval):
+            rss = rss_bytes(server_pid) if server_pid is not None else None
+            if rss is not None:
+                results.rss.append((time.monotonic() - start, rss))
+
+    threads = [threading.Thread(target=worker, daemon=True)
+        for _ in range(args.concurrency)]
+    threads.append(threading.Thread(target=sample_rss, daemon=True))
+    for thread in threads:
+        thread.start()
+
+    # Dispatch requests
+    next_arrival = start
+    num_sent = 0
+    while (
+        time.monotonic() < stop and
+        (args.requests == 0 or num_sent < args.requests)
+    ):
+        request = rng.choices(kinds, weights)[0]
+        if args.rate > 0:
+            next_arrival += rng.expovariate(args.rate)
+            time.sleep(max(next_arrival - time.monotonic(), 0))
+            pending.put((request, next_arrival))
+        else:
+            pending.put((request, None)) # Blocks until a thread is free
+        num_sent += 1
+
+    # Let requests in flight finish, but do not start any more
+    while not pending.empty():
+        try:
+            pending.get_nowait()
+        except Empty:
+            break
+    done.set()
+    for thread in threads:
+        thread.join()
+
+    return time.monotonic() - start
+
+# Reporting
+# --------------------------------------------------
+
+def percentile(sorted_values, fraction):
+    """Return the given percentile (as a fraction) by the nearest-rank method."""
+
+    if len(sorted_values) == 0:
+        return None
+    rank = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def report(results, elapsed):
+    """Return the results as a JSON-serialisable dict."""
+
+    kinds = {}
+    for name in sorted(results.statuses):
+        latencies = sorted(results.latencies[name])
+        statuses = results.statuses[name]
+        total = sum(statuses.values())
+        errors = sum(count
+            for (status, count) in statuses.items()
+            if status is None or status >= 400)
+
+        kinds[name] = {
+            "requests": total,
+            "errors": errors,
+            "errorRate": errors / total if total > 0 else 0,
+            "statuses": {str(status): count
+                for (status, count) in sorted(statuses.items(),
+                    key=lambda item: str(item[0]))},
+            "throughput": len(latencies) / elapsed,
+            "bytes": results.bytes[name],
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else None
+        }
+
+    return {
+        "seconds": elapsed,
+        "requests": kinds,
+        "rss": [{"seconds": seconds, "bytes": rss}
+            for (seconds, rss) in results.rss]
+    }
+
+def _ms(seconds):
+    return "-" if seconds is None else "{:.0f}".format(seconds * 1000)
+
+def print_report(summary, file=sys.stdout):
+    print("Ran for {:.1f}s".format(summary["seconds"]), file=file)
+    print(file=file)
+
+    row = "{:<24} {:>8} {:>7} {:>8} {:>8} {:>8} {:>8} {:>8}  {}"
+    print(row.format("request", "count", "err %", "req/s",
+        "p50 ms", "p95 ms", "p99 ms", "max ms", "statuses"), file=file)
+    for (name, kind) in summary["requests"].items():
+        print(row.format(name, kind["requests"],
+            "{:.1f}".format(kind["errorRate"] * 100),
+            "{:.2f}".format(kind["throughput"]),
+            _ms(kind["p50"]), _ms(kind["p95"]), _ms(kind["p99"]),
+            _ms(kind["max"]),
+            " ".join(status+":"+str(count)
+                for (status, count) in kind["statuses"].items())), file=file)
+
+    rss = summary["rss"]
+    if len(rss) > 0:
+        print(file=file)
+        print("Server RSS (MB): start {:.0f}, peak {:.0f}, end {:.0f}".format(
+            rss[0]["bytes"] / 2**20,
+            max(sample["bytes"] for sample in rss) / 2**20,
+            rss[-1]["bytes"] / 2**20), file=file)
+
+        # Around 10 evenly spaced samples, to show any growth over time
+        step = max(len(rss) // 10, 1)
+        print("  " + "  ".join(
+            "{:.0f}s:{:.0f}".format(sample["seconds"], sample["bytes"] / 2**20)
+            for sample in rss[::step]), file=file)
+
+# Command Line
+# --------------------------------------------------
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Load test the app's HTTP API with a mix of requests.")
+
+    parser.add_argument("--server", choices=["dev", "gunicorn"], default="dev",
+        help="which server to start the app on (default: dev)")
+    parser.add_argument("--port", type=int, default=5050,
+        help="port to start the app on (default: 5050)")
+    parser.add_argument("--url",
+        help="URL of an already running app to test, instead of starting one "+
+            "(its RSS is not reported unless --pid is given)")
+    parser.add_argument("--pid", type=int,
+        help="PID of the already running app, to report its RSS")
+
+    parser.add_argument("--spec", action="append",
+        help="generate spec to replay, as a path (or the name of a spec in "+
+            "tools/loadtest-specs), optionally followed by ':<weight>'. May "+
+            "be repeated. (default: "+" ".join(DEFAULT_SPECS)+")")
+    parser.add_argument("--schema-weight", type=float, default=2,
+        help="weight of schema requests in the mix (default: 2)")
+    parser.add_argument("--resource-weight", type=float, default=2,
+        help="weight of resource requests in the mix (default: 2)")
+
+    parser.add_argument("-c", "--concurrency", type=int, default=4,
+        help="how many requests may be in flight at once (default: 4)")
+    parser.add_argument("-r", "--rate", type=float, default=0,
+        help="mean arrival rate, in requests per second. If 0, each thread "+
+            "sends requests back to back. (default: 0)")
+    parser.add_argument("-d", "--duration", type=float, default=30,
+        help="how long to send requests for, in seconds (default: 30)")
+    parser.add_argument("-n", "--requests", type=int, default=0,
+        help="stop after sending this many requests (default: no limit)")
+    parser.add_argument("--timeout", type=float, default=300,
+        help="timeout of each request, in seconds (default: 300)")
+    parser.add_argument("--seed", type=int, default=0,
+        help="seed for the mix and arrival times (default: 0)")
+    parser.add_argument("--rss-interval", type=float, default=1,
+        help="how often to sample the server's RSS, in seconds (default: 1)")
+    parser.add_argument("--json",
+        help="also write the full results (including every RSS sample) to "+
+            "this JSON file")
+
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parse_args(argv)
+    requests = load_requests(args.spec or DEFAULT_SPECS,
+        args.schema_weight, args.resource_weight)
+
+    server = None
+    server_pid = args.pid
+    base_url = args.url
+    if base_url is None:
+        server = start_server(args.server, args.port)
+        server_pid = server.pid
+        base_url = "http://127.0.0.1:"+str(args.port)
+    base_url = base_url.rstrip("/")
+
+    try:
+        if not wait_until_ready(base_url, timeout=60):
+            sys.exit("app did not start at "+base_url)
+
+        results = Results()
+        elapsed = run_load(base_url, requests, args, results, server_pid)
+
+    finally:
+        if server is not None:
+            stop_server(server)
+
+    summary = report(results, elapsed)
+    print_report(summary)
+    if args.json is not None:
+        with open(args.json, "w", encoding="utf-8") as json_file:
+            json.dump(summary, json_file, indent=2)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,14 @@
+# WSGI entry point, for production servers, eg.
+#   gunicorn -c gunicorn.conf.py wsgi:app
+
+# General
+import os
+import importlib
+
+# Schemas and data files are located relative to the webroot, which is this
+# file's directory
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+# The app's module name is not a valid identifier, so must be imported by name
+dataset_generator = importlib.import_module("dataset-generator")
+app = dataset_generator.app